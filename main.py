@@ -1,46 +1,162 @@
-import os
-import subprocess
-
-# Define script paths
-PREPROCESS_SCRIPT = "utils/preprocess.py"
-OCR_SCRIPT = "utils/ocr_utils.py"
-IMAGE_UTILS_SCRIPT = "utils/image_utils.py"
-PARSER_SCRIPT = "utils/parser.py"
-VALIDATOR_SCRIPT = "utils/validator.py"
-EXCEL_SCRIPT = "utils/convert_to_excel.py"
-
-def run_script(script_path):
-    """Executes a Python script as a subprocess and captures the output."""
-    if os.path.exists(script_path):
-        print(f"Running {script_path}...")
-        result = subprocess.run(["python", script_path], capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print(f"Error in {script_path}: {result.stderr}")
-    else:
-        print(f"Script {script_path} not found!")
+import argparse
+from functools import partial
+
+from utils.cache import CACHE_FOLDER, MAX_CACHE_BYTES, ContentCache
+from utils.dedup import DEDUP_INDEX_FILE, DedupIndex
+from utils.distributed import LEASE_SECONDS
+from utils.llm_cache import LLM_CACHE_FILE, LLMCache
+from utils.metrics import METRICS_FILE
+from utils.pipeline import STAGE_NAMES, run_pipeline, run_streaming
+from utils.result_store import STORE_FOLDER, ResultStore
+from utils.seal_manifest import SEAL_MANIFEST_FILE, SealManifest
+from utils.service import MAX_QUEUE_DEPTH, SERVICE_WORKERS
+
+def parse_args():
+    """Parses command line options for selecting pipeline stages."""
+    parser = argparse.ArgumentParser(description="Invoice processing pipeline")
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGE_NAMES),
+        help=f"Comma-separated stages to run (default: all). Available: {', '.join(STAGE_NAMES)}",
+    )
+    parser.add_argument("--input-dir", default="input", help="Folder containing invoice PDFs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for rendering/preprocessing and OCR (default: all cores)")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Do not keep page images in memory between streamed stages; later stages re-read them from disk")
+    parser.add_argument("--keep-images", action="store_true",
+                        help="Hold page images in memory between stages of a staged run instead of re-reading them "
+                             "from disk (faster, but memory grows with the number of pages)")
+    parser.add_argument("--max-in-flight-pages", type=int, default=None,
+                        help="Pages being rendered or waiting for the next stage at once (default: 2 tasks per worker)")
+    parser.add_argument("--save-debug-images", action="store_true",
+                        help="Write preprocessed pages to output/images/processed")
+    parser.add_argument("--filter-chain", default=None,
+                        help="Comma-separated preprocessing filters, e.g. sharpen,denoise,threshold,morph_open")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every stage instead of reusing cached results")
+    parser.add_argument("--cache-dir", default=CACHE_FOLDER, help="Folder for cached stage results")
+    parser.add_argument("--cache-max-mb", type=int, default=MAX_CACHE_BYTES // 1024 ** 2,
+                        help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--seal-batch-size", type=int, default=None, help="Pages per YOLO predict call (default: 8)")
+    parser.add_argument("--seal-imgsz", type=int, default=None, help="YOLO input resolution (default: 640)")
+    parser.add_argument("--seal-region", choices=["full", "bottom"], default=None,
+                        help="Search the whole page or only the footer area for seals (default: full)")
+    parser.add_argument("--seal-manifest", default=SEAL_MANIFEST_FILE,
+                        help="SQLite file recording every page's seal/signature detections")
+    parser.add_argument("--no-seal-crops", action="store_true",
+                        help="Do not write detected seals/signatures to output/seal_signatures")
+    parser.add_argument("--llm-cache", default=LLM_CACHE_FILE, help="SQLite file caching LLM responses")
+    parser.add_argument("--llm-concurrency", type=int, default=None,
+                        help="Concurrent LLM calls while parsing (default: LLM_CONCURRENCY env or 4)")
+    parser.add_argument("--fake-llm", action="store_true",
+                        help="Parse with an offline fake chat model instead of Groq (for testing)")
+    parser.add_argument("--no-text-layer", action="store_true",
+                        help="Render and OCR every page, even pages of PDFs with an embedded text layer")
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="Send every field to the LLM instead of taking confidently matched fields from the rule-based extractor")
+    parser.add_argument("--dedup-index", default=DEDUP_INDEX_FILE,
+                        help="SQLite index of seen PDFs and invoices, used to skip re-sent duplicates")
+    parser.add_argument("--no-dedup", action="store_true", help="Process every PDF and invoice, even duplicates")
+    parser.add_argument("--results-dir", default=STORE_FOLDER,
+                        help="Folder of the append-only JSONL store receiving parsed invoices")
+    parser.add_argument("--export-formats", default=None,
+                        help="Comma-separated line-item exports: xlsx, csv, parquet (default: xlsx)")
+    parser.add_argument("--full-export", action="store_true",
+                        help="Regenerate extracted_data.json and every export from the whole result store, "
+                             "instead of exporting only invoices stored since the last export to output/updates")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="JSON file receiving timings, counters and peak memory")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics at http://localhost:PORT/metrics while running")
+    parser.add_argument("--profile", default=None,
+                        help="Comma-separated stages to run under cProfile, or 'all' (profiles go to output/profiles)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream each PDF through all stages as it is ready (ignores --stages)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and stream new PDFs as they land in the input folder")
+    parser.add_argument("--serve", type=int, default=None, metavar="PORT",
+                        help="Run as an HTTP service accepting PDFs at POST /jobs (see utils/service.py)")
+    parser.add_argument("--service-workers", type=int, default=SERVICE_WORKERS,
+                        help="Warm worker processes of the HTTP service")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE_DEPTH,
+                        help="Jobs queued or running before the HTTP service answers 429")
+    parser.add_argument("--shared-dir", default=None,
+                        help="Run as one node of a distributed batch over this shared folder (see utils/distributed.py)")
+    parser.add_argument("--node-id", default=None, help="Name of this node in leases and shards (default: host-PID)")
+    parser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS,
+                        help="How long a node's claim on a PDF lasts without renewal before others may take it over")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="Combine the node shards of --shared-dir into one result store, report and export")
+    args = parser.parse_args()
+    if args.merge_shards and args.shared_dir is None:
+        parser.error("--merge-shards needs --shared-dir")
+    return args
+
+def build_options(args):
+    """Opens the caches and stores and builds the LLM chain selected on the command line, as pipeline options."""
+    filter_chain = [name.strip() for name in args.filter_chain.split(",")] if args.filter_chain else None
+    export_formats = [name.strip() for name in args.export_formats.split(",")] if args.export_formats else None
+    profile_stages = None
+    if args.profile:
+        profile_stages = STAGE_NAMES if args.profile == "all" else [name.strip() for name in args.profile.split(",")]
+
+    cache = None if args.no_cache else ContentCache(args.cache_dir, args.cache_max_mb * 1024 ** 2)
+    llm_cache = None if args.no_cache else LLMCache(args.llm_cache)
+
+    llm_chain = None
+    if args.fake_llm:
+        from utils.fake_llm import FakeInvoiceChatModel
+        from utils.parser import build_chain
+        llm_chain = build_chain(FakeInvoiceChatModel())
+
+    # A staged run holds every page between stages, so images go to disk unless --keep-images;
+    # streamed PDFs only hold the pages in flight
+    staged = not (args.stream or args.watch or args.serve is not None or args.shared_dir is not None)
+    keep_images = args.keep_images if staged else not args.low_memory
+
+    return dict(workers=args.workers, keep_images=keep_images, max_in_flight_pages=args.max_in_flight_pages,
+                save_debug_images=args.save_debug_images,
+                filter_chain=filter_chain, cache=cache, llm_cache=llm_cache, seal_batch_size=args.seal_batch_size,
+                seal_image_size=args.seal_imgsz, seal_region=args.seal_region,
+                seal_manifest=SealManifest(args.seal_manifest), save_seal_crops=not args.no_seal_crops,
+                dedup=None if args.no_dedup else DedupIndex(args.dedup_index),
+                llm_concurrency=args.llm_concurrency, llm_chain=llm_chain, fast_path=not args.no_fast_path,
+                store=ResultStore(args.results_dir), export_formats=export_formats, full_export=args.full_export,
+                metrics_file=args.metrics_file, profile_stages=profile_stages, text_layer=not args.no_text_layer)
 
 def main():
     """Runs the full invoice processing pipeline."""
-    print("🔄 Starting Invoice Processing Pipeline...")
+    args = parse_args()
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
 
-    # Step 1: Preprocess Images
-    run_script(PREPROCESS_SCRIPT)
+    if args.serve is not None:
+        # Each service worker process builds its own options, see utils.service
+        from utils.service import serve
+        serve(args.serve, partial(build_options, args), workers=args.service_workers, max_queue=args.max_queue)
+        return
 
-    # Step 2: Perform OCR on Invoices
-    run_script(OCR_SCRIPT)
+    if args.metrics_port is not None:
+        from utils.metrics import serve
+        serve(args.metrics_port)
 
-    # Step 3: Handle Image Processing (Seal Detection, Cropping)
-    run_script(IMAGE_UTILS_SCRIPT)
+    if args.merge_shards:
+        from utils.distributed import merge_shards
+        export_formats = [name.strip() for name in args.export_formats.split(",")] if args.export_formats else None
+        merge_shards(args.shared_dir, export_formats=export_formats)
+        return
 
-    # Step 4: Parse Extracted Data into Structured Format
-    run_script(PARSER_SCRIPT)
+    print("🔄 Starting Invoice Processing Pipeline...")
+    options = build_options(args)
 
-    # Step 5: Validate Extracted Invoice Data
-    run_script(VALIDATOR_SCRIPT)
+    if args.shared_dir is not None:
+        from utils.distributed import run_node
+        run_node(args.shared_dir, node=args.node_id, lease_seconds=args.lease_seconds, **options)
+        return
 
-    # Step 6: Convert JSON to Excel Report
-    run_script(EXCEL_SCRIPT)
+    # Every stage runs in this process, so models and clients load once
+    # and pages are handed from stage to stage in memory.
+    if args.stream or args.watch:
+        run_streaming(args.input_dir, watch=args.watch, **options)
+    else:
+        run_pipeline(stages, input_dir=args.input_dir, **options)
 
     print("Invoice Processing Completed!")
 
@@ -0,0 +1,30 @@
+from utils.assembler import compact_text, group_pages
+from utils.document import Page
+
+
+def _pages(source, *texts):
+    return [Page(source, number, text=text) for number, text in enumerate(texts, start=1)]
+
+
+def test_pages_are_grouped_by_page_markers_invoice_numbers_and_totals():
+    pages = (_pages("markers.pdf", "TAX INVOICE\nPage 1 of 2", "Page 2 of 2\nGrand Total 100",
+                    "TAX INVOICE\nPage 1 of 1")
+             + _pages("numbers.pdf", "Invoice No: INV-001\nWHEEL 2", "Invoice No: INV-001\nTotal 10",
+                      "Invoice No: INV-002\nTotal 20")
+             + _pages("titles.pdf", "TAX INVOICE\nTotal 5", "Continued items", "TAX INVOICE\nTotal 7"))
+
+    documents = group_pages(list(reversed(pages)))  # Pages of a PDF are put back in page order
+
+    assert [(document.name, document.page_numbers) for document in documents] == [
+        ("titles.pdf_invoice_1", [1, 2]), ("titles.pdf_invoice_2", [3]),
+        ("numbers.pdf_invoice_1", [1, 2]), ("numbers.pdf_invoice_2", [3]),
+        ("markers.pdf_invoice_1", [1, 2]), ("markers.pdf_invoice_2", [3]),
+    ]
+
+
+def test_compact_text_drops_repeated_headers_footers_and_page_markers():
+    header = "ACME TRADERS\nGSTIN 27AAPFU0939F1ZV\nTAX INVOICE"
+    first, second = ("\n".join(f"{row} WHEEL 2 1000" for row in rows) for rows in (range(1, 11), range(11, 21)))
+    pages = _pages("a.pdf", f"{header}\nPage 1 of 2\n\n{first}\nThank you", f"{header}\nPage 2 of 2\n{second}\nThank you")
+
+    assert compact_text(pages) == f"{header}\n{first}\nThank you\n{second}"
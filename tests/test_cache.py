@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from utils import preprocess
+from utils.cache import ContentCache, make_key
+from utils.preprocess import iter_processed_pages
+
+
+def test_entries_are_hits_once_stored_and_counted_per_stage(tmp_path):
+    cache = ContentCache(str(tmp_path))
+    key = make_key("ocr", 1, "page")
+
+    assert cache.get_json("ocr", key) is None
+    cache.put_json("ocr", key, {"text": "INVOICE"})
+    assert cache.get_json("ocr", key) == {"text": "INVOICE"}
+    assert cache.get_image("seals", key, ".png") is None
+
+    assert cache.summary() == {"ocr": {"hits": 1, "misses": 1}, "seals": {"hits": 0, "misses": 1}}
+    assert make_key("ocr", 2, "page") != key  # A new CACHE_VERSION never reuses old entries
+
+
+def test_eviction_removes_the_least_recently_used_entries_first(tmp_path):
+    cache = ContentCache(str(tmp_path), max_bytes=2500)
+    for age, name in enumerate("abc"):
+        path = cache.put_bytes("parse", name * 8, ".json", b"x" * 1000)
+        os.utime(path, (1_000_000 + age, 1_000_000 + age))
+    cache.get_path("parse", "a" * 8, ".json")  # Used last, so "b" is now the oldest
+
+    assert cache.evict() == 1
+    assert [name for name in "abc" if cache.get_path("parse", name * 8, ".json", record=False)] == ["a", "c"]
+    assert cache.size() == 2000
+
+
+def test_unchanged_pdfs_are_not_rendered_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess, "ORIGINAL_FOLDER", str(tmp_path / "original"))
+    monkeypatch.setattr(preprocess, "PROCESSED_FOLDER", str(tmp_path / "processed"))
+    monkeypatch.setattr(preprocess, "get_page_count", lambda pdf_path: 3)
+    rendered = []
+
+    def convert_from_path(pdf_path, dpi, first_page, last_page, poppler_path):
+        rendered.extend(range(first_page, last_page + 1))
+        return [Image.new("RGB", (80, 110), "white") for _ in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(preprocess, "convert_from_path", convert_from_path)
+    pdf = tmp_path / "invoice.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    cache = ContentCache(str(tmp_path / "cache"))
+    options = dict(workers=1, filter_chain=["threshold"], cache=cache, text_layer=False)
+
+    first = list(iter_processed_pages([str(pdf)], **options))
+    second = list(iter_processed_pages([str(pdf)], **options))
+
+    assert rendered == [1, 2, 3]
+    assert [page.cache_key for page in second] == [page.cache_key for page in first]
+    assert np.array_equal(cache.get_image("rasterize", second[0].cache_key, ".png"), first[0].processed)
+
+    pdf.write_bytes(b"%PDF-1.5")  # Changed content, new key
+    list(iter_processed_pages([str(pdf)], **options))
+    assert rendered == [1, 2, 3, 1, 2, 3]
@@ -0,0 +1,49 @@
+import csv
+from functools import partial
+
+import pytest
+from openpyxl import load_workbook
+
+from utils import convert_to_excel
+from utils.convert_to_excel import EXCEL_MAX_ROWS, HEADERS, ExcelWriter, export_invoices
+
+
+def _invoices(count, items=2):
+    return [{"source_file": f"{number}.pdf", "pages": [1, 2], "invoice_number": f"INV-{number}",
+             "items": [{"serial_number": str(row), "description": "WHEEL", "quantity": "1,000", "total_amount": 5}
+                       for row in range(1, items + 1)]}
+            for number in range(count)]
+
+
+def test_rows_continue_on_a_new_sheet_once_a_sheet_is_full(tmp_path, monkeypatch):
+    assert EXCEL_MAX_ROWS == 1_048_576  # Excel's row limit, header included
+    monkeypatch.setitem(convert_to_excel.WRITERS, "xlsx", (partial(ExcelWriter, max_rows=4), None))
+
+    path = export_invoices(_invoices(4), paths={"xlsx": str(tmp_path / "out.xlsx")})["xlsx"]
+
+    workbook = load_workbook(path, read_only=True)
+    assert workbook.sheetnames == ["Invoices", "Invoices (2)", "Invoices (3)"]
+    sheets = [list(sheet.values) for sheet in workbook.worksheets]
+    assert [len(rows) for rows in sheets] == [4, 4, 3]  # 8 line items, 3 per sheet under a header
+    assert all(rows[0] == tuple(HEADERS) for rows in sheets)
+    assert sheets[2][-1][:3] == ("3.pdf", "1, 2", "INV-3")
+
+
+def test_every_format_gets_the_same_rows_in_one_pass(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    paths = export_invoices(_invoices(3), formats=["xlsx", "csv", "parquet"],
+                            paths={name: str(tmp_path / f"out.{name}") for name in ("xlsx", "csv", "parquet")})
+
+    with open(paths["csv"], encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == HEADERS and len(rows) == 7
+    table = pq.read_table(paths["parquet"])
+    assert table.num_rows == 6 and table.column("Quantity").to_pylist() == [1000.0] * 6
+    assert len(list(load_workbook(paths["xlsx"], read_only=True)["Invoices"].values)) == 7
+
+
+def test_an_empty_export_still_has_a_header(tmp_path):
+    path = export_invoices([], paths={"xlsx": str(tmp_path / "out.xlsx")})["xlsx"]
+    assert list(load_workbook(path, read_only=True)["Invoices"].values) == [tuple(HEADERS)]
@@ -0,0 +1,73 @@
+import sqlite3
+
+from utils import dedup
+from utils.dedup import MAX_CANDIDATES, DedupIndex, hash_bands
+
+LAYOUT = (1 << 200) - 1  # Thumbnail hash shared by every PDF of one supplier's layout
+
+
+def _index(path, count, monkeypatch):
+    clock = iter(range(1, count + 1))
+    monkeypatch.setattr(dedup.time, "time", lambda: float(next(clock)))
+    index = DedupIndex(str(path))
+    for number in range(count):
+        index.add_document(f"hash{number:03}", f"invoice{number:03}.pdf", [LAYOUT])
+    return index
+
+
+def test_similar_pdfs_are_the_most_recently_indexed(tmp_path, monkeypatch):
+    count = MAX_CANDIDATES * 3
+    index = _index(tmp_path / "dedup.sqlite", count, monkeypatch)
+    similar = index.find_similar([LAYOUT ^ 0b101])  # Two bits off, in one band only
+
+    assert sorted(similar) == [f"invoice{number:03}.pdf" for number in range(count - MAX_CANDIDATES, count)]
+    index.close()
+
+
+def test_bands_of_an_older_index_are_ordered_by_their_documents(tmp_path, monkeypatch):
+    path = tmp_path / "dedup.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE documents (pdf_hash TEXT PRIMARY KEY, source TEXT NOT NULL, "
+                 "page_hashes TEXT NOT NULL, first_seen REAL NOT NULL)")
+    conn.execute("CREATE TABLE page_bands (band INTEGER NOT NULL, value INTEGER NOT NULL, pdf_hash TEXT NOT NULL, "
+                 "PRIMARY KEY (band, value, pdf_hash)) WITHOUT ROWID")
+    for number in range(MAX_CANDIDATES + 4):
+        conn.execute("INSERT INTO documents VALUES (?, ?, ?, ?)",
+                     (f"hash{number:03}", f"invoice{number:03}.pdf", f'["{LAYOUT:x}"]', 100 - number))
+        conn.executemany("INSERT INTO page_bands VALUES (?, ?, ?)",
+                         [(band, value, f"hash{number:03}") for band, value in enumerate(hash_bands(LAYOUT))])
+    conn.commit()
+    conn.close()
+
+    index = DedupIndex(str(path))
+    assert sorted(index.find_similar([LAYOUT])) == [f"invoice{number:03}.pdf" for number in range(MAX_CANDIDATES)]
+    index.close()
+
+
+def test_copy_of_a_pdf_is_only_skipped_once_the_original_completed(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "thumbnail_hashes", lambda pdf_path: [LAYOUT])
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+
+    assert index.check_pdf("input/job1_invoice.pdf", "hash") == (None, None)
+    # The first upload failed before its invoices were stored: a re-submitted copy is processed
+    assert index.check_pdf("input/job2_invoice.pdf", "hash") == (None, None)
+    assert index.duplicates_of("job2_invoice.pdf") == []
+
+    index.complete_pdf("hash")
+    assert index.check_pdf("input/job3_invoice.pdf", "hash") == ("exact", "job2_invoice.pdf")
+    assert index.check_pdf("input/job2_invoice.pdf", "hash") == (None, None)  # A rerun of the original
+    index.close()
+
+
+def test_pdfs_of_an_older_index_count_as_completed(tmp_path):
+    path = tmp_path / "dedup.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE documents (pdf_hash TEXT PRIMARY KEY, source TEXT NOT NULL, "
+                 "page_hashes TEXT NOT NULL, first_seen REAL NOT NULL)")
+    conn.execute("INSERT INTO documents VALUES ('hash', 'a.pdf', '[]', 1.0)")
+    conn.commit()
+    conn.close()
+
+    index = DedupIndex(str(path))
+    assert index.check_pdf("input/b.pdf", "hash") == ("exact", "a.pdf")
+    index.close()
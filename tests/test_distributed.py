@@ -0,0 +1,83 @@
+import json
+import multiprocessing
+import os
+import time
+
+from utils.distributed import Lease, SharedBatch
+
+FILENAME = "invoice.pdf"
+
+
+def _expire(folder, attempt=1):
+    """Leaves the lease file of a node that crashed on `attempt`."""
+    with open(Lease.path_for(folder, FILENAME, attempt), "w", encoding="utf-8") as f:
+        json.dump({"node": "crashed", "token": "old", "attempt": attempt, "expires_at": time.time() - 1}, f)
+
+
+def _race(folder, barrier, results):
+    barrier.wait()
+    lease = Lease.acquire(folder, FILENAME, f"node-{os.getpid()}", seconds=60)
+    results.put(None if lease is None else (lease.attempt, lease.held()))
+
+
+def test_only_one_process_reclaims_an_expired_lease(tmp_path):
+    processes = 6
+    context = multiprocessing.get_context("fork")
+    for round_number in range(20):
+        folder = tmp_path / f"round-{round_number}"
+        folder.mkdir()
+        _expire(str(folder))
+
+        barrier, results = context.Barrier(processes), context.Queue()
+        workers = [context.Process(target=_race, args=(str(folder), barrier, results)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=30) for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        assert [outcome for outcome in outcomes if outcome is not None] == [(2, True)]
+        assert Lease.attempts(str(folder), FILENAME) == [1, 2]
+
+
+def test_stale_view_of_an_expired_lease_cannot_take_over_a_fresh_one(tmp_path):
+    folder = str(tmp_path)
+    _expire(folder)
+    winner = Lease.acquire(folder, FILENAME, "a", seconds=60)
+
+    # Another node read attempt 1 as expired before the winner's claim: it can only try attempt 2
+    late = Lease(folder, FILENAME, "b", seconds=60, attempt=2)
+    try:
+        os.open(late.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        raise AssertionError("the fresh lease was replaced")
+    except FileExistsError:
+        pass
+    assert Lease.acquire(folder, FILENAME, "b", seconds=60) is None
+    assert winner.held()
+
+
+def test_reclaimed_lease_is_lost_by_its_previous_holder(tmp_path):
+    folder = str(tmp_path)
+    first = Lease.acquire(folder, FILENAME, "a", seconds=0.01)
+    time.sleep(0.05)
+    second = Lease.acquire(folder, FILENAME, "b", seconds=60)
+
+    assert second.attempt == 2
+    assert not first.held() and not first.renew()
+    first.release()
+    assert second.held()
+
+    second.release()
+    assert Lease.attempts(folder, FILENAME) == []
+    assert Lease.acquire(folder, FILENAME, "c", seconds=60).attempt == 1
+
+
+def test_shared_batch_tracks_pending_and_done(tmp_path):
+    batch = SharedBatch(str(tmp_path))
+    for name in ("b.pdf", "a.pdf", "notes.txt"):
+        open(os.path.join(batch.input_dir, name), "wb").close()
+
+    assert batch.pending() == ["a.pdf", "b.pdf"]
+    batch.mark_done("a.pdf", "node-1", invoices=2)
+    assert batch.pending() == ["b.pdf"]
+    assert batch.done_records()["a.pdf"]["invoices"] == 2
@@ -0,0 +1,87 @@
+import pytest
+
+from utils.fast_extract import CONFIDENCE_THRESHOLD, extract_fields, extract_invoice_number, gstin_checksum_valid
+from utils.synthetic import gstin_check_digit
+
+SUPPLIER = "29AAHCS6672E1Z" + gstin_check_digit("29AAHCS6672E1Z")
+BUYER = "33ABCDE1234F1Z" + gstin_check_digit("33ABCDE1234F1Z")
+
+INVOICE = f"""TAX INVOICE
+Supplier: Speed Auto Parts
+GSTIN: {SUPPLIER}
+Invoice Number: INV-2024-001
+Invoice Date: 15/02/2024
+PO Number: 4500012345
+Bill To: Ramesh Motors
+GSTIN: {BUYER}
+Ship To: 12 Beach Road
+Pondicherry-605001
+S.No Description HSN Qty Rate Amount
+1 FRONT WHEEL 8714 2 1,000 2,000
+2 BRAKE PAD 8708 4 250.50 1,002
+Total 3,002
+"""
+
+
+@pytest.mark.parametrize("line, number", [
+    ("Invoice Number: INV-2024-001", "INV-2024-001"),
+    ("Invoice No. 123/45", "123/45"),
+    ("INVOICE NUM - 7781", "7781"),
+    ("Inv # A-9981", "A-9981"),
+    ("Bill No: 7781", "7781"),
+])
+def test_invoice_number_labels(line, number):
+    assert extract_invoice_number(line) == number
+
+
+@pytest.mark.parametrize("line, number", [
+    ("PO Number: 4500012345", "4500012345"),
+    ("P.O. No: 88-12", "88-12"),
+    ("PO#: 4411", "4411"),
+    ("Purchase Order 4500", "4500"),
+    ("Purchase Order No. 99812", "99812"),
+])
+def test_po_number_labels(line, number):
+    data, confidences = extract_fields(line)
+    assert data["po_number"] == number and confidences["po_number"] >= CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize("line", ["Pondicherry-605001", "Position No. 5", "Ship to: Pondicherry 605001", "Pono 123"])
+def test_words_starting_with_po_are_not_po_numbers(line):
+    data, _ = extract_fields(line)
+    assert data["po_number"] == ""  # Confidently none: the document has no PO label
+
+
+def test_po_label_without_a_usable_value_is_left_to_the_llm():
+    data, confidences = extract_fields("PO Number: see attached")
+    assert "po_number" not in data and confidences["po_number"] == 0.0
+
+
+def test_extract_fields_reads_a_labelled_invoice():
+    data, confidences = extract_fields(INVOICE)
+
+    assert gstin_checksum_valid(SUPPLIER) and gstin_checksum_valid(BUYER)
+    assert {field: data[field] for field in ("invoice_number", "invoice_date", "po_number",
+                                             "supplier_gst_number", "bill_to_gst_number", "shipping_address")} == {
+        "invoice_number": "INV-2024-001", "invoice_date": "15-02-2024", "po_number": "4500012345",
+        "supplier_gst_number": SUPPLIER, "bill_to_gst_number": BUYER,
+        "shipping_address": "12 Beach Road, Pondicherry-605001",
+    }
+    assert [(item["description"], item["hsn_sac"], item["quantity"], item["total_amount"]) for item in data["items"]] == [
+        ("FRONT WHEEL", "8714", 2, 2000), ("BRAKE PAD", "8708", 4, 1002)]
+    assert data["no_items"] == 2
+    assert all(confidence >= CONFIDENCE_THRESHOLD for confidence in confidences.values())
+
+
+def test_ocr_confusions_in_a_gstin_are_repaired():
+    garbled = SUPPLIER[:6] + "5" + SUPPLIER[7:]  # 5 for the S of the PAN
+    data, _ = extract_fields(f"Supplier GSTIN: {garbled}")
+    assert data["supplier_gst_number"] == SUPPLIER
+
+
+def test_shipping_address_without_a_label_stays_below_the_threshold():
+    data, confidences = extract_fields("Invoice No: 12345\nRamesh Motors, Pondicherry 605001")
+    assert data["shipping_address"] == "" and confidences["shipping_address"] < CONFIDENCE_THRESHOLD
+
+    data, confidences = extract_fields("Consignee: same as billing")
+    assert data["shipping_address"] == "" and confidences["shipping_address"] >= CONFIDENCE_THRESHOLD
@@ -0,0 +1,64 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from utils import llm_cache
+from utils.llm_cache import LLMCache, response_key
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Every call to time.time() in the cache is one second later than the last."""
+    ticks = itertools.count(1_000_000)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def test_a_stored_answer_is_returned_until_it_expires(tmp_path, monkeypatch):
+    cache = LLMCache(str(tmp_path / "llm.sqlite"), ttl_seconds=60)
+    key = response_key("model", "template", "invoice text")
+
+    assert cache.get(key) is None
+    cache.put(key, "model", '{"invoice_number": "INV-1"}', {"invoice_number": "INV-1"})
+
+    assert cache.get(key) == {"invoice_number": "INV-1"}
+    assert cache.get_raw(key) == '{"invoice_number": "INV-1"}'
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: 2_000_000.0))
+    assert cache.get(key) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 0.333, "entries": 0}
+
+
+def test_answers_survive_reopening_the_cache(tmp_path):
+    path = str(tmp_path / "llm.sqlite")
+    cache = LLMCache(path)
+    cache.put("key", "model", "raw", {"po_number": "PO-7"})
+    cache.close()
+
+    assert LLMCache(path).get("key") == {"po_number": "PO-7"}
+
+
+def test_least_recently_used_answers_are_evicted_every_few_puts(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite"), max_entries=3, evict_every=2)
+    for key in "abc":
+        cache.put(key, "model", "raw", {"key": key})
+    cache.get("a")  # "b" is now the least recently used
+
+    cache.put("d", "model", "raw", {"key": "d"})
+    assert len(cache) == 3  # The count is checked on every second put
+
+    cache.put("e", "model", "raw", {"key": "e"})
+    assert len(cache) == 4
+
+    cache.put("f", "model", "raw", {"key": "f"})
+    assert len(cache) == 3
+    assert [key for key in "abcdef" if cache.get_raw(key)] == ["d", "e", "f"]
+
+
+def test_opening_a_cache_trims_it_to_a_lower_limit(tmp_path):
+    path = str(tmp_path / "llm.sqlite")
+    cache = LLMCache(path)
+    for key in "abcd":
+        cache.put(key, "model", "raw", {"key": key})
+    cache.close()
+
+    assert len(LLMCache(path, max_entries=2)) == 2
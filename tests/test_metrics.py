@@ -0,0 +1,18 @@
+import pytest
+
+from utils import metrics
+
+
+def gauge(name):
+    return next(entry["value"] for entry in metrics.snapshot()["gauges"] if entry["name"] == name)
+
+
+def test_peak_rss_keeps_a_peak_that_ended_before_it_was_sampled():
+    pytest.importorskip("resource")
+    psutil = pytest.importorskip("psutil")
+    metrics.reset()
+
+    block = b"x" * (256 * 1024 ** 2)
+    del block
+
+    assert gauge("peak_rss_bytes") >= psutil.Process().memory_info().rss + 200 * 1024 ** 2
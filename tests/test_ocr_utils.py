@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import metrics, ocr_utils, preprocess
+from utils.document import Page
+
+
+@pytest.fixture
+def ocr(tmp_path, monkeypatch):
+    """OCR in this process with a fake Tesseract that cannot read pages filled with 255."""
+    def extract_words(image, preprocess=True):
+        if image.max() == 255:
+            raise RuntimeError("tesseract crashed")
+        return [{"text": "INVOICE", "conf": 0.9, "block": 1, "par": 1, "line": 1}]
+
+    monkeypatch.setattr(ocr_utils, "TEXT_OUTPUT_FOLDER", str(tmp_path))
+    monkeypatch.setattr(ocr_utils, "extract_words", extract_words)
+    monkeypatch.setattr(ocr_utils, "_pool", None)
+    metrics.reset()
+    return tmp_path
+
+
+def test_a_page_tesseract_fails_on_is_left_empty_and_the_rest_are_read(ocr):
+    pages = [Page("a.pdf", 1, processed=np.zeros((4, 4), dtype=np.uint8)),
+             Page("a.pdf", 2, processed=np.full((4, 4), 255, dtype=np.uint8)),
+             Page("a.pdf", 3, processed=np.zeros((4, 4), dtype=np.uint8))]
+
+    ocr_utils.extract_text_from_pages(pages, workers=1)
+
+    assert [page.text for page in pages] == ["INVOICE", "", "INVOICE"]
+    assert pages[1].words == []
+    assert (ocr / pages[1].text_filename).read_text() == ""
+    errors = [entry["value"] for entry in metrics.snapshot()["counters"]
+              if entry["name"] == "errors_total" and entry["labels"] == {"stage": "ocr"}]
+    assert errors == [1]
+
+
+def test_a_page_without_a_processed_image_is_reported(ocr):
+    page = Page("a.pdf", 1)
+
+    with pytest.raises(ValueError, match="a.pdf_page_1 has no processed image"):
+        ocr_utils._ocr_source(page)
+
+    ocr_utils.extract_text_from_pages([page], workers=1)
+    assert page.text == ""
+
+
+def test_preprocessed_pages_reach_tesseract_from_memory_without_a_second_filter_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess, "ORIGINAL_FOLDER", str(tmp_path))
+    monkeypatch.setattr(preprocess, "convert_from_path", lambda pdf_path, dpi, first_page, last_page, poppler_path:
+                        [Image.new("RGB", (80, 110), "white") for _ in range(first_page, last_page + 1)])
+    monkeypatch.setattr(ocr_utils, "TEXT_OUTPUT_FOLDER", str(tmp_path))
+    monkeypatch.setattr(ocr_utils, "_pool", None)
+    calls = []
+    monkeypatch.setattr(ocr_utils, "extract_words", lambda image, preprocess=True: calls.append(
+        (image if isinstance(image, str) else image.shape, preprocess)) or [])
+
+    pages = preprocess.process_page_range("a.pdf", 1, 2, save_processed=False, filter_chain=["threshold"])
+    assert all(page.processed is not None and page.processed_path is None for page in pages)
+    assert not list(tmp_path.glob("*_processed.jpg"))
+
+    # A processed JPEG read back from disk gets the OCR filter chain, an in-memory page does not
+    pages[1].processed_path = str(tmp_path / pages[1].processed_filename)
+    cv2.imwrite(pages[1].processed_path, pages[1].processed)
+    pages[1].processed = None
+    ocr_utils.extract_text_from_pages(pages, workers=1)
+
+    assert calls == [((110, 80), False), (pages[1].processed_path, True)]
@@ -0,0 +1,181 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("langchain_groq")
+
+from utils import metrics, parser
+from utils.fake_llm import FakeInvoiceChatModel, FakeRateLimitError
+from utils.parser import build_chain, parse_batch
+from utils.rate_limit import RateLimiter, TokenBucket, backoff_delay, is_retryable
+
+TEXT = "TAX INVOICE Invoice No: INV-0001 Dated 15/02/2019 GSTIN 29AAHCS6672E1ZZ FRONT WHEEL 70800"
+
+
+class CountingChatModel(FakeInvoiceChatModel):
+    """Fake model recording how many calls are in flight at once."""
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+class FailingChatModel(FakeInvoiceChatModel):
+    """Fake model failing its first `failures` calls with `error`."""
+    model_config = {"arbitrary_types_allowed": True}
+
+    failures: int = 0
+    error: Exception = FakeRateLimitError("Rate limit reached (fake 429)")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.calls < self.failures:
+            self.calls += 1
+            raise self.error
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    delays = []
+
+    def record(attempt, error=None):
+        delays.append(attempt)
+        return 0.0
+
+    monkeypatch.setattr(parser, "backoff_delay", record)
+    return delays
+
+
+def _parse(model, count=1, **kwargs):
+    kwargs.setdefault("limiter", RateLimiter())
+    return parse_batch([TEXT] * count, llm_chain=build_chain(model), fast_path=False, **kwargs)
+
+
+def test_token_bucket_paces_requests_beyond_its_capacity(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(60, capacity=2)  # One unit per second
+
+    bucket.consume(1)
+    bucket.consume(1)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    now[0] += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    now[0] += 10
+    assert bucket.wait_time(2) == 0.0  # Refills up to the capacity only
+    assert bucket.wait_time(5) == 0.0  # Oversized requests wait for a full bucket, not forever
+
+
+def test_rate_limiter_spreads_requests_at_the_configured_rate():
+    limiter = RateLimiter(requests_per_minute=1200)  # 20 per second
+    limiter.requests.tokens = 0
+
+    async def acquire_all():
+        start = time.perf_counter()
+        await asyncio.gather(*(limiter.acquire() for _ in range(4)))
+        return time.perf_counter() - start
+
+    assert asyncio.run(acquire_all()) >= 0.18
+
+
+def test_rate_limit_and_transient_errors_are_retried(no_backoff):
+    model = FailingChatModel(latency=0, failures=2)
+    [result] = _parse(model)
+    assert "error" not in result and result["invoice_number"] == "INV-0001"
+    assert model.calls == 3 and no_backoff == [0, 1]
+
+    model = FailingChatModel(latency=0, failures=1, error=ServerError("Service unavailable"))
+    [result] = _parse(model)
+    assert "error" not in result and no_backoff == [0, 1, 0]
+
+
+def test_retries_stop_after_max_retries_and_on_permanent_errors(no_backoff):
+    [result] = _parse(FailingChatModel(latency=0, failures=10))
+    assert "Rate limit" in result["error"] and len(no_backoff) == parser.LLM_MAX_RETRIES
+
+    model = FailingChatModel(latency=0, failures=1, error=ValueError("bad request"))
+    [result] = _parse(model)
+    assert "bad request" in result["error"] and model.calls == 1
+
+
+def test_backoff_honours_retry_after():
+    class Response:
+        headers = {"retry-after": "7"}
+
+    error = FakeRateLimitError("429")
+    error.response = Response()
+    assert is_retryable(error) and is_retryable(ServerError()) and not is_retryable(ValueError())
+    assert backoff_delay(0, error=error) == 7.0
+    assert 0 <= backoff_delay(3) <= 8.0
+
+
+def test_concurrency_cap_limits_calls_in_flight():
+    model = CountingChatModel(latency=0.02)
+    results = _parse(model, count=12, concurrency=3)
+    assert len(results) == 12 and all("error" not in result for result in results)
+    assert model.max_in_flight == 3
+
+
+def test_one_bad_response_or_callback_does_not_abort_the_batch():
+    delivered = []
+
+    def on_result(index, parsed_data):
+        if index == 1:
+            raise OSError("disk full")
+        delivered.append(index)
+
+    results = _parse(FakeInvoiceChatModel(latency=0.01), count=4, on_result=on_result)
+    assert sorted(delivered) == [0, 2, 3]
+    assert "disk full" in results[1]["error"]
+    assert all("error" not in results[index] for index in (0, 2, 3))
+
+    [result] = _parse(FakeInvoiceChatModel(latency=0, response="not json"))
+    assert result["error"] == "No valid JSON found in response."
+
+
+def test_vendor_label_is_bounded(monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(metrics, "MAX_LABEL_VALUES", 2)
+    vendors = [metrics.bounded_label("vendor", gstin) for gstin in ("29A", "27B", "29A", "33C", "07D")]
+    assert vendors == ["29A", "27B", "29A", "other", "other"]
+
+    _parse(FakeInvoiceChatModel(latency=0), count=3)
+    labels = {entry["labels"]["vendor"] for entry in metrics.snapshot()["timings"]
+              if entry["name"] == "invoice_parse_seconds"}
+    assert labels == {"other"}
+
+
+def test_only_pdfs_whose_invoices_were_all_handled_are_completed_in_the_dedup_index(tmp_path, monkeypatch, no_backoff):
+    from utils.dedup import DedupIndex
+    from utils.document import InvoiceDocument, Page
+    from utils.parser import aparse_documents
+
+    monkeypatch.setattr(parser, "JSON_OUTPUT_FOLDER", str(tmp_path / "parsed_json"))
+    completed = []
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    monkeypatch.setattr(index, "complete_pdf", completed.append)
+    documents = [InvoiceDocument(source, 1, pages=[Page(source, 1, content_hash=f"{source}-hash")], text=text)
+                 for source, text in (("bad.pdf", "UNREADABLE " + TEXT), ("good.pdf", TEXT))]
+
+    class RejectingChatModel(FakeInvoiceChatModel):
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            if "UNREADABLE" in messages[-1].content:
+                raise ValueError("bad request")
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    results = asyncio.run(aparse_documents(documents, dedup=index, llm_chain=build_chain(RejectingChatModel(latency=0)),
+                                           fast_path=False, limiter=RateLimiter()))
+    assert ["error" in result for result in results] == [True, False]
+    assert completed == ["good.pdf-hash"]
+    index.close()
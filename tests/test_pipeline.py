@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_groq")
+
+from utils import pipeline
+from utils.document import Page, PipelineContext
+from utils.pipeline import Stage, _ensure_page_text, run_pipeline
+from utils.seal_manifest import SealManifest
+
+
+def test_parse_without_seals_stage_reads_the_seal_manifest(tmp_path):
+    manifest = SealManifest(str(tmp_path / "seals.sqlite"))
+    manifest.record("a.pdf_page_1", [{"bbox": [0, 0, 10, 10], "score": 0.8, "class": 0}])
+    manifest.record("a.pdf_page_2", [])
+    pages = [Page("a.pdf", number, text="text", words=[]) for number in (1, 2, 3)]
+    context = PipelineContext(pages=pages, seal_manifest=manifest)
+
+    _ensure_page_text(context)
+
+    assert [(page.seal_detected, page.seal_score) for page in pages] == [(True, 0.8), (False, 0.0), (False, None)]
+
+
+def test_page_images_are_released_once_ocr_and_seals_have_used_them(tmp_path, monkeypatch):
+    held = {}
+
+    def run(context, name):
+        if name == "preprocess":
+            image = np.zeros((4, 4), dtype=np.uint8)
+            context.pages = [Page("a.pdf", 1, original=image, processed=image)]
+        else:
+            held[name] = (context.pages[0].processed is not None, context.pages[0].original is not None)
+
+    stages = [Stage(name, name, lambda context, name=name: run(context, name)) for name in pipeline.STAGE_NAMES]
+    monkeypatch.setattr(pipeline, "STAGES", stages)
+
+    context = run_pipeline(["preprocess", "ocr", "seals", "parse"], metrics_file=str(tmp_path / "metrics.json"))
+    assert held == {"ocr": (True, True), "seals": (False, True), "parse": (False, False)}
+    assert context.pages[0].original is None
+
+    # Without a seals stage the originals are never read from memory
+    held.clear()
+    run_pipeline(["preprocess", "ocr", "parse"], metrics_file=str(tmp_path / "metrics.json"))
+    assert held == {"ocr": (True, False), "parse": (False, False)}
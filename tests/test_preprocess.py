@@ -0,0 +1,81 @@
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import preprocess
+from utils.pipeline import run_pipeline
+
+PAGE_SIZE = (800, 1100)  # About 2.6 MB per rendered page, 0.9 MB preprocessed
+
+
+@pytest.fixture
+def fake_pdfs(tmp_path, monkeypatch):
+    """Folder of fake PDFs rendered as blank pages, with every image written under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(preprocess, "ORIGINAL_FOLDER", str(tmp_path / "original"))
+    monkeypatch.setattr(preprocess, "PROCESSED_FOLDER", str(tmp_path / "processed"))
+    monkeypatch.setattr(preprocess, "get_page_count", lambda pdf_path: int(pdf_path.split("-")[-1][:-4]))
+    monkeypatch.setattr(preprocess, "convert_from_path", lambda pdf_path, dpi, first_page, last_page, poppler_path:
+                        [Image.new("RGB", PAGE_SIZE, "white") for _ in range(first_page, last_page + 1)])
+
+    def make(pages, pdfs=4):
+        folder = tmp_path / f"input-{pages}"
+        folder.mkdir()
+        for index in range(pdfs):
+            (folder / f"invoice{index}-{pages // pdfs}.pdf").write_bytes(b"%PDF-1.4")
+        return str(folder)
+    return make
+
+
+def _peak_bytes(input_dir, **options):
+    tracemalloc.start()
+    try:
+        context = run_pipeline(["preprocess"], input_dir=input_dir, workers=1, filter_chain=["threshold"],
+                               text_layer=False, metrics_file="metrics.json", **options)
+        return tracemalloc.get_traced_memory()[1], context
+    finally:
+        tracemalloc.stop()
+
+
+def test_staged_preprocess_memory_does_not_grow_with_the_page_count(fake_pdfs):
+    small, context = _peak_bytes(fake_pdfs(8), max_in_flight_pages=2)
+    large, context = _peak_bytes(fake_pdfs(64), max_in_flight_pages=2)
+
+    assert len(context.pages) == 64
+    assert all(page.original is None and page.processed is None and page.processed_path for page in context.pages)
+    assert large < small * 1.5  # Eight times the pages, about the same peak
+
+    held, _ = _peak_bytes(fake_pdfs(32), keep_images=True, max_in_flight_pages=2)
+    assert held > large * 4  # Holding the images between stages grows with the pages
+
+
+def _page(noise=0.0, skew=0.0, ink=0):
+    """A grayscale page of text lines, with Gaussian noise (sigma in gray levels) and rotation."""
+    page = np.full((1600, 1200), 255, dtype=np.uint8)
+    for row in range(12):
+        cv2.putText(page, f"{row + 1} FRONT WHEEL 8714 2 1,000.00", (80, 150 + row * 110),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.6, ink, 3)
+    if skew:
+        page = preprocess.rotate_image(page, skew)
+    noisy = page + np.random.default_rng(0).normal(0, noise, page.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("noise, dpi, profile", [(0, 300, "clean"), (5, 300, "downscaled"),
+                                                 (5, 200, "tiled"), (20, 300, "tiled")])
+def test_the_profile_follows_the_page_noise_and_resolution(noise, dpi, profile):
+    processed, record = preprocess.adaptive_preprocess(_page(noise), dpi=dpi)
+
+    assert record["profile"] == profile
+    assert record["filters"] == preprocess.PREPROCESS_PROFILES[profile]
+    assert processed.shape == (1600, 1200) and not record["deskewed"]
+
+
+def test_faded_and_skewed_pages_are_stretched_and_straightened_first():
+    _, record = preprocess.adaptive_preprocess(_page(skew=2.0, ink=190), dpi=300)
+
+    assert record["filters"][0] == "normalize" and record["contrast"] < preprocess.LOW_CONTRAST
+    assert record["deskewed"] and abs(record["skew"] - 2.0) <= preprocess.SKEW_STEP_DEGREES
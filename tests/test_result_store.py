@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+from utils import convert_to_excel
+from utils.convert_to_excel import export_store
+from utils.result_store import ResultStore
+
+
+def _invoice(number, total=1.0):
+    return {"invoice_number": number, "items": [{"description": "item", "total_amount": total}]}
+
+
+def test_iter_invoices_between_checkpoints_returns_each_new_invoice_once(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.append([_invoice("A"), _invoice("B")])
+    first = store.checkpoint()
+    store.append([_invoice("C"), _invoice("A", 2.0)])
+    second = store.checkpoint()
+
+    assert [invoice["invoice_number"] for invoice in store.iter_invoices(until=first)] == ["A", "B"]  # As of `first`
+    assert [invoice["invoice_number"] for invoice in store.iter_invoices(since=first, until=second)] == ["C", "A"]
+    assert list(store.iter_invoices(since=second)) == []
+
+
+def test_reads_since_a_checkpoint_skip_the_history(tmp_path):
+    store = ResultStore(str(tmp_path), segment_max_bytes=200)
+    for number in range(20):
+        store.append(_invoice(f"OLD-{number}"))
+    assert len(store) == 20
+    checkpoint = store.checkpoint()
+    store.append([_invoice("NEW-1"), _invoice("NEW-2")])
+
+    # Segments before the checkpoint are never opened again
+    for path in store.segments():
+        if os.path.basename(path) < checkpoint[0]:
+            os.remove(path)
+    assert [invoice["invoice_number"] for invoice in store.iter_invoices(since=checkpoint)] == ["NEW-1", "NEW-2"]
+    assert len(store) == 22  # Counted incrementally, the removed segments were already counted
+
+
+def test_export_mark_round_trips_and_old_timestamp_marks_mean_a_full_export(tmp_path):
+    store = ResultStore(str(tmp_path))
+    assert store.last_export() is None
+    store.append(_invoice("A"))
+    store.set_last_export(store.checkpoint())
+    assert store.last_export() == ("invoices-000001.jsonl", os.path.getsize(store.segments()[0]))
+
+    with open(tmp_path / "last_export", "w", encoding="utf-8") as f:
+        f.write("1700000000.0")
+    assert store.last_export() is None
+
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    """Points every export path at tmp_path, so tests never touch the real output/ folder."""
+    monkeypatch.setattr(convert_to_excel, "JSON_FILE", str(tmp_path / "extracted_data.json"))
+    monkeypatch.setattr(convert_to_excel, "UPDATES_FOLDER", str(tmp_path / "updates"))
+    writers = {}
+    for name, (writer, path) in convert_to_excel.WRITERS.items():
+        path = str(tmp_path / os.path.basename(path))
+        monkeypatch.setattr(convert_to_excel, {"xlsx": "EXCEL_OUTPUT_FILE", "csv": "CSV_OUTPUT_FILE",
+                                               "parquet": "PARQUET_OUTPUT_FILE"}[name], path)
+        writers[name] = (writer, path)
+    monkeypatch.setattr(convert_to_excel, "WRITERS", writers)
+    return tmp_path
+
+
+def test_export_store_writes_only_new_invoices_after_the_first_export(output, monkeypatch):
+    store = ResultStore(str(output / "results"))
+    exported = []
+    monkeypatch.setattr(store, "export_parquet", lambda: exported.append("parquet"))
+    store.append([_invoice("A"), _invoice("B")])
+
+    paths = export_store(store, formats=["csv"])
+    assert exported == ["parquet"] and paths["csv"] == str(output / "extracted_data.csv")
+    with open(paths["json"], "r", encoding="utf-8") as f:
+        assert [invoice["invoice_number"] for invoice in json.load(f)] == ["A", "B"]
+
+    store.append([_invoice("C")])
+    paths = export_store(store, formats=["csv"])
+    assert os.path.dirname(paths["json"]) == str(output / "updates")
+    with open(paths["json"], "r", encoding="utf-8") as f:
+        assert [invoice["invoice_number"] for invoice in json.load(f)] == ["C"]
+    with open(paths["csv"], "r", encoding="utf-8-sig") as f:
+        assert len(f.readlines()) == 2  # Header and C's line item
+    assert exported == ["parquet"]
+
+    assert export_store(store, formats=["csv"]) == {}
+    export_store(store, formats=["csv"], full=True)
+    assert exported == ["parquet", "parquet"]
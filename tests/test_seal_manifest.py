@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+from utils.document import Page
+from utils.seal_manifest import SealManifest, scaled_bbox
+
+DETECTION = {"bbox": [100, 200, 150, 260], "score": 0.9, "class": 0, "label": "seal", "crop_path": None}
+
+
+def test_detections_keep_the_dpi_their_boxes_are_in(tmp_path):
+    manifest = SealManifest(str(tmp_path / "seals.sqlite"))
+    manifest.record("scan.pdf_page_1", [{**DETECTION, "dpi": 300}])
+    manifest.record("digital.pdf_page_1", [{**DETECTION, "dpi": 150}])
+
+    scanned, digital = (manifest.get(page)["detections"][0] for page in ("scan.pdf_page_1", "digital.pdf_page_1"))
+    assert (scanned["dpi"], digital["dpi"]) == (300, 150)
+    assert scaled_bbox(scanned, 300) == [100, 200, 150, 260]
+    assert scaled_bbox(digital, 300) == [200, 400, 300, 520]
+
+
+def test_manifest_written_before_dpi_was_recorded_still_opens(tmp_path):
+    path = tmp_path / "seals.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE detections (page TEXT NOT NULL, idx INTEGER NOT NULL, class INTEGER NOT NULL, label TEXT, "
+                 "score REAL NOT NULL, x1 INTEGER NOT NULL, y1 INTEGER NOT NULL, x2 INTEGER NOT NULL, "
+                 "y2 INTEGER NOT NULL, crop_path TEXT, PRIMARY KEY (page, idx))")
+    conn.execute("INSERT INTO detections VALUES ('a.pdf_page_1', 0, 0, 'seal', 0.8, 1, 2, 3, 4, NULL)")
+    conn.commit()
+    conn.close()
+
+    manifest = SealManifest(str(path))
+    manifest.record("b.pdf_page_1", [{**DETECTION, "dpi": 150}])
+    with manifest._lock:
+        rows = manifest._conn.execute("SELECT page, dpi FROM detections ORDER BY page").fetchall()
+    assert rows == [("a.pdf_page_1", None), ("b.pdf_page_1", 150)]
+    assert scaled_bbox({"bbox": [1, 2, 3, 4], "dpi": None}, 300) == [1, 2, 3, 4]
+
+
+def test_every_batch_records_the_dpi_of_its_pages(tmp_path, monkeypatch):
+    pytest.importorskip("ultralytics")
+    import numpy as np
+    from utils import image_utils, text_layer
+
+    def fake_batch(images, page_names, dpis=None, **kwargs):
+        return [[{**DETECTION, "dpi": dpi}] for dpi in dpis]
+
+    monkeypatch.setattr(image_utils, "detect_seals_batch", fake_batch)
+    monkeypatch.setattr(text_layer, "render_page", lambda *args, **kwargs: np.zeros((8, 8, 3), dtype=np.uint8))
+    pages = [Page("a.pdf", number, original=np.zeros((8, 8, 3), dtype=np.uint8)) for number in (1, 2, 3)]
+    pages += [Page("b.pdf", number, text_layer=True, pdf_path="b.pdf") for number in (1, 2)]
+    manifest = SealManifest(str(tmp_path / "seals.sqlite"))
+
+    image_utils.detect_seals_in_pages(pages, batch_size=2, manifest=manifest)
+    assert [manifest.get(page.name)["detections"][0]["dpi"] for page in pages] == [300, 300, 300, 150, 150]
+    assert all("seals" in page.timings for page in pages)
+
+
+def test_saved_crops_are_reported_once_per_call(tmp_path, monkeypatch, capsys):
+    pytest.importorskip("ultralytics")
+    from types import SimpleNamespace
+
+    import numpy as np
+    from utils import image_utils
+
+    boxes = SimpleNamespace(xyxy=np.array([[0, 0, 4, 4], [4, 4, 8, 8]]), conf=np.array([0.9, 0.8]), cls=np.array([0, 1]))
+    model = SimpleNamespace(predict=lambda crops, **kwargs: [SimpleNamespace(boxes=boxes, names={}) for _ in crops])
+    monkeypatch.setattr(image_utils, "get_model", lambda: model)
+    monkeypatch.setattr(image_utils, "SEAL_SIGNATURE_FOLDER", str(tmp_path))
+    pages = [Page("a.pdf", number, original=np.zeros((8, 8, 3), dtype=np.uint8)) for number in (1, 2, 3)]
+
+    image_utils.detect_seals_in_pages(pages, batch_size=2)
+
+    assert len(list(tmp_path.glob("*"))) == 6
+    assert capsys.readouterr().out.splitlines() == [f"Saved 6 seal/signature crop(s) to {tmp_path}"]
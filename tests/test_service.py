@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from utils import metrics, service
+from utils.service import JobService, make_handler, pool_size
+
+PDF = b"%PDF-1.4 fake invoice"
+
+
+def _no_warm_up(context):
+    pass
+
+def _fake_job(job, context, jobs):
+    """Stands in for the pipeline: one invoice per PDF."""
+    metrics.increment("service_jobs_total", status="done")
+    jobs.complete(job["job_id"], {"invoices": [{"invoice_number": job["filename"]}], "report": None})
+
+def _crash_first_attempt(job, context, jobs):
+    if job["attempts"] == 1:
+        os._exit(1)  # The worker dies mid-job
+    _fake_job(job, context, jobs)
+
+
+@pytest.fixture
+def run_service(tmp_path, monkeypatch):
+    """Starts a JobService and its HTTP API on a free port; returns a request helper."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(service, "warm_up", _no_warm_up)
+    monkeypatch.setattr(service, "POLL_SECONDS", 0.05)
+    monkeypatch.setattr(service, "SUPERVISE_SECONDS", 0.1)
+    started = []
+
+    def start(run_job=_fake_job, workers=1, max_queue=10, start_workers=True):
+        monkeypatch.setattr(service, "run_job", run_job)  # Inherited by the forked workers
+        job_service = JobService(dict, workers=workers, max_queue=max_queue, queue_path=str(tmp_path / "jobs.sqlite"))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(job_service))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        if start_workers:
+            job_service.start()
+        started.append((job_service, server))
+
+        def request(method, path, data=None):
+            url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as response:
+                    return response.status, response.read(), response.headers
+            except urllib.error.HTTPError as e:
+                return e.code, e.read(), e.headers
+        return job_service, request
+
+    yield start
+    for job_service, server in started:
+        server.shutdown()
+        server.server_close()
+        job_service.stop(timeout=5)
+
+
+def _wait_for_result(request, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, body, _ = request("GET", f"/jobs/{job_id}/result")
+        if status != 202:
+            return status, json.loads(body)
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_submitted_jobs_are_processed_by_warm_workers(run_service):
+    job_service, request = run_service(workers=2)
+    job_ids = []
+    for index in range(4):
+        status, body, headers = request("POST", f"/jobs?filename=invoice{index}.pdf", PDF)
+        assert status == 202 and headers["Location"] == f"/jobs/{json.loads(body)['job_id']}"
+        job_ids.append(json.loads(body)["job_id"])
+
+    for index, job_id in enumerate(job_ids):
+        status, result = _wait_for_result(request, job_id)
+        assert status == 200 and result["invoices"] == [{"invoice_number": f"invoice{index}.pdf"}]
+
+    assert request("POST", "/jobs", b"not a pdf")[0] == 415
+    assert json.loads(request("GET", "/health")[1])["jobs"] == {"done": 4}
+
+    # Job metrics are counted in the worker processes and served labelled by worker
+    text = request("GET", "/metrics")[1].decode("utf-8")
+    served = [line for line in text.splitlines() if line.startswith('invoice_service_jobs_total{status="done",worker=')]
+    assert sum(float(line.split()[-1]) for line in served) == 4
+    assert text.count("# TYPE invoice_service_jobs_total counter") == 1
+
+
+def test_full_queue_answers_429_with_retry_after(run_service):
+    job_service, request = run_service(max_queue=2, start_workers=False)
+    assert request("POST", "/jobs?filename=a.pdf", PDF)[0] == 202
+    assert request("POST", "/jobs?filename=b.pdf", PDF)[0] == 202
+
+    status, body, headers = request("POST", "/jobs?filename=c.pdf", PDF)
+    assert status == 429 and headers["Retry-After"] == str(service.RETRY_AFTER_SECONDS)
+    assert "Queue is full" in json.loads(body)["error"]
+    assert job_service.jobs.depth() == 2
+
+
+def test_job_of_a_crashed_worker_is_requeued_and_finished_by_its_replacement(run_service):
+    job_service, request = run_service(run_job=_crash_first_attempt)
+    job_id = json.loads(request("POST", "/jobs?filename=a.pdf", PDF)[1])["job_id"]
+
+    status, result = _wait_for_result(request, job_id)
+    assert status == 200 and result["invoices"] == [{"invoice_number": "a.pdf"}]
+    assert json.loads(request("GET", f"/jobs/{job_id}")[1])["attempts"] == 2
+
+
+def test_worker_pools_share_the_cores(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    assert [pool_size(workers) for workers in (1, 2, 3, 16)] == [8, 4, 2, 1]
@@ -0,0 +1,69 @@
+import _thread
+import os
+import threading
+import time
+
+import pytest
+
+from utils import streaming
+from utils.document import PipelineContext
+from utils.streaming import QUEUE_SIZE, StreamItem, stream_pdfs, watch_folder
+
+
+def test_stages_never_run_more_than_the_queues_hold_ahead_of_a_slow_consumer(monkeypatch):
+    produced = []
+
+    def rasterize(pdf_paths, context, outbox):
+        for path in pdf_paths:
+            produced.append(path)
+            outbox.put(StreamItem(source=path))
+
+    async def parse(context, inbox, outbox):
+        while (item := inbox.get()) is not streaming._DONE:
+            item.invoices = []
+            outbox.put(item)
+        outbox.put(streaming._DONE)
+
+    monkeypatch.setattr(streaming, "_rasterize", rasterize)
+    monkeypatch.setattr(streaming, "_parse_stage", parse)
+    for stage in ("_ocr", "_seals", "_validate"):
+        monkeypatch.setattr(streaming, stage, lambda item, context: item)
+
+    ahead, sources = [], []
+    for item in stream_pdfs([f"{i}.pdf" for i in range(50)], PipelineContext()):
+        ahead.append(len(produced) - len(sources))
+        sources.append(item.source)
+        time.sleep(0.005)
+
+    assert sources == [f"{i}.pdf" for i in range(50)]
+    # Five queues of QUEUE_SIZE PDFs, plus one PDF in the hands of each stage
+    assert max(ahead) <= 5 * QUEUE_SIZE + 5
+
+
+def test_watch_forgets_deleted_pdfs_so_a_copy_at_the_same_path_is_processed(tmp_path, monkeypatch):
+    pytest.importorskip("watchdog")
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    os.utime(pdf, (1_000_000, 1_000_000))
+    batches = []
+
+    def copy_back():
+        pdf.write_bytes(b"%PDF-1.4")
+        os.utime(pdf, (1_000_000, 1_000_000))  # Same size and mtime as the copy processed before
+
+    def run_stream(paths, context):
+        batches.append([os.path.basename(path) for path in paths])
+        if len(batches) == 2:
+            raise KeyboardInterrupt
+        pdf.unlink()
+        threading.Timer(0.5, copy_back).start()
+
+    monkeypatch.setattr(streaming, "run_stream", run_stream)
+    timeout = threading.Timer(10, _thread.interrupt_main)
+    timeout.start()
+    try:
+        watch_folder(PipelineContext(input_dir=str(tmp_path)), poll_seconds=0.05, settle_seconds=0.1)
+    finally:
+        timeout.cancel()
+
+    assert batches == [["a.pdf"], ["a.pdf"]]
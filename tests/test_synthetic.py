@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from utils.benchmark import compare_to_baseline, run_benchmarks
+from utils.fast_extract import gstin_checksum_valid
+from utils.synthetic import layout_pages, page_text, random_invoice
+from utils.validator import build_verifiability_report
+
+
+@pytest.mark.parametrize("pages", [1, 2, 3])
+def test_invoices_fill_exactly_the_requested_pages_with_consistent_numbers(pages):
+    invoice = random_invoice(random.Random(pages), index=7, pages=pages)
+    assert invoice == random_invoice(random.Random(pages), index=7, pages=pages)  # Same seed, same invoice
+
+    layout = layout_pages(invoice)
+    assert len(layout) == pages
+    assert [page_text(lines).splitlines()[-1] for lines in layout] == [f"Page {n} of {pages}" for n in range(1, pages + 1)]
+
+    assert gstin_checksum_valid(invoice["supplier_gst_number"]) and gstin_checksum_valid(invoice["bill_to_gst_number"])
+    report = build_verifiability_report([invoice], gst_rates_by_hsn={})
+    assert report["summary"]["all_line_items_verified"] and report["summary"]["totals_verified"]
+
+
+def test_benchmarks_measure_each_stage_on_a_corpus_generated_once(tmp_path):
+    options = dict(stages=["validate", "export"], count=2, min_pages=1, max_pages=1, folder=str(tmp_path))
+    report = run_benchmarks(**options)
+
+    assert report["corpus"] == {"pdfs": 2, "pages": 2, "seed": 0}
+    for result in report["stages"].values():
+        assert result["count"] == 6 and result["calls"] == 3 and result["throughput"] > 0
+
+    corpus_pdf = tmp_path / "synthetic_0001.pdf"
+    mtime = corpus_pdf.stat().st_mtime_ns
+    run_benchmarks(**options)
+    assert corpus_pdf.stat().st_mtime_ns == mtime
+
+
+def test_regressions_beyond_the_tolerance_are_reported():
+    def stage(throughput, p95_ms, peak_rss_mb=100.0):
+        return {"unit": "pages", "throughput": throughput, "p95_ms": p95_ms, "peak_rss_mb": peak_rss_mb}
+
+    baseline = {"stages": {"ocr": stage(10.0, 100.0), "seals": stage(5.0, 50.0), "parse": {"skipped": "no LLM"}}}
+    report = {"stages": {"ocr": stage(8.0, 110.0), "seals": stage(4.5, 50.0, 200.0), "parse": stage(1.0, 1.0)}}
+
+    assert compare_to_baseline(report, baseline) == ["ocr: throughput 10.0 → 8.0 pages/s",
+                                                     "seals: peak_rss_mb 100.0 → 200.0"]
@@ -0,0 +1,57 @@
+import pytest
+from PIL import Image
+
+pymupdf = pytest.importorskip("pymupdf")
+
+from utils import preprocess
+from utils.text_layer import extract_text_layer, is_readable
+
+
+@pytest.fixture
+def mixed_pdf(tmp_path):
+    """Page 1 is born-digital (an invoice header with table cells written as separate texts), page 2 a scan."""
+    path = str(tmp_path / "mixed.pdf")
+    with pymupdf.open() as document:
+        page = document.new_page()
+        page.insert_text((72, 72), "TAX INVOICE Invoice No: INV-2024-00017")
+        page.insert_text((72, 100), "FRONT WHEEL")
+        page.insert_text((300, 100), "8714")
+        page.insert_text((400, 100), "2,000.00")
+        document.new_page()
+        document.save(path)
+    return path
+
+
+def test_born_digital_pages_are_read_from_the_text_layer_and_scans_are_not(mixed_pdf):
+    first, second = extract_text_layer(mixed_pdf, content_hash="abc")
+
+    assert second is None
+    assert first.text_layer and first.page_number == 1 and first.cache_key
+    assert first.text.splitlines() == ["TAX INVOICE Invoice No: INV-2024-00017", "FRONT WHEEL 8714 2,000.00"]
+    wheel = next(word for word in first.words if word["text"] == "WHEEL")
+    assert wheel["conf"] == 1.0 and wheel["line"] == 2
+    assert wheel["left"] > 72 * 300 / 72  # Boxes are in pixels of a 300 DPI render
+
+
+def test_short_or_garbled_text_is_not_trusted():
+    assert not is_readable("Page 1")
+    assert not is_readable("�" * 60)
+    assert is_readable("TAX INVOICE Invoice No: INV-2024-00017 Date 01-02-2024")
+
+
+def test_only_pages_without_a_text_layer_are_rendered(mixed_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess, "ORIGINAL_FOLDER", str(tmp_path / "original"))
+    monkeypatch.setattr(preprocess, "PROCESSED_FOLDER", str(tmp_path / "processed"))
+    rendered = []
+
+    def convert_from_path(pdf_path, dpi, first_page, last_page, poppler_path):
+        rendered.extend(range(first_page, last_page + 1))
+        return [Image.new("RGB", (80, 110), "white") for _ in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(preprocess, "convert_from_path", convert_from_path)
+
+    pages = list(preprocess.iter_processed_pages([mixed_pdf], workers=1, filter_chain=["threshold"]))
+
+    assert rendered == [2]
+    assert [(page.page_number, page.text_layer, page.processed is not None) for page in pages] == [
+        (1, True, False), (2, False, True)]
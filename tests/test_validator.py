@@ -0,0 +1,67 @@
+import pytest
+
+from utils.seal_manifest import SealManifest
+from utils import validator
+from utils.validator import build_verifiability_report, calculate_confidence, generate_verifiability_report
+
+
+def _invoice(number, seal, **fields):
+    return {"invoice_number": number, "seal_and_sign_present": seal, "source_file": f"{number}.pdf", "pages": [1],
+            "items": [{"description": "WHEEL", "quantity": 2, "unit_price": "1,000", "total_amount": 2000}], **fields}
+
+
+def _seal_confidence(report, number):
+    return report["field_verification"][number]["seal_and_sign_present"]["confidence"]
+
+
+def test_seal_confidence_uses_the_detection_score_whether_or_not_a_seal_was_found(tmp_path):
+    manifest = SealManifest(str(tmp_path / "seals.sqlite"))
+    manifest.record("missed.pdf_page_1", [{"bbox": [0, 0, 9, 9], "score": 0.9, "class": 0}])
+    manifest.record("clean.pdf_page_1", [])
+    invoices = [
+        _invoice("found", True, seal_and_sign_present_confidence=0.7),
+        _invoice("checked", False, seal_and_sign_present_confidence=0.0),
+        _invoice("missed", False),     # The manifest found a seal the invoice says is absent
+        _invoice("clean", False),
+        _invoice("unchecked", False),
+    ]
+    report = build_verifiability_report(invoices, seal_manifest=manifest)
+
+    assert [_seal_confidence(report, invoice["invoice_number"]) for invoice in invoices] == [0.7, 1.0, 0.1, 1.0, 0.5]
+    assert "Low confidence in seal_and_sign_present: 0.1" in report["summary"]["issues"]
+    assert [calculate_confidence(value, score, seal_present=True)
+            for value, score in ((True, 0.7), (False, 0.0), (False, 0.9), (False, None))] == [0.7, 1.0, 0.1, 0.5]
+
+
+def test_report_rows_and_checks_match_the_per_item_rules():
+    invoices = [_invoice("A", True, subtotal=2000, final_total=9),
+                {"error": "unreadable"},
+                _invoice("B", True, items=[{"quantity": 3, "unit_price": 5, "total_amount": 16, "description": ""},
+                                           {"quantity": None, "unit_price": 5, "total_amount": 5}])]
+    report = build_verifiability_report(invoices, gst_rates_by_hsn={})
+
+    [row] = report["line_items_verification"]["A"]
+    assert row["row"] == 1 and row["description_confidence"] == calculate_confidence("WHEEL")
+    assert row["line_total_check"] == {"calculated_value": 2000.0, "extracted_value": 2000.0, "check_passed": True}
+    assert report["total_calculations_verification"]["A"]["subtotal_check"]["check_passed"]
+    assert not report["total_calculations_verification"]["A"]["final_total_check"]["check_passed"]
+
+    first, second = report["line_items_verification"]["B"]
+    assert first["line_total_check"]["check_passed"] is False and first["description_confidence"] == 0.5
+    assert second["row"] == 2 and second["line_total_check"]["calculated_value"] is None
+    issues = report["summary"]["issues"]
+    assert {"Line total mismatch in row 1", "Total calculations mismatch in invoice A",
+            "Skipping invoice due to error: unreadable"} <= set(issues)
+
+
+def test_batch_reports_merge_into_the_report_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(validator, "VERIFIABILITY_REPORT_FILE", str(tmp_path / "report.json"))
+    generate_verifiability_report([_invoice("A", True, final_total=9), _invoice("B", True)])
+
+    report = generate_verifiability_report([_invoice("A", True), _invoice("C", True)], merge=True)
+
+    assert list(report["field_verification"]) == ["A", "B", "C"]
+    assert report["total_calculations_verification"]["A"]["final_total_check"]["check_passed"]
+    assert report["summary"]["totals_verified"]  # The re-sent A replaced the mismatching one
+    assert report["summary"]["issues"].count("Total calculations mismatch in invoice A") == 1
+    assert validator.merge_verifiability_reports({}, report) == report
@@ -0,0 +1,104 @@
+import re
+from collections import OrderedDict
+
+from utils.document import InvoiceDocument
+from utils.fast_extract import extract_invoice_number
+
+# Lines at the top/bottom of a page that may repeat on every page of an invoice
+HEADER_LINES = 8
+FOOTER_LINES = 6
+
+PAGE_OF_PATTERN = re.compile(r"\bpage\s*(\d+)\s*(?:of|/)\s*(\d+)\b", re.IGNORECASE)
+TITLE_PATTERN = re.compile(r"\b(?:tax\s+)?in[vy][o0][il1]ce\b", re.IGNORECASE)
+TOTAL_PATTERN = re.compile(r"\b(?:grand\s+total|total|amount\s+due|amount\s+in\s+words)\b", re.IGNORECASE)
+
+def _page_marker(text):
+    """Returns the page number of a "Page x of y" marker, or None."""
+    match = PAGE_OF_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+def _has_title(text):
+    """True if the page header announces an invoice."""
+    return any(TITLE_PATTERN.search(line) for line in text.splitlines()[:HEADER_LINES])
+
+def starts_new_invoice(text, current_number, current_has_total):
+    """
+    Decides whether a page begins a new invoice rather than continuing the current one:
+    an explicit "Page 1 of N" marker, an invoice number that differs from the current invoice's,
+    or an invoice title after the current invoice already reached its total.
+    """
+    marker = _page_marker(text)
+    if marker is not None:
+        return marker == 1
+
+    number = extract_invoice_number(text)
+    if number is not None and current_number is not None:
+        return number != current_number
+    if number is not None and current_has_total:
+        return True
+
+    return current_has_total and _has_title(text)
+
+def _normalize_line(line):
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+def compact_text(pages):
+    """
+    Joins the OCR text of an invoice's pages into one prompt.
+    Header/footer lines already seen on an earlier page, "Page x of y" markers and blank lines are dropped.
+    """
+    seen = set()
+    parts = []
+
+    for page in pages:
+        lines = [line for line in (page.text or "").splitlines() if line.strip()]
+        kept = []
+
+        for position, line in enumerate(lines):
+            if PAGE_OF_PATTERN.search(line) and len(line) < 40:
+                continue
+
+            normalized = _normalize_line(line)
+            in_margin = position < HEADER_LINES or position >= len(lines) - FOOTER_LINES
+            if in_margin:
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+            kept.append(line.strip())
+
+        if kept:
+            parts.append("\n".join(kept))
+
+    return "\n".join(parts)
+
+def group_pages(pages):
+    """
+    Groups pages into invoices: pages are grouped by source PDF (in page order),
+    then split wherever `starts_new_invoice` detects a boundary.
+    Returns InvoiceDocument objects with their compacted text.
+    """
+    by_source = OrderedDict()
+    for page in pages:
+        by_source.setdefault(page.source, []).append(page)
+
+    documents = []
+    for source, source_pages in by_source.items():
+        current, current_number, current_has_total = None, None, False
+        index = 0
+
+        for page in sorted(source_pages, key=lambda p: p.page_number):
+            text = page.text or ""
+            if current is None or starts_new_invoice(text, current_number, current_has_total):
+                index += 1
+                current = InvoiceDocument(source=source, index=index)
+                documents.append(current)
+                current_number, current_has_total = None, False
+
+            current.pages.append(page)
+            current_number = current_number or extract_invoice_number(text)
+            current_has_total = current_has_total or bool(TOTAL_PATTERN.search(text))
+
+    for document in documents:
+        document.text = compact_text(document.pages)
+
+    return documents
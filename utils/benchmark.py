@@ -0,0 +1,402 @@
+import argparse
+import difflib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.preprocess import PREPROCESS_PROFILES
+from utils.synthetic import CORPUS_FOLDER, MAX_PAGES, MIN_PAGES, generate_corpus, load_corpus, render_document
+
+# Define paths
+BENCHMARK_FOLDER = "output/benchmark"
+BASELINE_FILE = os.path.join(BENCHMARK_FOLDER, "baseline.json")
+REPORT_FILE = os.path.join(BENCHMARK_FOLDER, "report.json")
+CORPUS_SETTINGS_FILE = "corpus.json"   # Settings the corpus in a folder was generated with
+PAGE_IMAGE_SUBFOLDER = "pages"         # Rendered page images, for stages that start from an image
+
+CORPUS_SIZE = 5
+REPEATS = 3                   # Times the whole-batch stages (validate, export) are run
+RSS_SAMPLE_SECONDS = 0.005    # Interval between peak memory samples
+REGRESSION_TOLERANCE = 0.15   # Allowed slowdown / memory growth against the baseline
+ACCURACY_TOLERANCE = 0.02     # Allowed drop of OCR accuracy (0-1) against the baseline
+
+
+class SkipStage(Exception):
+    """Raised when a stage's external dependency (poppler, Tesseract, YOLO weights) is not available offline."""
+
+
+class PeakRss:
+    """Samples the resident set size of this process in a background thread and keeps the maximum."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        import psutil
+
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def ensure_corpus(folder=CORPUS_FOLDER, count=CORPUS_SIZE, seed=0, min_pages=MIN_PAGES, max_pages=MAX_PAGES):
+    """Returns the synthetic corpus in `folder`, generating it first unless it was made with the same settings."""
+    settings = {"count": count, "seed": seed, "min_pages": min_pages, "max_pages": max_pages}
+    settings_path = os.path.join(folder, CORPUS_SETTINGS_FILE)
+
+    if os.path.exists(settings_path):
+        with open(settings_path, "r", encoding="utf-8") as f:
+            if json.load(f) == settings:
+                return load_corpus(folder)
+        shutil.rmtree(folder)
+
+    corpus = generate_corpus(folder, count=count, seed=seed, min_pages=min_pages, max_pages=max_pages)
+    with open(settings_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=4)
+    return corpus
+
+def page_image_paths(corpus, folder=CORPUS_FOLDER):
+    """Renders every corpus page to a JPEG (once), named like the pipeline's original page images."""
+    image_folder = os.path.join(folder, PAGE_IMAGE_SUBFOLDER)
+    os.makedirs(image_folder, exist_ok=True)
+
+    paths = []
+    for spec in corpus:
+        filename = os.path.basename(spec["path"])
+        names = [os.path.join(image_folder, f"{filename}_page_{n}_original.jpg") for n in range(1, spec["pages"] + 1)]
+        if not all(os.path.exists(path) for path in names):
+            for path, image in zip(names, render_document(spec)):
+                cv2.imwrite(path, cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))
+        paths.extend(names)
+    return paths
+
+
+def tesseract_available():
+    """True if pytesseract is installed and can run the Tesseract binary."""
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def ocr_scorer(data):
+    """
+    Returns score(expected_text) -> check(image), which OCRs a preprocessed page and returns its
+    character-level similarity (0-1) to the ground truth, or None when Tesseract is not available.
+    """
+    if "tesseract" not in data:
+        data["tesseract"] = tesseract_available()
+        if not data["tesseract"]:
+            print("Tesseract is not available, OCR accuracy is not measured")
+
+    def score(expected_text):
+        if not data["tesseract"]:
+            return None
+
+        def check(image):
+            from utils.ocr_utils import extract_words
+            text = " ".join(word["text"] for word in extract_words(image, preprocess=False))
+            return difflib.SequenceMatcher(None, " ".join(expected_text.split()), text).ratio()
+        return check
+
+    return score
+
+
+# Each benchmark yields (units processed, call) pairs, optionally with a check(result) returning an
+# accuracy score; only the calls are timed.
+
+def bench_rasterize(data):
+    """`preprocess.convert_pdf_to_images`, one PDF at a time."""
+    from pdf2image import pdfinfo_from_path
+    from utils.preprocess import POPPLER_PATH, convert_pdf_to_images
+
+    try:
+        pdfinfo_from_path(data["corpus"][0]["path"], poppler_path=POPPLER_PATH)
+    except Exception as e:
+        raise SkipStage(f"poppler is not available ({e})")
+
+    with tempfile.TemporaryDirectory() as folder:
+        for spec in data["corpus"]:
+            input_dir = os.path.join(folder, os.path.basename(spec["path"]))
+            os.makedirs(input_dir)
+            shutil.copy(spec["path"], input_dir)
+            yield spec["pages"], lambda: convert_pdf_to_images(input_dir, workers=data["workers"])
+
+def bench_preprocess(data):
+    """`preprocess.preprocess_image` (adaptive profile per page) on each page, with OCR accuracy."""
+    from utils.preprocess import preprocess_image
+
+    score = ocr_scorer(data)
+    for path, text in zip(data["page_images"], data["page_texts"]):
+        image = cv2.imread(path)
+        yield 1, lambda: preprocess_image(image), score(text)
+
+def profile_benchmark(profile):
+    """Benchmark of one fixed `preprocess.PREPROCESS_PROFILES` profile, with OCR accuracy."""
+    def bench(data):
+        from utils.preprocess import adaptive_preprocess
+
+        score = ocr_scorer(data)
+        for path, text in zip(data["page_images"], data["page_texts"]):
+            image = cv2.imread(path)
+            yield 1, lambda: adaptive_preprocess(image, profile=profile)[0], score(text)
+
+    bench.__doc__ = f"`preprocess.adaptive_preprocess` forced to the '{profile}' profile on each page."
+    return bench
+
+def bench_ocr_preprocess(data):
+    """`ocr_utils.preprocess_image` (the lighter OCR chain) on each page."""
+    from utils.ocr_utils import preprocess_image
+
+    for path in data["page_images"]:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        yield 1, lambda: preprocess_image(image)
+
+def bench_ocr(data):
+    """Tesseract (`ocr_utils.extract_words`) on each preprocessed page."""
+    import pytesseract
+    from utils.ocr_utils import extract_words
+    from utils.preprocess import preprocess_image
+
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        raise SkipStage(f"Tesseract is not available ({e})")
+
+    for path in data["page_images"]:
+        image = preprocess_image(cv2.imread(path))
+        yield 1, lambda: extract_words(image, preprocess=False)
+
+def bench_seals(data):
+    """`image_utils.detect_seal_signature` on each page image."""
+    from utils import image_utils
+
+    if not os.path.exists(image_utils.MODEL_PATH):
+        raise SkipStage(f"YOLO weights {image_utils.MODEL_PATH} not found (not downloaded in offline benchmarks)")
+
+    for path in data["page_images"]:
+        yield 1, lambda: image_utils.detect_seal_signature(path)
+
+def bench_parse(data):
+    """`parser.parse_text` on each invoice's text, with an instant fake LLM and no LLM cache."""
+    from utils.fake_llm import FakeInvoiceChatModel
+    from utils.parser import build_chain, parse_text
+
+    chain = build_chain(FakeInvoiceChatModel(latency=0))
+    for spec in data["corpus"]:
+        text = "\n".join(spec["page_texts"])
+        yield 1, lambda: parse_text(text, llm_chain=chain)
+
+def bench_validate(data):
+    """`validator.build_verifiability_report` over all ground-truth invoices."""
+    from utils.validator import build_verifiability_report
+
+    for _ in range(REPEATS):
+        yield len(data["invoices"]), lambda: build_verifiability_report(data["invoices"])
+
+def bench_export(data):
+    """`convert_to_excel.export_invoices` of all ground-truth invoices to every format."""
+    from utils.convert_to_excel import EXPORT_FORMATS, export_invoices
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {name: os.path.join(folder, f"extracted_data.{name}") for name in EXPORT_FORMATS}
+        for _ in range(REPEATS):
+            yield len(data["invoices"]), lambda: export_invoices(data["invoices"], formats=EXPORT_FORMATS, paths=paths)
+
+# Benchmarks in pipeline order: name -> (unit, benchmark)
+# The per-profile preprocessing benchmarks only run when asked for (--profiles), as the denoising ones are slow
+BENCHMARKS = {
+    "rasterize": ("pages", bench_rasterize),
+    "preprocess": ("pages", bench_preprocess),
+    **{f"preprocess_{profile}": ("pages", profile_benchmark(profile)) for profile in PREPROCESS_PROFILES},
+    "ocr_preprocess": ("pages", bench_ocr_preprocess),
+    "ocr": ("pages", bench_ocr),
+    "seals": ("pages", bench_seals),
+    "parse": ("invoices", bench_parse),
+    "validate": ("invoices", bench_validate),
+    "export": ("invoices", bench_export),
+}
+
+PROFILE_BENCHMARKS = ["preprocess"] + [f"preprocess_{profile}" for profile in PREPROCESS_PROFILES]
+DEFAULT_BENCHMARKS = [name for name in BENCHMARKS if name not in PROFILE_BENCHMARKS[1:]]
+
+def measure(unit, calls):
+    """
+    Times every call and returns throughput, p50/p95 latency and peak RSS,
+    plus the mean accuracy when the benchmark checks its results.
+    """
+    latencies, scores, units = [], [], 0
+    with PeakRss() as rss:
+        for count, call, *check in calls:
+            start = time.perf_counter()
+            result = call()
+            latencies.append(time.perf_counter() - start)
+            units += count
+            if check and check[0] is not None:
+                scores.append(check[0](result))
+
+    if not latencies:
+        raise SkipStage("nothing to measure")
+
+    seconds = sum(latencies)
+    accuracy = {"ocr_accuracy": round(float(np.mean(scores)), 4)} if scores else {}
+    return {
+        "unit": unit,
+        "count": units,
+        "calls": len(latencies),
+        "seconds": round(seconds, 4),
+        "throughput": round(units / seconds, 3) if seconds else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        **accuracy,
+    }
+
+def run_benchmarks(stages=None, count=CORPUS_SIZE, seed=0, min_pages=MIN_PAGES, max_pages=MAX_PAGES,
+                   workers=1, folder=CORPUS_FOLDER):
+    """
+    Runs the selected stage benchmarks on a synthetic corpus and returns the report.
+    Stages whose dependencies are missing are reported as skipped rather than failing the run.
+    """
+    stages = stages or DEFAULT_BENCHMARKS
+    unknown = [name for name in stages if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+
+    corpus = ensure_corpus(folder, count=count, seed=seed, min_pages=min_pages, max_pages=max_pages)
+    data = {"corpus": corpus, "workers": workers, "invoices": [spec["invoice"] for spec in corpus],
+            "page_images": page_image_paths(corpus, folder),
+            "page_texts": [text for spec in corpus for text in spec["page_texts"]]}
+
+    results = {}
+    for name in stages:
+        unit, benchmark = BENCHMARKS[name]
+        print(f"Benchmarking '{name}'...")
+        try:
+            results[name] = measure(unit, benchmark(data))
+        except (SkipStage, ImportError) as e:
+            print(f"Skipping '{name}': {e}")
+            results[name] = {"unit": unit, "skipped": str(e)}
+
+    return {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "corpus": {"pdfs": len(corpus), "pages": sum(spec["pages"] for spec in corpus), "seed": seed},
+        "stages": results,
+    }
+
+def compare_to_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Lists regressions against a baseline report: throughput more than `tolerance` lower,
+    or p95 latency or peak RSS more than `tolerance` higher, or OCR accuracy more than
+    ACCURACY_TOLERANCE lower. Skipped stages are not compared.
+    """
+    regressions = []
+    for name, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous or "skipped" in current or "skipped" in previous:
+            continue
+
+        if previous["throughput"] and current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput']} → {current['throughput']} {current['unit']}/s")
+        for metric in ("p95_ms", "peak_rss_mb"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} → {current[metric]}")
+        if "ocr_accuracy" in previous and current.get("ocr_accuracy", 1.0) < previous["ocr_accuracy"] - ACCURACY_TOLERANCE:
+            regressions.append(f"{name}: ocr_accuracy {previous['ocr_accuracy']} → {current['ocr_accuracy']}")
+    return regressions
+
+def print_report(report, baseline=None):
+    """Prints one line per stage, with the change against the baseline when there is one."""
+    print(f"\nBenchmark on {report['corpus']['pdfs']} PDFs / {report['corpus']['pages']} pages:")
+    for name, result in report["stages"].items():
+        if "skipped" in result:
+            print(f"  {name:<22} skipped: {result['skipped']}")
+            continue
+
+        line = (f"  {name:<22} {result['throughput']:>10.2f} {result['unit']}/s  p50 {result['p50_ms']:.1f} ms  "
+                f"p95 {result['p95_ms']:.1f} ms  peak RSS {result['peak_rss_mb']:.0f} MB")
+        if "ocr_accuracy" in result:
+            line += f"  OCR accuracy {result['ocr_accuracy']:.3f}"
+        previous = (baseline or {}).get("stages", {}).get(name)
+        if previous and "skipped" not in previous and previous["throughput"]:
+            line += f"  ({(result['throughput'] / previous['throughput'] - 1) * 100:+.1f}% throughput vs baseline)"
+        print(line)
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Benchmark report saved: {path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on a synthetic invoice corpus")
+    parser.add_argument("--stages", default=",".join(DEFAULT_BENCHMARKS),
+                        help=f"Comma-separated benchmarks (default: all but the per-profile ones). Available: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--profiles", action="store_true",
+                        help="Compare throughput and OCR accuracy of every preprocessing profile (ignores --stages)")
+    parser.add_argument("--pdfs", type=int, default=CORPUS_SIZE, help="Synthetic PDFs to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    parser.add_argument("--min-pages", type=int, default=MIN_PAGES, help="Fewest pages per synthetic PDF")
+    parser.add_argument("--max-pages", type=int, default=MAX_PAGES, help="Most pages per synthetic PDF")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the rasterize benchmark")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative slowdown or memory growth reported as a regression (default: 0.15)")
+    return parser.parse_args()
+
+def main():
+    """Runs the benchmarks, saves the report and exits with status 1 if a stage regressed against the baseline."""
+    args = parse_args()
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    if args.profiles:
+        stages = PROFILE_BENCHMARKS
+    report = run_benchmarks(stages, count=args.pdfs, seed=args.seed, min_pages=args.min_pages,
+                            max_pages=args.max_pages, workers=args.workers)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+    save_report(report, REPORT_FILE)
+
+    if args.save_baseline:
+        save_report(report, args.baseline)
+        return
+
+    if baseline is not None:
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import cv2
+
+from utils import metrics
+
+# Define cache location and size limit
+CACHE_FOLDER = "output/cache"
+MAX_CACHE_BYTES = 2 * 1024 ** 3  # Oldest entries are evicted once the cache grows past this
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def text_hash(text):
+    """Returns the SHA-256 of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_key(stage, version, *parts):
+    """Builds a cache key from the stage name, its CACHE_VERSION and its input/config parts."""
+    payload = json.dumps([stage, version, parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def page_cache_key(page):
+    """
+    Returns the content key identifying a page's rendered image.
+    Pages rendered in this run already carry one; pages loaded from disk are keyed by their image file.
+    """
+    if page.cache_key is None:
+        path = page.processed_path or page.original_path
+        if path and os.path.exists(path):
+            page.cache_key = file_hash(path)
+    return page.cache_key
+
+
+class ContentCache:
+    """
+    Content-addressed store for stage results.
+    Entries live under `<folder>/<stage>/<key[:2]>/<key><ext>`; a key is the hash of the
+    stage name, the stage's CACHE_VERSION and everything its output depends on.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=MAX_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+
+    def path(self, stage, key, ext):
+        return os.path.join(self.folder, stage, key[:2], f"{key}{ext}")
+
+    def _record(self, stage, hit):
+        counters = self.hits if hit else self.misses
+        counters[stage] = counters.get(stage, 0) + 1
+        metrics.increment("cache_hits_total" if hit else "cache_misses_total", cache="content", stage=stage)
+
+    def get_path(self, stage, key, ext, record=True):
+        """Returns the path of a cached entry (marking it as recently used), or None on a miss."""
+        path = self.path(stage, key, ext)
+        hit = os.path.exists(path)
+        if hit:
+            os.utime(path)  # Eviction removes the least recently used entries first
+        if record:
+            self._record(stage, hit)
+        return path if hit else None
+
+    def put_bytes(self, stage, key, ext, data):
+        """Writes an entry atomically so a crash never leaves a truncated file behind."""
+        path = self.path(stage, key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def put_file(self, stage, key, ext, src_path):
+        """Copies an existing file into the cache."""
+        with open(src_path, "rb") as f:
+            return self.put_bytes(stage, key, ext, f.read())
+
+    def get_text(self, stage, key):
+        path = self.get_path(stage, key, ".txt")
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put_text(self, stage, key, text):
+        return self.put_bytes(stage, key, ".txt", text.encode("utf-8"))
+
+    def get_json(self, stage, key):
+        path = self.get_path(stage, key, ".json")
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put_json(self, stage, key, data):
+        return self.put_bytes(stage, key, ".json", json.dumps(data).encode("utf-8"))
+
+    def put_image(self, stage, key, ext, image):
+        """Encodes an image with OpenCV (format chosen by `ext`) and stores it."""
+        ok, encoded = cv2.imencode(ext, image)
+        if not ok:
+            raise ValueError(f"Could not encode image for cache entry {key}{ext}")
+        return self.put_bytes(stage, key, ext, encoded.tobytes())
+
+    def get_image(self, stage, key, ext, flags=cv2.IMREAD_UNCHANGED):
+        path = self.get_path(stage, key, ext)
+        return cv2.imread(path, flags) if path else None
+
+    def size(self):
+        """Returns the total size of all cache entries in bytes."""
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            for filename in files:
+                total += os.path.getsize(os.path.join(root, filename))
+        return total
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for filename in files:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            print(f"Cache eviction removed {removed} entries, {total / 1024 ** 2:.1f} MB left")
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def summary(self):
+        """Returns hit/miss counts per stage."""
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0)} for stage in stages}
@@ -1,45 +1,254 @@
+import csv
 import json
-import pandas as pd
 import os
+import time
+
+from openpyxl import Workbook
+
+from utils.result_store import STORE_FOLDER, ResultStore
 
 # Define paths
 JSON_FILE = "output/extracted_data.json"
 EXCEL_OUTPUT_FILE = "output/extracted_data.xlsx"
+CSV_OUTPUT_FILE = "output/extracted_data.csv"
+PARQUET_OUTPUT_FILE = "output/extracted_data.parquet"
+UPDATES_FOLDER = "output/updates"   # Exports of the invoices stored since the previous export
+
+EXPORT_FORMATS = ["xlsx", "csv", "parquet"]
+DEFAULT_EXPORT_FORMATS = ["xlsx"]
 
-def json_to_excel():
-    """Reads parsed JSON and converts it into a structured Excel file."""
-    with open(JSON_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+EXCEL_MAX_ROWS = 1_048_576   # Rows per worksheet (header included); further rows continue on a new sheet
+SHEET_NAME = "Invoices"
+PARQUET_BATCH_SIZE = 10_000  # Rows buffered per Parquet row group
 
-    # Flatten structure and ensure all required fields are included
-    structured_data = []
+# Output columns: (header, invoice field, item field, Arrow type name)
+COLUMNS = [
+    ("Source File", "source_file", None, "string"),
+    ("Pages", "pages", None, "string"),
+    ("Invoice Number", "invoice_number", None, "string"),
+    ("Invoice Date", "invoice_date", None, "string"),
+    ("Supplier GST", "supplier_gst_number", None, "string"),
+    ("Bill-To GST", "bill_to_gst_number", None, "string"),
+    ("PO Number", "po_number", None, "string"),
+    ("Shipping Address", "shipping_address", None, "string"),
+    ("Seal & Sign", "seal_and_sign_present", None, "bool_"),
+    ("No. of Items", "no_items", None, "float64"),
+    ("Serial Number", None, "serial_number", "string"),
+    ("Description", None, "description", "string"),
+    ("HSN/SAC", None, "hsn_sac", "string"),
+    ("Quantity", None, "quantity", "float64"),
+    ("Unit Price", None, "unit_price", "float64"),
+    ("Total Amount", None, "total_amount", "float64"),
+]
+HEADERS = [header for header, _, _, _ in COLUMNS]
 
-    for invoice in data:
+def load_invoices(data=None):
+    """
+    Returns the invoices to export: the given list or ResultStore, otherwise the result store,
+    or the JSON file when there is no store yet.
+    """
+    if data is None and os.path.exists(STORE_FOLDER):
+        data = ResultStore()
+    if data is None:
+        with open(JSON_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    return data
+
+def iter_rows(invoices):
+    """Yields one flat row (a tuple in COLUMNS order) per line item, without materializing them."""
+    for invoice in invoices:
         for item in invoice.get("items", []):
-            structured_data.append({
-                "Invoice Number": invoice.get("invoice_number", ""),
-                "Invoice Date": invoice.get("invoice_date", ""),
-                "Supplier GST": invoice.get("supplier_gst_number", ""),
-                "Bill-To GST": invoice.get("bill_to_gst_number", ""),
-                "PO Number": invoice.get("po_number", ""),
-                "Shipping Address": invoice.get("shipping_address", ""),
-                "Seal & Sign": invoice.get("seal_and_sign_present", ""),
-                "No. of Items": invoice.get("no_items", ""),
-                "Serial Number": item.get("serial_number", ""),
-                "Description": item.get("description", ""),
-                "HSN/SAC": item.get("hsn_sac", ""),
-                "Quantity": item.get("quantity", ""),
-                "Unit Price": item.get("unit_price", ""),
-                "Total Amount": item.get("total_amount", "")
-            })
-
-    # Convert structured data to DataFrame
-    df = pd.DataFrame(structured_data)
-
-    # Save to Excel
-    df.to_excel(EXCEL_OUTPUT_FILE, index=False)
-
-    print(f"Structured invoice data saved as {EXCEL_OUTPUT_FILE}")
+            row = []
+            for _, invoice_field, item_field, _ in COLUMNS:
+                if invoice_field == "pages":
+                    row.append(", ".join(map(str, invoice.get("pages", []))))
+                elif invoice_field is not None:
+                    row.append(invoice.get(invoice_field, ""))
+                else:
+                    row.append(item.get(item_field, ""))
+            yield tuple(row)
+
+
+class ExcelWriter:
+    """Write-only workbook that streams rows to disk and starts a new sheet when one is full."""
+
+    def __init__(self, path, max_rows=EXCEL_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self.sheets = 0
+
+    def _new_sheet(self):
+        self.sheets += 1
+        title = SHEET_NAME if self.sheets == 1 else f"{SHEET_NAME} ({self.sheets})"
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(HEADERS)
+        self.sheet_rows = 1
+
+    def write(self, row):
+        if self.sheet is None or self.sheet_rows >= self.max_rows:
+            self._new_sheet()
+        self.sheet.append([_excel_value(value) for value in row])
+        self.sheet_rows += 1
+
+    def close(self):
+        if self.sheet is None:
+            self._new_sheet()  # Header-only sheet for an empty export
+        self.workbook.save(self.path)
+
+
+class CsvWriter:
+    """Streams rows to a UTF-8 CSV file (with BOM, so Excel detects the encoding)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(HEADERS)
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Buffers rows into fixed-schema row groups of `batch_size` rows."""
+
+    def __init__(self, path, batch_size=PARQUET_BATCH_SIZE):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.path = path
+        self.batch_size = batch_size
+        self.kinds = [kind for _, _, _, kind in COLUMNS]
+        self.schema = pa.schema([(header, getattr(pa, kind)()) for header, kind in zip(HEADERS, self.kinds)])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        arrays = [self.pa.array([_parquet_value(value, kind) for value in column], type=field.type)
+                  for column, kind, field in zip(zip(*self.rows), self.kinds, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self.rows:
+            self._flush()
+        self.writer.close()
+
+
+WRITERS = {
+    "xlsx": (ExcelWriter, EXCEL_OUTPUT_FILE),
+    "csv": (CsvWriter, CSV_OUTPUT_FILE),
+    "parquet": (ParquetWriter, PARQUET_OUTPUT_FILE),
+}
+
+def _excel_value(value):
+    """Cells hold only scalars; anything nested is written as JSON text."""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+def _parquet_value(value, kind):
+    if value is None or value == "":
+        return None
+    if kind == "float64":
+        try:
+            return float(str(value).replace(",", ""))
+        except ValueError:
+            return None
+    if kind == "bool_":
+        return bool(value)
+    return value if isinstance(value, str) else json.dumps(value)
+
+def validate_export_formats(formats):
+    """Raises ValueError for unknown export formats."""
+    unknown = [name for name in formats if name not in WRITERS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(unknown)}. Available: {', '.join(EXPORT_FORMATS)}")
+
+def export_invoices(data=None, formats=None, paths=None):
+    """
+    Writes one row per line item to every requested format ("xlsx", "csv", "parquet") in a single
+    streaming pass over the invoices, so memory stays constant regardless of how many there are.
+    `paths` optionally maps a format to its output file. Returns {format: path}.
+    """
+    formats = formats or DEFAULT_EXPORT_FORMATS
+    validate_export_formats(formats)
+    paths = {name: (paths or {}).get(name, WRITERS[name][1]) for name in formats}
+
+    for path in paths.values():
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    writers = [WRITERS[name][0](paths[name]) for name in formats]
+    rows = 0
+    try:
+        for row in iter_rows(load_invoices(data)):
+            for writer in writers:
+                writer.write(row)
+            rows += 1
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for name, path in paths.items():
+        print(f"Structured invoice data saved as {path} ({rows} rows)")
+    return paths
+
+def export_store(store, formats=None, full=False):
+    """
+    Exports a ResultStore. The first export, and any export with `full`, regenerates
+    extracted_data.json, the line-item exports and the Parquet analytics files from the whole store.
+    Later exports only read and write the invoices stored since the previous one (from the store
+    position saved at that export), to output/updates/extracted_data-<time>.json and .xlsx (or the
+    given `formats`), so each run or watch batch costs as much as its new invoices, not the whole
+    history. extracted_data.json and the line-item exports in output/ are then left as they were.
+    Returns {format: path} of the files written (empty when nothing new was stored).
+    """
+    checkpoint = store.checkpoint()
+    since = store.last_export()
+
+    if full or since is None:
+        paths = export_invoices(store, formats=formats)
+        paths["json"] = store.export_json(JSON_FILE)
+        store.export_parquet()
+    else:
+        invoices = list(store.iter_invoices(since=since, until=checkpoint))
+        paths = {}
+        if invoices:
+            now = time.time()
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+            base = os.path.join(UPDATES_FOLDER, f"extracted_data-{stamp}")
+            paths = export_invoices(invoices, formats=formats,
+                                    paths={name: f"{base}.{name}" for name in formats or DEFAULT_EXPORT_FORMATS})
+            with open(f"{base}.json", "w", encoding="utf-8") as f:
+                json.dump(invoices, f, indent=4)
+            paths["json"] = f"{base}.json"
+        print(f"Exported {len(invoices)} invoice(s) stored since the last export to {UPDATES_FOLDER}; "
+              f"use --full-export to regenerate {JSON_FILE} and the full exports")
+
+    store.set_last_export(checkpoint)
+    return paths
+
+def json_to_excel(data=None):
+    """
+    Reads parsed JSON and converts it into a structured Excel file.
+    Uses the given invoices (a list or a ResultStore) when called in-process; otherwise streams
+    the result store, or reads the JSON file when there is no store yet.
+    """
+    return export_invoices(data, formats=["xlsx"])["xlsx"]
 
 if __name__ == "__main__":
-    json_to_excel()
\ No newline at end of file
+    json_to_excel()
@@ -0,0 +1,316 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils import metrics
+
+# Define index location
+DEDUP_INDEX_FILE = "output/dedup_index.sqlite"
+
+# Perceptual page hashes: a difference hash of each page rendered as a small thumbnail
+THUMBNAIL_DPI = 24       # Enough for the page layout, and cheap to render
+HASH_SIZE = 16           # 16x16 grid: 256-bit hashes
+HASH_BANDS = 8           # Hashes are indexed as 8 bands of 32 bits...
+MAX_HASH_DISTANCE = 7    # ...so every page within this many differing bits shares a band (pigeonhole)
+MAX_CANDIDATES = 16      # Most recently indexed documents compared per band, keeping lookups bounded for common layouts
+
+# Invoice numbers of near-duplicate pages may differ by this many characters (OCR errors in scans)
+MAX_NUMBER_EDITS = 1
+
+
+def normalize_key(value):
+    """Case and punctuation-insensitive form of a GSTIN or invoice number, e.g. "inv/2024-07" -> "INV202407"."""
+    return re.sub(r"[^A-Z0-9]", "", str(value or "").upper())
+
+def business_key(supplier_gst_number, invoice_number):
+    """(supplier GSTIN, invoice number) key identifying an invoice, or None if either is missing."""
+    supplier, number = normalize_key(supplier_gst_number), normalize_key(invoice_number)
+    return f"{supplier}|{number}" if supplier and number else None
+
+def dhash(gray, size=HASH_SIZE):
+    """Difference hash of a grayscale image: one bit per horizontally adjacent pair of cells."""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def hash_bands(page_hash):
+    """Splits a page hash into HASH_BANDS integers of equal width."""
+    width = HASH_SIZE * HASH_SIZE // HASH_BANDS
+    return [(page_hash >> (band * width)) & ((1 << width) - 1) for band in range(HASH_BANDS)]
+
+def thumbnail_hashes(pdf_path):
+    """Renders every page of a PDF as a THUMBNAIL_DPI thumbnail and returns their perceptual hashes."""
+    from pdf2image import convert_from_path
+    from utils.preprocess import POPPLER_PATH
+
+    thumbnails = convert_from_path(pdf_path, dpi=THUMBNAIL_DPI, grayscale=True, poppler_path=POPPLER_PATH)
+    return [dhash(np.asarray(thumbnail)) for thumbnail in thumbnails]
+
+def _within_edits(a, b, max_edits=MAX_NUMBER_EDITS):
+    """True if strings a and b differ by at most `max_edits` insertions, deletions or substitutions."""
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+
+class DedupIndex:
+    """
+    SQLite index of every PDF and invoice seen, catching re-sent invoices in three layers:
+    1. exact: SHA-256 of the PDF, checked before anything is rendered;
+    2. perceptual: hashes of page thumbnails, which find re-exported or re-scanned copies. Recurring
+       invoices from one supplier can look identical at thumbnail size, so a perceptual match only
+       nominates candidates that are confirmed by their invoice number before the LLM is called;
+    3. business key: (supplier GSTIN, invoice number), from the fast-path fields before the LLM call
+       and from the parsed invoice after it.
+    Every lookup is a primary-key or indexed read, so it stays fast with millions of stored invoices.
+    """
+
+    def __init__(self, path=DEDUP_INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                pdf_hash TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                page_hashes TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                completed_at REAL
+            )
+        """)
+        if "completed_at" not in [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]:
+            # Indexes written before completion was tracked: their PDFs count as completed
+            self._conn.execute("ALTER TABLE documents ADD COLUMN completed_at REAL")
+            self._conn.execute("UPDATE documents SET completed_at = first_seen")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS page_bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                pdf_hash TEXT NOT NULL,
+                first_seen REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (band, value, pdf_hash)
+            ) WITHOUT ROWID
+        """)
+        if "first_seen" not in [row[1] for row in self._conn.execute("PRAGMA table_info(page_bands)")]:
+            # Indexes written before bands were ordered by recency: copy each document's time over
+            self._conn.execute("ALTER TABLE page_bands ADD COLUMN first_seen REAL NOT NULL DEFAULT 0")
+            self._conn.execute("""
+                UPDATE page_bands SET first_seen = COALESCE(
+                    (SELECT first_seen FROM documents WHERE documents.pdf_hash = page_bands.pdf_hash), 0)
+            """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                business_key TEXT PRIMARY KEY,
+                invoice_id TEXT NOT NULL,
+                source TEXT,
+                first_seen REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS duplicates (
+                source TEXT NOT NULL,
+                duplicate_of TEXT NOT NULL,
+                layer TEXT NOT NULL,
+                detail TEXT,
+                detected_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_page_bands_recent ON page_bands(band, value, first_seen DESC)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_source ON invoices(source)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_source ON duplicates(source)")
+        self._conn.commit()
+
+    # Layers 1 and 2: whole PDFs
+
+    def check_pdf(self, pdf_path, pdf_hash):
+        """
+        Checks a PDF before it is rendered. Returns ("exact", original source) for a byte-identical copy
+        of a PDF seen under another name whose invoices were stored (see `complete_pdf`), which should
+        be skipped. Otherwise the PDF is indexed and ("near", [sources]) lists earlier PDFs whose pages
+        look the same, or (None, None) if there are none.
+        The same file seen again under its own name (a rerun) is never a duplicate, and neither is a
+        copy of a PDF that failed before its invoices were stored: it is processed again. Two processes
+        seeing the same PDF at once then both parse it, and the business-key layer stores its invoices once.
+        """
+        source = os.path.basename(pdf_path)
+        with self._lock:
+            registered = self._conn.execute(
+                "INSERT OR IGNORE INTO documents (pdf_hash, source, page_hashes, first_seen) VALUES (?, ?, '[]', ?)",
+                (pdf_hash, source, time.time()),
+            ).rowcount
+            self._conn.commit()
+            row = None if registered else self._conn.execute(
+                "SELECT source, completed_at FROM documents WHERE pdf_hash = ?", (pdf_hash,)).fetchone()
+        if row is not None:
+            if row[0] == source:
+                return None, None
+            if row[1] is not None:
+                self.record_duplicate(source, row[0], "exact")
+                return "exact", row[0]
+            print(f"{source} is a copy of {row[0]}, which was never completed: processing it again")
+
+        try:
+            page_hashes = thumbnail_hashes(pdf_path)
+        except Exception as e:
+            # Still index the PDF, so the exact layer catches copies of it
+            print(f"Could not hash the pages of {source}: {e}")
+            page_hashes = []
+        earlier = {source, row[0]} if row is not None else {source}  # Not similar to itself under its earlier name
+        similar = [match for match in self.find_similar(page_hashes) if match not in earlier]
+        self.add_document(pdf_hash, source, page_hashes)
+        if similar:
+            metrics.increment("near_duplicate_candidates_total")
+            return "near", similar
+        return None, None
+
+    def complete_pdf(self, pdf_hash):
+        """Marks an indexed PDF as fully processed: from now on, copies of it are exact duplicates."""
+        with self._lock:
+            self._conn.execute("UPDATE documents SET completed_at = ? WHERE pdf_hash = ?", (time.time(), pdf_hash))
+            self._conn.commit()
+
+    def find_similar(self, page_hashes):
+        """
+        Sources of indexed PDFs with as many pages, each within MAX_HASH_DISTANCE bits of `page_hashes`.
+        Only the MAX_CANDIDATES most recently indexed PDFs sharing a band are compared: a re-sent
+        invoice is most likely a copy of a recent one, not of the oldest PDF with the same layout.
+        """
+        if not page_hashes:
+            return []
+
+        with self._lock:
+            candidates = set()
+            for band, value in enumerate(hash_bands(page_hashes[0])):
+                rows = self._conn.execute(
+                    "SELECT pdf_hash FROM page_bands WHERE band = ? AND value = ? ORDER BY first_seen DESC LIMIT ?",
+                    (band, value, MAX_CANDIDATES),
+                ).fetchall()
+                candidates.update(row[0] for row in rows)
+            documents = [self._conn.execute("SELECT source, page_hashes FROM documents WHERE pdf_hash = ?",
+                                            (candidate,)).fetchone() for candidate in candidates]
+
+        similar = []
+        for source, hashes in filter(None, documents):
+            hashes = [int(value, 16) for value in json.loads(hashes)]
+            if len(hashes) == len(page_hashes) and all(
+                    hamming(a, b) <= MAX_HASH_DISTANCE for a, b in zip(hashes, page_hashes)):
+                similar.append(source)
+        return similar
+
+    def add_document(self, pdf_hash, source, page_hashes):
+        """Indexes a PDF by its content hash and the bands of its first page's hash."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (pdf_hash, source, page_hashes, first_seen) VALUES (?, ?, ?, ?)",
+                (pdf_hash, source, json.dumps([format(value, "x") for value in page_hashes]), now),
+            )
+            if page_hashes:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO page_bands (band, value, pdf_hash, first_seen) VALUES (?, ?, ?, ?)",
+                    [(band, value, pdf_hash, now) for band, value in enumerate(hash_bands(page_hashes[0]))],
+                )
+            self._conn.commit()
+
+    # Layer 3: parsed invoices
+
+    def find_invoice(self, supplier_gst_number, invoice_number, invoice_id, near_duplicates=None):
+        """
+        Returns (invoice_id, layer) of the earlier invoice this one duplicates: one with the same
+        (supplier GSTIN, invoice number) ("business_key"), or among invoices of the near-duplicate PDFs
+        `near_duplicates`, one with the same supplier and an invoice number at most MAX_NUMBER_EDITS
+        characters off ("perceptual"). None if the invoice is new (or is `invoice_id` itself, parsed again).
+        """
+        key = business_key(supplier_gst_number, invoice_number)
+        if key is None:
+            return None
+
+        layer = "business_key"
+        with self._lock:
+            row = self._conn.execute("SELECT invoice_id FROM invoices WHERE business_key = ?", (key,)).fetchone()
+            if row is None and near_duplicates:
+                layer = "perceptual"
+                rows = self._conn.execute(
+                    f"SELECT business_key, invoice_id FROM invoices WHERE source IN ({','.join('?' * len(near_duplicates))})",
+                    list(near_duplicates),
+                ).fetchall()
+                supplier, number = key.split("|")
+                row = next(((original,) for other_key, original in rows
+                            if other_key.split("|")[0] == supplier and _within_edits(other_key.split("|")[1], number)),
+                           None)
+
+        if row is None or row[0] == invoice_id:
+            return None
+        return row[0], layer
+
+    def claim_invoice(self, invoice, near_duplicates=None):
+        """
+        Registers a parsed invoice under its business key. Returns (invoice_id, layer) of the earlier
+        invoice it duplicates (and registers nothing), or None when it is new.
+        """
+        supplier, number = invoice.get("supplier_gst_number"), invoice.get("invoice_number")
+        duplicate = self.find_invoice(supplier, number, invoice.get("invoice_id"), near_duplicates)
+        if duplicate is not None:
+            return duplicate
+
+        key = business_key(supplier, number)
+        if key is None:
+            return None
+        with self._lock:
+            registered = self._conn.execute(
+                "INSERT OR IGNORE INTO invoices (business_key, invoice_id, source, first_seen) VALUES (?, ?, ?, ?)",
+                (key, invoice.get("invoice_id"), invoice.get("source_file"), time.time()),
+            ).rowcount
+            self._conn.commit()
+        if registered:
+            return None
+        # Another process registered the same invoice since the lookup above
+        return self.find_invoice(supplier, number, invoice.get("invoice_id"))
+
+    # Links from duplicates to their originals
+
+    def record_duplicate(self, source, duplicate_of, layer, detail=None):
+        """Links a skipped PDF or invoice to the record it duplicates."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO duplicates (source, duplicate_of, layer, detail, detected_at) VALUES (?, ?, ?, ?, ?)",
+                (source, duplicate_of, layer, detail, time.time()),
+            )
+            self._conn.commit()
+        metrics.increment("duplicates_total", layer=layer)
+
+    def duplicates_of(self, source):
+        """Every recorded link of a PDF or invoice to its originals, as {"duplicate_of", "layer", "detail"} dicts."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT duplicate_of, layer, detail FROM duplicates WHERE source = ? ORDER BY detected_at", (source,)
+            ).fetchall()
+        return [{"duplicate_of": original, "layer": layer, "detail": detail} for original, layer, detail in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
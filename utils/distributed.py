@@ -0,0 +1,333 @@
+import heapq
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from utils import metrics
+from utils.document import PipelineContext
+from utils.result_store import ResultStore
+
+# Leases: a node holds a PDF for LEASE_SECONDS and renews it while processing, so only the PDFs
+# of a node that crashed or hung become claimable again, once their lease expires.
+# Node clocks must agree to well within LEASE_SECONDS.
+LEASE_SECONDS = 300
+RENEWALS_PER_LEASE = 3       # A running lease is renewed every LEASE_SECONDS / 3
+POLL_SECONDS = 5.0           # Idle nodes re-check leased PDFs this often, in case a lease expires
+MAX_ATTEMPTS = 3             # A PDF whose lease expired this many times is recorded as failed
+MERGE_BATCH_SIZE = 500       # Invoices appended to the merged store per write
+
+
+def default_node_id():
+    """Identifies this node in leases and shard names, e.g. "worker-3-12345"."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _write_json(path, data):
+    """Replaces a small JSON file atomically (readers see the old or the new content, never a mix)."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SharedBatch:
+    """
+    Layout of a batch directory shared by every node:
+      input/               PDFs to process
+      leases/<pdf>.<n>.lease   the node processing a PDF on its n-th attempt, and until when
+      done/<pdf>.json      finished PDFs (node, invoice count, error if any); delete one to retry it
+      shards/<node>/       each node's result store and metrics
+      results/, extracted_data.*, verifiability_report.json   written by `merge_shards`
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.input_dir = os.path.join(folder, "input")
+        self.lease_dir = os.path.join(folder, "leases")
+        self.done_dir = os.path.join(folder, "done")
+        self.shard_dir = os.path.join(folder, "shards")
+        for path in (self.input_dir, self.lease_dir, self.done_dir, self.shard_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def done_path(self, filename):
+        return os.path.join(self.done_dir, f"{filename}.json")
+
+    def pending(self):
+        """Input PDFs without a done marker, in name order."""
+        done = {name[:-len(".json")] for name in os.listdir(self.done_dir) if name.endswith(".json")}
+        return sorted(name for name in os.listdir(self.input_dir) if name.lower().endswith(".pdf") and name not in done)
+
+    def is_done(self, filename):
+        return os.path.exists(self.done_path(filename))
+
+    def mark_done(self, filename, node, invoices=0, error=None, duplicate_of=None):
+        _write_json(self.done_path(filename), {"node": node, "finished_at": time.time(), "invoices": invoices,
+                                               "error": error, "duplicate_of": duplicate_of})
+
+    def done_records(self):
+        """Every done marker, as {pdf filename: marker}."""
+        records = {}
+        for name in os.listdir(self.done_dir):
+            if name.endswith(".json"):
+                with open(os.path.join(self.done_dir, name), "r", encoding="utf-8") as f:
+                    records[name[:-len(".json")]] = json.load(f)
+        return records
+
+    def node_folder(self, node):
+        return os.path.join(self.shard_dir, node)
+
+    def shard_store(self, node):
+        return ResultStore(os.path.join(self.node_folder(node), "results"))
+
+    def shard_stores(self):
+        return [self.shard_store(node) for node in sorted(os.listdir(self.shard_dir))
+                if os.path.isdir(os.path.join(self.shard_dir, node, "results"))]
+
+
+class Lease:
+    """
+    A node's claim on one PDF: a file leases/<pdf>.<attempt>.lease created with O_EXCL, so exactly
+    one node can hold each attempt. An expired lease is reclaimed by creating the next attempt's
+    file, never by replacing the expired one, so of several nodes reclaiming it only one succeeds;
+    the node holding the older attempt sees the newer file and knows it lost the lease.
+    """
+
+    def __init__(self, folder, filename, node, seconds=LEASE_SECONDS, attempt=1):
+        self.folder = folder
+        self.filename = filename
+        self.node = node
+        self.seconds = seconds
+        self.attempt = attempt
+        self.path = self.path_for(folder, filename, attempt)
+        self.token = uuid.uuid4().hex
+
+    def _content(self):
+        return {"node": self.node, "token": self.token, "attempt": self.attempt,
+                "acquired_at": time.time(), "expires_at": time.time() + self.seconds}
+
+    @staticmethod
+    def path_for(folder, filename, attempt):
+        return os.path.join(folder, f"{filename}.{attempt}.lease")
+
+    @staticmethod
+    def attempts(folder, filename):
+        """Attempt numbers with a lease file for `filename`, in increasing order."""
+        prefix = f"{filename}."
+        numbers = (name[len(prefix):-len(".lease")] for name in os.listdir(folder)
+                   if name.startswith(prefix) and name.endswith(".lease"))
+        return sorted(int(number) for number in numbers if number.isdigit())
+
+    @staticmethod
+    def read(path, seconds=LEASE_SECONDS):
+        """Current content of a lease file, or None if there is none."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError):
+            # Being written, or left empty by a node that died right after creating it: expires with its mtime
+            try:
+                return {"node": None, "expires_at": os.path.getmtime(path) + seconds}
+            except OSError:
+                return None
+
+    @classmethod
+    def acquire(cls, folder, filename, node, seconds=LEASE_SECONDS):
+        """Returns the lease on `filename` for `node`, or None if another node holds an unexpired lease."""
+        attempts = cls.attempts(folder, filename)
+        attempt = 1
+        current = None
+        if attempts:
+            current = cls.read(cls.path_for(folder, filename, attempts[-1]), seconds)
+            if current is not None and current["expires_at"] > time.time():
+                return None
+            attempt = attempts[-1] + 1
+
+        lease = cls(folder, filename, node, seconds, attempt)
+        try:
+            fd = os.open(lease.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None  # Another node claimed this attempt first
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(lease._content(), f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Our view of the attempts may have been stale: a newer attempt means someone else reclaimed it
+        if not lease.held():
+            os.remove(lease.path)
+            return None
+        if attempt > 1:
+            metrics.increment("leases_reclaimed_total")
+            print(f"Reclaimed the expired lease of {(current or {}).get('node') or 'an unknown node'} on {filename}")
+        return lease
+
+    def held(self):
+        """True while this lease's file is ours and no node has reclaimed it with a newer attempt."""
+        current = self.read(self.path, self.seconds)
+        if current is None or current.get("token") != self.token:
+            return False
+        return max(self.attempts(self.folder, self.filename), default=0) == self.attempt
+
+    def renew(self):
+        """Extends the lease; returns False if it was lost (expired and reclaimed by another node)."""
+        if not self.held():
+            return False
+        _write_json(self.path, self._content())
+        return True
+
+    def release(self):
+        """Removes every attempt's lease file, once the PDF is done; a lost lease leaves them to its new holder."""
+        if self.held():
+            for attempt in self.attempts(self.folder, self.filename):
+                try:
+                    os.remove(self.path_for(self.folder, self.filename, attempt))
+                except FileNotFoundError:
+                    pass
+
+
+def _keep_renewed(lease, stop):
+    """Thread body: renews `lease` until `stop` is set."""
+    while not stop.wait(lease.seconds / RENEWALS_PER_LEASE):
+        if not lease.renew():
+            print(f"Lost the lease on {lease.filename}; another node may process it again")
+            metrics.increment("leases_lost_total")
+            return
+
+def process_leased(filename, lease, batch, context, node):
+    """Streams one leased PDF through every stage into this node's shard, then marks it done."""
+    from utils.streaming import stream_pdfs
+
+    stop = threading.Event()
+    renewer = threading.Thread(target=_keep_renewed, args=(lease, stop), name="lease-renewer", daemon=True)
+    renewer.start()
+    start = time.perf_counter()
+    invoices, error, duplicate_of = 0, None, None
+    try:
+        items = list(stream_pdfs([os.path.join(batch.input_dir, filename)], context))
+        invoices = sum(len(item.invoices) for item in items)
+        if not items:
+            # Skipped PDFs are duplicates of earlier ones; anything else failed in a stage
+            duplicates = context.dedup.duplicates_of(filename) if context.dedup is not None else []
+            if duplicates:
+                duplicate_of = duplicates[-1]["duplicate_of"]
+            else:
+                error = "The PDF could not be processed, see the node's log"
+    except Exception as e:
+        error = str(e)
+    finally:
+        stop.set()
+        renewer.join()
+
+    batch.mark_done(filename, node, invoices, error, duplicate_of)
+    lease.release()
+    metrics.increment("distributed_pdfs_total", status="failed" if error else "done")
+    print(f"{'❌' if error else '✅'} {filename}: {error or f'{invoices} invoice(s)'} "
+          f"in {time.perf_counter() - start:.2f}s (attempt {lease.attempt})")
+    return error is None
+
+def run_node(shared_dir, node=None, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS, **options):
+    """
+    Runs one node of a distributed batch over `shared_dir` (see SharedBatch): claims pending PDFs
+    one at a time with a lease, processes them into the node's own shard and returns once every
+    PDF is done, by this node or another. While the remaining PDFs are leased by other nodes it
+    keeps polling, so PDFs of a node that crashes are taken over when their lease expires.
+    Takes the same options as `run_pipeline`; the result store is replaced by the node's shard.
+    """
+    node = node or default_node_id()
+    batch = SharedBatch(shared_dir)
+    context = PipelineContext(input_dir=batch.input_dir, **options)
+    context.store = batch.shard_store(node)
+    context.warm_pools = True  # PDFs are streamed one at a time; start the render pool once
+    print(f"🛰️ Node {node} processing {batch.input_dir}")
+
+    processed = failed = 0
+    start = time.perf_counter()
+    while True:
+        pending = batch.pending()
+        if not pending:
+            break
+
+        claimed = False
+        for filename in pending:
+            lease = Lease.acquire(batch.lease_dir, filename, node, lease_seconds)
+            if lease is None:
+                continue
+            if batch.is_done(filename):  # Finished by another node since the listing
+                lease.release()
+                continue
+
+            claimed = True
+            if lease.attempt > MAX_ATTEMPTS:
+                batch.mark_done(filename, node, error=f"Abandoned after {MAX_ATTEMPTS} expired leases")
+                lease.release()
+                failed += 1
+                print(f"❌ {filename}: abandoned after {MAX_ATTEMPTS} expired leases")
+                continue
+
+            if process_leased(filename, lease, batch, context, node):
+                processed += 1
+            else:
+                failed += 1
+
+        if not claimed:
+            time.sleep(poll_seconds)  # Everything left is leased by other nodes
+
+    if context.cache is not None:
+        context.cache.evict()
+    metrics.write_json(os.path.join(batch.node_folder(node), "metrics.json"))
+    print(f"Node {node} finished: {processed} PDF(s) processed, {failed} failed, "
+          f"in {time.perf_counter() - start:.2f}s. Merge the shards with --merge-shards.")
+    return processed, failed
+
+def merge_shards(shared_dir, export_formats=None):
+    """
+    Combines every node's shard into `shared_dir`: the result store `results/` (rebuilt from the shards,
+    with the latest record of each invoice), `extracted_data.json`, the line-item exports and
+    `verifiability_report.json`. Returns the report.
+    """
+    from utils.convert_to_excel import export_invoices
+    from utils.validator import build_verifiability_report
+
+    batch = SharedBatch(shared_dir)
+    results_dir = os.path.join(shared_dir, "results")
+    building_dir = f"{results_dir}.merging"
+    shutil.rmtree(building_dir, ignore_errors=True)
+    merged = ResultStore(building_dir)
+
+    # Shards are each in write order, so merging them by time keeps the latest record of an invoice last
+    records = heapq.merge(*(store.iter_records() for store in batch.shard_stores()), key=lambda record: record["stored_at"])
+    invoices = []
+    for record in records:
+        invoices.append(record["invoice"])
+        if len(invoices) >= MERGE_BATCH_SIZE:
+            merged.append(invoices)
+            invoices = []
+    merged.append(invoices)
+
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.replace(building_dir, results_dir)
+    merged = ResultStore(results_dir)
+
+    merged.export_json(os.path.join(shared_dir, "extracted_data.json"))
+    formats = export_formats or ["xlsx"]
+    export_invoices(merged, formats=formats,
+                    paths={name: os.path.join(shared_dir, f"extracted_data.{name}") for name in formats})
+
+    report = build_verifiability_report(merged)
+    with open(os.path.join(shared_dir, "verifiability_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+    done = batch.done_records()
+    failures = {name: record["error"] for name, record in done.items() if record.get("error")}
+    print(f"Merged {len(merged)} invoice(s) from {len(batch.shard_stores())} shard(s); "
+          f"{len(done)} PDF(s) done, {len(failures)} failed, {len(batch.pending())} still pending")
+    for name, error in sorted(failures.items()):
+        print(f"  {name}: {error}")
+    return report
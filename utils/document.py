@@ -0,0 +1,168 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+import numpy as np
+
+# Matches page image names written by preprocess.py, e.g. sample_invoice.pdf_page_1_processed.jpg
+PAGE_IMAGE_PATTERN = re.compile(r"^(?P<source>.+)_page_(?P<page>\d+)_(?P<kind>original|processed)\.(?:jpg|png)$")
+# Matches OCR text files written by ocr_utils.py, e.g. sample_invoice.pdf_page_1_processed.jpg.txt
+PAGE_TEXT_PATTERN = re.compile(r"^(?P<source>.+)_page_(?P<page>\d+)_processed\.jpg\.txt$")
+
+
+@dataclass
+class Page:
+    """A single invoice page as it moves between pipeline stages."""
+    source: str                             # PDF filename, e.g. sample_invoice.pdf
+    page_number: int                        # 1-based page index within the PDF
+    original: Optional[np.ndarray] = None   # BGR page as rendered from the PDF
+    processed: Optional[np.ndarray] = None  # Grayscale page after preprocessing
+    original_path: Optional[str] = None
+    processed_path: Optional[str] = None
+    text: Optional[str] = None
+    words: Optional[List[dict]] = None      # OCR words with boxes and confidences (see ocr_utils.extract_words)
+    seal_detected: bool = False
+    seal_score: Optional[float] = None      # Highest seal/signature detection score (0.0 if none), None if not checked
+    content_hash: Optional[str] = None      # SHA-256 of the source PDF
+    cache_key: Optional[str] = None         # Content key of the rendered page (see utils.cache)
+    timings: dict = field(default_factory=dict)  # Seconds spent on this page per step, measured where it ran
+    pdf_path: Optional[str] = None          # Source PDF, for rendering the page lazily
+    text_layer: bool = False                # Text and words come from the PDF's text layer, not OCR
+    preprocess: Optional[dict] = None       # Adaptive preprocessing profile and quality estimate (see preprocess.adaptive_preprocess)
+    near_duplicates: Optional[List[str]] = None  # Earlier PDFs whose pages look the same (see utils.dedup)
+
+    @property
+    def name(self):
+        """Base name shared by every artifact of this page."""
+        return f"{self.source}_page_{self.page_number}"
+
+    @property
+    def original_filename(self):
+        return f"{self.name}_original.jpg"
+
+    @property
+    def processed_filename(self):
+        return f"{self.name}_processed.jpg"
+
+    @property
+    def text_filename(self):
+        return f"{self.processed_filename}.txt"
+
+    @property
+    def json_filename(self):
+        return f"{self.processed_filename}.json"
+
+
+@dataclass
+class InvoiceDocument:
+    """One invoice assembled from consecutive pages of a PDF (see utils.assembler)."""
+    source: str                             # PDF filename
+    index: int                              # 1-based invoice index within the PDF
+    pages: List[Page] = field(default_factory=list)
+    text: Optional[str] = None              # Compacted text of all pages, sent to the parser once
+
+    @property
+    def name(self):
+        return f"{self.source}_invoice_{self.index}"
+
+    @property
+    def json_filename(self):
+        return f"{self.name}.json"
+
+    @property
+    def page_numbers(self):
+        return [page.page_number for page in self.pages]
+
+    @property
+    def words(self):
+        """OCR words of all pages, or None when no page has any."""
+        words = [word for page in self.pages for word in (page.words or [])]
+        return words or None
+
+    @property
+    def seal_detected(self):
+        return any(page.seal_detected for page in self.pages)
+
+    @property
+    def near_duplicates(self):
+        """Earlier PDFs that look like this invoice's PDF, or None."""
+        return self.pages[0].near_duplicates if self.pages else None
+
+    @property
+    def seal_score(self):
+        """Highest seal/signature detection score of the pages, or None when no page was checked."""
+        scores = [page.seal_score for page in self.pages if page.seal_score is not None]
+        return max(scores) if scores else None
+
+
+@dataclass
+class PipelineContext:
+    """State handed from one pipeline stage to the next."""
+    input_dir: str = "input"
+    workers: Optional[int] = None   # Worker processes for rendering and OCR (default: all cores)
+    warm_pools: bool = False        # Keep the render pool alive between streamed batches (long-running workers)
+    keep_images: bool = True        # Hold page images in memory between stages instead of re-reading them
+    max_in_flight_pages: Optional[int] = None  # Pages being rendered or waiting for the next stage (default: 2 tasks per worker)
+    save_debug_images: bool = False # Also write preprocessed pages to output/images/processed
+    filter_chain: Optional[List[str]] = None  # Fixed preprocessing filters (default: adaptive profile per page)
+    cache: Optional[Any] = None     # utils.cache.ContentCache, or None to recompute every stage
+    llm_cache: Optional[Any] = None # utils.llm_cache.LLMCache, or None to call the LLM for every page
+    seal_batch_size: Optional[int] = None  # Pages per YOLO call (default: image_utils.BATCH_SIZE)
+    seal_image_size: Optional[int] = None  # YOLO input resolution (default: image_utils.IMAGE_SIZE)
+    seal_region: Optional[str] = None      # "full" or "bottom" (default: image_utils.DEFAULT_REGION)
+    seal_manifest: Optional[Any] = None    # utils.seal_manifest.SealManifest recording every page's detections
+    save_seal_crops: bool = True    # Write each detected seal/signature to output/seal_signatures
+    dedup: Optional[Any] = None     # utils.dedup.DedupIndex skipping re-sent PDFs and invoices
+    llm_concurrency: Optional[int] = None  # Concurrent LLM calls while parsing (default: parser.LLM_CONCURRENCY)
+    llm_chain: Optional[Any] = None # Runnable used instead of the Groq chain, e.g. built on utils.fake_llm
+    fast_path: bool = True          # Take confidently matched fields from utils.fast_extract instead of the LLM
+    store: Optional[Any] = None     # utils.result_store.ResultStore receiving parsed invoices
+    export_formats: Optional[List[str]] = None  # Flat line-item exports (default: convert_to_excel.DEFAULT_EXPORT_FORMATS)
+    full_export: bool = False       # Re-export the whole result store instead of only newly stored invoices
+    metrics_file: Optional[str] = None     # JSON metrics written after each run (default: metrics.METRICS_FILE)
+    profile_stages: Optional[List[str]] = None  # Stages run under cProfile (see metrics.profile)
+    text_layer: bool = True         # Read born-digital pages from their text layer instead of rendering and OCR
+    pages: List[Page] = field(default_factory=list)
+    documents: List[InvoiceDocument] = field(default_factory=list)
+    invoices: Optional[List[dict]] = None
+    report: Optional[dict] = None
+
+
+def load_pages_from_folder(folder, kind):
+    """
+    Rebuilds Page objects from images previously written to disk.
+    `kind` is either "original" or "processed"; only the matching path is filled in.
+    """
+    pages = []
+    if not os.path.exists(folder):
+        return pages
+
+    for filename in sorted(os.listdir(folder)):
+        match = PAGE_IMAGE_PATTERN.match(filename)
+        if not match or match.group("kind") != kind:
+            continue
+
+        page = Page(source=match.group("source"), page_number=int(match.group("page")))
+        setattr(page, f"{kind}_path", os.path.join(folder, filename))
+        pages.append(page)
+
+    return pages
+
+def load_pages_from_text_folder(folder):
+    """Rebuilds Page objects, with their OCR text, from text files previously written to disk."""
+    pages = []
+    if not os.path.exists(folder):
+        return pages
+
+    for filename in sorted(os.listdir(folder)):
+        match = PAGE_TEXT_PATTERN.match(filename)
+        if not match:
+            continue
+
+        page = Page(source=match.group("source"), page_number=int(match.group("page")))
+        with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+            page.text = f.read().strip()
+        pages.append(page)
+
+    return pages
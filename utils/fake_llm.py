@@ -0,0 +1,83 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Answer returned by the fake model, shaped like a real Llama3 invoice response
+SAMPLE_RESPONSE = {
+    "invoice_number": "INV-0001",
+    "invoice_date": "15-02-2019",
+    "supplier_gst_number": "29AAHCS6672E1ZZ",
+    "bill_to_gst_number": "29AAFCA0924K1ZN",
+    "po_number": "PO-1001",
+    "shipping_address": "1450/1, INFANTRY ROAD, BENGALURU, 560001",
+    "seal_and_sign_present": False,
+    "no_items": 2,
+    "items": [
+        {"serial_number": 1, "description": "FRONT WHEEL", "hsn_sac": "8714", "quantity": 1, "unit_price": 70800, "total_amount": 70800},
+        {"serial_number": 2, "description": "ANO ADJUST", "hsn_sac": "8714", "quantity": 2, "unit_price": 30000, "total_amount": 60000},
+    ],
+}
+
+
+class FakeRateLimitError(Exception):
+    """Mimics the 429 error raised by the Groq client."""
+    status_code = 429
+
+
+class FakeInvoiceChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatGroq, for exercising the parser without network access.
+    Every call sleeps for `latency` seconds (plus up to `jitter`) and fails with a
+    FakeRateLimitError with probability `error_rate`.
+    """
+    latency: float = 0.2
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    response: str = json.dumps(SAMPLE_RESPONSE)
+    seed: Optional[int] = None
+    calls: int = 0
+    errors: int = 0
+
+    def model_post_init(self, __context: Any) -> None:
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-invoice-chat-model"
+
+    def _next_outcome(self):
+        """Counts the call and decides its delay and whether it fails."""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        delay, failed = self._next_outcome()
+        time.sleep(delay)
+        if failed:
+            raise FakeRateLimitError("Rate limit reached (fake 429)")
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        delay, failed = self._next_outcome()
+        await asyncio.sleep(delay)
+        if failed:
+            raise FakeRateLimitError("Rate limit reached (fake 429)")
+        return self._result()
@@ -0,0 +1,331 @@
+import re
+from itertools import combinations
+
+from utils.ocr_utils import value_confidence, word_confidence_index
+
+# A field is taken from the fast path only at or above this confidence
+CONFIDENCE_THRESHOLD = 0.9
+
+# Fields of the prompt_template schema filled by the fast path
+FIELDS = ["invoice_number", "invoice_date", "supplier_gst_number", "bill_to_gst_number",
+          "po_number", "shipping_address", "items"]
+
+GSTIN_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+GSTIN_PATTERN = re.compile(r"\b[0-9OIl]{2}[A-Z0-9]{5}[0-9OIl]{4}[A-Z0-9][A-Z0-9]Z[A-Z0-9]\b")
+# GSTIN positions that must be digits / letters, used to undo common OCR confusions
+GSTIN_DIGIT_POSITIONS = {0, 1, 7, 8, 9, 10}
+GSTIN_LETTER_POSITIONS = {2, 3, 4, 5, 6, 11}
+TO_DIGIT = str.maketrans({"O": "0", "I": "1", "l": "1", "S": "5", "B": "8"})
+TO_LETTER = str.maketrans({"0": "O", "1": "I", "5": "S", "8": "B"})
+
+# "No", "Num", "Number" or "#" after a label; longest first, so "Number" is not read as "Num" + "ber"
+NUMBER_LABEL = r"(?:(?:number|num|no)\b|#)"
+# A PO label must be a whole word ("PO No", "P.O. #", "Purchase Order"), not "po" inside "Pondicherry"
+PO_LABEL = rf"\b(?:p\.?\s?o\b\.?\s*{NUMBER_LABEL}|purchase\s+order\b(?:\s*{NUMBER_LABEL})?)"
+INVOICE_NUMBER_PATTERN = re.compile(
+    rf"\b(?:in[vy][o0][il1]ce|inv|bill)\s*{NUMBER_LABEL}\.?\s*[:\-]?\s*([A-Z0-9][A-Z0-9/\-]{{2,}})", re.IGNORECASE)
+PO_NUMBER_PATTERN = re.compile(rf"{PO_LABEL}\.?\s*[:\-]?\s*([A-Z0-9][A-Z0-9/\-]{{2,}})", re.IGNORECASE)
+PO_LABEL_PATTERN = re.compile(PO_LABEL, re.IGNORECASE)
+DATE_LABEL_PATTERN = re.compile(r"\b(?:in[vy][o0][il1]ce\s*)?dated?\b\s*[:\-]?\s*(.{6,20})", re.IGNORECASE)
+NUMERIC_DATE_PATTERN = re.compile(r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{2,4})\b")
+TEXT_DATE_PATTERN = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?[\s\-]*([A-Za-z]{3,9})[\s\-,]*(\d{2,4})\b")
+SHIP_TO_PATTERN = re.compile(
+    r"\b(?:ship(?:ping)?\s*(?:to|address)|deliver(?:y)?\s*(?:to|address)|consignee(?:\s*address)?)\b\s*[:\-]?\s*(.*)",
+    re.IGNORECASE)
+SAME_AS_BILLING_PATTERN = re.compile(r"^\s*same\s+as\s+(?:billing|bill(?:ed)?\s*to|buyer|above)\b", re.IGNORECASE)
+PIN_CODE_PATTERN = re.compile(r"\b\d{6}\b")
+ITEM_ROW_PATTERN = re.compile(r"^\s*(\d{1,3})[.)]?\s+(.+)$")
+TABLE_HEADER_PATTERN = re.compile(r"\b(?:description|particulars|item)\b", re.IGNORECASE)
+TABLE_END_PATTERN = re.compile(r"\b(?:sub\s*total|total|amount\s+in\s+words)\b", re.IGNORECASE)
+SUPPLIER_LABELS = re.compile(r"\b(?:supplier|seller|sold\s+by|from|vendor|dealer)\b", re.IGNORECASE)
+BILL_TO_LABELS = re.compile(r"\b(?:bill(?:ed)?\s*to|buyer|customer|consignee|ship(?:ped)?\s*to)\b", re.IGNORECASE)
+OTHER_LABELS = re.compile(r"\b(?:gstin?|invoice|date|p\.?o\.?|phone|email|state|pan)\b", re.IGNORECASE)
+
+MONTHS = {name: index for index, names in enumerate(
+    [("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+     ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"),
+     ("dec", "december")], start=1) for name in names}
+
+
+def gstin_checksum_valid(gstin):
+    """Validates the 15th GSTIN character, a base-36 Luhn-style check digit."""
+    if len(gstin) != 15 or any(c not in GSTIN_CHARS for c in gstin):
+        return False
+    total = 0
+    for i, c in enumerate(gstin[:14]):
+        value = GSTIN_CHARS.index(c) * (2 if i % 2 else 1)
+        total += value // 36 + value % 36
+    return GSTIN_CHARS[(36 - total % 36) % 36] == gstin[14]
+
+def repair_gstin(candidate):
+    """Fixes OCR letter/digit confusions at positions whose type is fixed by the GSTIN format."""
+    chars = list(candidate.upper())
+    for i in GSTIN_DIGIT_POSITIONS:
+        chars[i] = chars[i].translate(TO_DIGIT)
+    for i in GSTIN_LETTER_POSITIONS:
+        chars[i] = chars[i].translate(TO_LETTER)
+    return "".join(chars)
+
+def parse_number(token):
+    """Parses amounts like `70,800.00` or `Rs.1,200`; returns None for non-numbers."""
+    token = re.sub(r"^(?:rs\.?|inr|₹)", "", token.strip(), flags=re.IGNORECASE).replace(",", "")
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+def normalize_date(text):
+    """Returns the first date in `text` as DD-MM-YYYY, or None."""
+    match = NUMERIC_DATE_PATTERN.search(text)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+    else:
+        match = TEXT_DATE_PATTERN.search(text)
+        if not match or match.group(2).lower() not in MONTHS:
+            return None
+        day, month, year = int(match.group(1)), MONTHS[match.group(2).lower()], int(match.group(3))
+
+    if year < 100:
+        year += 2000
+    if not (1 <= day <= 31 and 1 <= month <= 12):
+        return None
+    return f"{day:02d}-{month:02d}-{year}"
+
+
+def _find_gstins(lines):
+    """Returns [(gstin, role, confidence)] with role inferred from the nearest preceding party label."""
+    found = []
+    section = None
+
+    for line in lines:
+        if BILL_TO_LABELS.search(line):
+            section = "bill_to"
+        elif SUPPLIER_LABELS.search(line):
+            section = "supplier"
+
+        for match in GSTIN_PATTERN.finditer(line.upper()):
+            gstin = repair_gstin(match.group(0))
+            if not gstin_checksum_valid(gstin) or any(gstin == g for g, _, _ in found):
+                continue
+            found.append((gstin, section, 0.97 if section else 0.85))
+
+    return found
+
+def _extract_gstins(lines):
+    """Assigns supplier and bill-to GSTINs; without labels the first is assumed to be the supplier."""
+    found = _find_gstins(lines)
+    result = {}
+
+    for gstin, role, confidence in found:
+        if role == "supplier" and "supplier_gst_number" not in result:
+            result["supplier_gst_number"] = (gstin, confidence)
+        elif role == "bill_to" and "bill_to_gst_number" not in result:
+            result["bill_to_gst_number"] = (gstin, confidence)
+
+    unassigned = [(gstin, confidence) for gstin, role, confidence in found
+                  if gstin not in {value for value, _ in result.values()}]
+    for field in ("supplier_gst_number", "bill_to_gst_number"):
+        if field not in result and unassigned:
+            gstin, _ = unassigned.pop(0)
+            result[field] = (gstin, 0.8)  # Guessed from document order only
+
+    return result
+
+def _extract_labelled(lines, pattern, validate=None):
+    """Returns (value, confidence) for the first `label: value` match whose value passes `validate`."""
+    for line in lines:
+        match = pattern.search(line)
+        if match:
+            value = match.group(1).strip(" .:-")
+            if any(c.isdigit() for c in value) and (validate is None or validate(value)):
+                return value, 0.95
+    return None
+
+def extract_invoice_number(text):
+    """Returns the labelled invoice number in `text`, or None."""
+    result = _extract_labelled(text.splitlines(), INVOICE_NUMBER_PATTERN)
+    return result[0] if result else None
+
+def _extract_date(lines):
+    for line in lines:
+        match = DATE_LABEL_PATTERN.search(line)
+        if match:
+            date = normalize_date(match.group(1))
+            if date:
+                return date, 0.95
+    return None
+
+def _extract_shipping_address(lines):
+    """Collects up to four lines after a ship-to label, confident only when they end in a PIN code."""
+    for i, line in enumerate(lines):
+        match = SHIP_TO_PATTERN.search(line)
+        if not match:
+            continue
+
+        # "Ship to: same as billing" is explicit evidence of no separate shipping address
+        if SAME_AS_BILLING_PATTERN.search(match.group(1)):
+            return "", 0.95
+
+        parts = [match.group(1).strip()] if match.group(1).strip() else []
+        for next_line in lines[i + 1:i + 5]:
+            if parts and PIN_CODE_PATTERN.search(parts[-1]):
+                break
+            if not next_line.strip() or TABLE_HEADER_PATTERN.search(next_line):
+                break
+            if OTHER_LABELS.search(next_line) and not PIN_CODE_PATTERN.search(next_line):
+                break
+            parts.append(next_line.strip())
+
+        address = ", ".join(parts)
+        if not address:
+            return "", 0.0
+        return address, 0.92 if PIN_CODE_PATTERN.search(address) else 0.6
+    return None
+
+def _parse_item_row(serial, rest):
+    """
+    Parses one table row after its serial number. Finds quantity, unit price and total among the
+    numeric tokens such that quantity × unit price ≈ total; returns None if no such triple exists.
+    """
+    tokens = rest.split()
+    numbers = [(i, parse_number(token)) for i, token in enumerate(tokens)]
+    numbers = [(i, value) for i, value in numbers if value is not None]
+
+    for (qi, qty), (ui, unit_price), (ti, total) in combinations(numbers, 3):
+        if qty <= 0 or unit_price <= 0 or abs(qty * unit_price - total) > max(0.05, total * 0.001):
+            continue
+
+        # An integer code of 4-8 digits just before the quantity is the HSN/SAC
+        hsn_sac = ""
+        description_end = qi
+        if qi > 0 and re.fullmatch(r"\d{4,8}", tokens[qi - 1]):
+            hsn_sac = tokens[qi - 1]
+            description_end = qi - 1
+
+        description = " ".join(tokens[:description_end]).strip()
+        if not description:
+            return None
+
+        return {
+            "serial_number": serial,
+            "description": description,
+            "hsn_sac": hsn_sac,
+            "quantity": int(qty) if qty.is_integer() else qty,
+            "unit_price": int(unit_price) if unit_price.is_integer() else unit_price,
+            "total_amount": int(total) if total.is_integer() else total,
+        }
+    return None
+
+def _extract_items(lines):
+    """
+    Parses numbered rows of the item table. Confident only if every numbered row inside the table
+    balances and serial numbers run 1..n without gaps.
+    """
+    start = next((i + 1 for i, line in enumerate(lines) if TABLE_HEADER_PATTERN.search(line)), 0)
+    items = []
+    unparsed_rows = 0
+
+    for line in lines[start:]:
+        if items and TABLE_END_PATTERN.search(line):
+            break
+        match = ITEM_ROW_PATTERN.match(line)
+        if not match:
+            continue
+        item = _parse_item_row(int(match.group(1)), match.group(2))
+        if item is None:
+            unparsed_rows += 1
+        else:
+            items.append(item)
+
+    if not items:
+        return None
+
+    serials = [item["serial_number"] for item in items]
+    confident = unparsed_rows == 0 and serials == list(range(1, len(items) + 1))
+    return items, 0.95 if confident else 0.5
+
+
+def extract_fields(ocr_text, words=None):
+    """
+    Rule-based extraction of the prompt_template fields from raw OCR text.
+    Returns (data, confidences): `data` uses the LLM's JSON schema, `confidences` holds a 0-1 score
+    per field in FIELDS (0 when not found). Scores combine the rule's certainty with the OCR word
+    confidences of the extracted value when `words` are available.
+    """
+    lines = ocr_text.splitlines()
+    data = {}
+    confidences = {field: 0.0 for field in FIELDS}
+
+    extracted = {
+        "invoice_number": _extract_labelled(lines, INVOICE_NUMBER_PATTERN),
+        "invoice_date": _extract_date(lines),
+        "po_number": _extract_labelled(lines, PO_NUMBER_PATTERN),
+        "shipping_address": _extract_shipping_address(lines),
+        "items": _extract_items(lines),
+    }
+    extracted.update(_extract_gstins(lines))
+
+    # A missing PO number is a confident empty value if the document never mentions one
+    if extracted["po_number"] is None and not any(PO_LABEL_PATTERN.search(line) for line in lines):
+        extracted["po_number"] = ("", 0.95)
+    # No ship-to label is not evidence of no shipping address (it is often the unlabelled
+    # buyer block), so leave it below the threshold for the LLM
+    if extracted["shipping_address"] is None:
+        extracted["shipping_address"] = ("", 0.5)
+
+    index = word_confidence_index(words) if words else None
+
+    for field, result in extracted.items():
+        if result is None:
+            continue
+        value, confidence = result
+        data[field] = value
+
+        # Scale by how well Tesseract read the value itself
+        if index and value and field != "items":
+            ocr_confidence = value_confidence(value, index)
+            if ocr_confidence is not None:
+                confidence = min(confidence, ocr_confidence)
+        confidences[field] = round(confidence, 2)
+
+    if "items" in data:
+        data["no_items"] = len(data["items"])
+
+    return data, confidences
+
+def missing_fields(confidences, threshold=CONFIDENCE_THRESHOLD):
+    """Fields the fast path is not confident about and the LLM must provide."""
+    return [field for field in FIELDS if confidences.get(field, 0.0) < threshold]
+
+def confident_fields(confidences, threshold=CONFIDENCE_THRESHOLD):
+    """Fields the fast path is confident enough to keep without asking the LLM."""
+    return [field for field in FIELDS if confidences.get(field, 0.0) >= threshold]
+
+def known_fields(data, confidences):
+    """
+    Confident fields that hold an actual value. Empty values (e.g. no PO label found) only
+    count when the whole invoice skips the LLM; otherwise the LLM is asked for them too.
+    """
+    return [field for field in confident_fields(confidences) if data[field]]
+
+def _apply_confident(result, data, fields, confidences):
+    """Overwrites `result` with the fast-path value and confidence of each of `fields`."""
+    for field in fields:
+        result[field] = data[field]
+        if field == "items":
+            result["no_items"] = data["no_items"]
+        elif data[field]:
+            result[f"{field}_confidence"] = confidences[field]
+    return result
+
+def fast_path_result(data, confidences):
+    """Builds the parsed-invoice dict for a fully confident fast-path extraction."""
+    result = _apply_confident({}, data, confident_fields(confidences), confidences)
+    result["extraction_method"] = "fast_path"
+    return result
+
+def merge_with_llm(data, confidences, llm_data):
+    """Combines the LLM's answer for the missing fields with the confident fast-path values."""
+    result = _apply_confident(dict(llm_data), data, known_fields(data, confidences), confidences)
+    result["extraction_method"] = "fast_path+llm"
+    return result
@@ -1,43 +1,195 @@
 from ultralytics import YOLO
 import cv2
 import os
+import time
+
+from utils import metrics
+from utils.cache import make_key, page_cache_key
+from utils.document import PAGE_IMAGE_PATTERN, load_pages_from_folder
 
 # Define directories
 ORIGINAL_IMAGE_FOLDER = "output/images/original"
 SEAL_SIGNATURE_FOLDER = "output/seal_signatures"
 
+# Replace with trained model for seals/signatures
+MODEL_PATH = "yolov8n.pt"
+
+# Detection settings
+BATCH_SIZE = 8          # Pages per YOLO predict call
+IMAGE_SIZE = 640        # YOLO input resolution (longest side)
+CONFIDENCE = 0.25       # Minimum detection score
+SAVE_CROPS = True       # Write each detected seal/signature to SEAL_SIGNATURE_FOLDER
+
+# Page regions searched for seals, as (top, bottom) fractions of the page height.
+# Seals and signatures sit in the footer, so "bottom" skips most of the page.
+REGIONS = {
+    "full": (0.0, 1.0),
+    "bottom": (0.6, 1.0),
+}
+DEFAULT_REGION = "full"
+
+# Bump when detection logic changes so cached detections are not reused
+CACHE_VERSION = 3
+
+_model = None
+
 def ensure_folder_exists(folder):
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+    os.makedirs(folder, exist_ok=True)  # No error when another process creates it at the same time
+
+def get_model():
+    """Loads the YOLO model on first use and reuses it for every later call."""
+    global _model
+    if _model is None:
+        _model = YOLO(MODEL_PATH)
+    return _model
+
+def crop_region(image, region=DEFAULT_REGION):
+    """Returns the part of the page searched for seals (a view, not a copy) and its vertical offset."""
+    top, bottom = REGIONS[region]
+    height = image.shape[0]
+    y_offset = int(height * top)
+    return image[y_offset:int(height * bottom)], y_offset
+
+def crop_filename(page_name, index):
+    """Unique name of a page's `index`-th (1-based) seal/signature crop, e.g. sample_invoice.pdf_page_1_seal_2.jpg."""
+    return f"{page_name}_seal_{index}.jpg"
+
+def detect_seals_batch(images, page_names, imgsz=IMAGE_SIZE, region=DEFAULT_REGION, conf=CONFIDENCE, save_crops=SAVE_CROPS,
+                       dpis=None):
+    """
+    Detects seals/signatures in a batch of in-memory invoice images with one YOLO predict call.
+    With `save_crops`, every detection is saved as its own crop (see `crop_filename`).
+    `dpis` holds the resolution each image was rendered at, recorded with its boxes.
+    Returns one list of detections ({"bbox", "score", "class", "label", "crop_path", "dpi"} in full-page pixels)
+    per image.
+    """
+    if save_crops:
+        ensure_folder_exists(SEAL_SIGNATURE_FOLDER)
+
+    regions = [crop_region(image, region) for image in images]
+    results = get_model().predict([crop for crop, _ in regions], imgsz=imgsz, conf=conf, verbose=False)
+
+    detections = []
+    for image, page_name, (_, y_offset), result, dpi in zip(images, page_names, regions, results,
+                                                            dpis or [None] * len(images)):
+        page_detections = []
+        names = getattr(result, "names", None) or {}
+
+        boxes = zip(result.boxes.xyxy.tolist(), result.boxes.conf.tolist(), result.boxes.cls.tolist())
+        for index, (box, score, cls) in enumerate(boxes, start=1):
+            x1, y1, x2, y2 = map(int, box)
+            y1, y2 = y1 + y_offset, y2 + y_offset  # Map back from the searched region to the page
+
+            seal_path = None
+            if save_crops:
+                seal_path = os.path.join(SEAL_SIGNATURE_FOLDER, crop_filename(page_name, index))
+                cv2.imwrite(seal_path, image[y1:y2, x1:x2])
 
-# Load YOLO model
-model = YOLO("yolov8n.pt")  # Replace with trained model for seals/signatures
+            page_detections.append({"bbox": [x1, y1, x2, y2], "score": round(score, 4), "class": int(cls),
+                                    "label": names.get(int(cls)), "crop_path": seal_path, "dpi": dpi})
+
+        detections.append(page_detections)
+
+    return detections
+
+def detect_seals_in_image(image, page_name, **kwargs):
+    """
+    Detects seal/signature in an in-memory invoice image using YOLO.
+    Crops are saved under the page name. Returns True if anything was detected.
+    """
+    return len(detect_seals_batch([image], [page_name], **kwargs)[0]) > 0
 
 def detect_seal_signature(image_path):
     """Detects seal/signature in an invoice using YOLO."""
     image = cv2.imread(image_path)
-    results = model(image)  # Run YOLO detection
 
-    ensure_folder_exists(SEAL_SIGNATURE_FOLDER)
+    # Name crops after the page, e.g. sample_invoice.pdf_page_1 for sample_invoice.pdf_page_1_original.jpg
+    match = PAGE_IMAGE_PATTERN.match(os.path.basename(image_path))
+    page_name = (f"{match.group('source')}_page_{match.group('page')}" if match
+                 else os.path.splitext(os.path.basename(image_path))[0])
+
+    return detect_seals_in_image(image, page_name)
+
+def load_original(page):
+    """
+    The page image searched for seals and its DPI: held in memory, read from disk, or, for pages
+    taken from the PDF's text layer (never rendered), rendered now at a lower resolution.
+    """
+    from utils.preprocess import RENDER_DPI
+
+    if page.original is not None:
+        return page.original, RENDER_DPI
+    if page.original_path is not None and (page.pdf_path is None or os.path.exists(page.original_path)):
+        return cv2.imread(page.original_path), RENDER_DPI
+
+    from utils.text_layer import SEAL_RENDER_DPI, render_page
+    return render_page(page.pdf_path, page.page_number, dpi=SEAL_RENDER_DPI), SEAL_RENDER_DPI
+
+def detect_seals_in_pages(pages, cache=None, batch_size=BATCH_SIZE, imgsz=IMAGE_SIZE, region=DEFAULT_REGION,
+                          manifest=None, save_crops=SAVE_CROPS):
+    """
+    Applies YOLO seal detection to Page objects in batches of `batch_size` pages,
+    reading the original image from disk only for pages not held in memory
+    (text-layer pages are rendered on demand, see `load_original`).
+    With a cache, pages whose rendered image is unchanged reuse their previous detection.
+    With a manifest (utils.seal_manifest.SealManifest), every page's detections are recorded in it.
+    """
+    if region not in REGIONS:
+        raise ValueError(f"Unknown seal region '{region}'. Available: {', '.join(REGIONS)}")
+
+    pending = []  # (page, cache key) of pages that still need YOLO
+    results = []  # (page, detections) for the manifest
+    crops = 0
+
+    for page in pages:
+        key = None
+        if cache is not None and page_cache_key(page) is not None:
+            key = make_key("seals", CACHE_VERSION, page.cache_key, MODEL_PATH, imgsz, REGIONS[region], CONFIDENCE,
+                           save_crops)
+            cached = cache.get_json("seals", key)
+            if cached is not None:
+                _set_detections(page, cached["detections"])
+                results.append((page, cached["detections"]))
+                continue
+        pending.append((page, key))
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        images, dpis = zip(*(load_original(page) for page, _ in batch))
+
+        batch_start = time.perf_counter()
+        detections = detect_seals_batch(images, [page.name for page, _ in batch], imgsz=imgsz, region=region,
+                                        save_crops=save_crops, dpis=dpis)
+        seconds = (time.perf_counter() - batch_start) / len(batch)
+
+        for (page, key), page_detections in zip(batch, detections):
+            _set_detections(page, page_detections)
+            results.append((page, page_detections))
+            crops += sum(detection["crop_path"] is not None for detection in page_detections)
+            page.timings["seals"] = seconds
+            metrics.observe("page_seconds", seconds, stage="seals")
+            if key is not None:
+                cache.put_json("seals", key, {"seal_detected": page.seal_detected, "detections": page_detections})
+
+    if crops:
+        print(f"Saved {crops} seal/signature crop(s) to {SEAL_SIGNATURE_FOLDER}")
 
-    # Extract original invoice filename (keeping original name)
-    invoice_filename = os.path.basename(image_path)  # Example: sample_invoice.pdf_page_1_original.jpg
+    if manifest is not None:
+        manifest.record_many([(page.name, page.source, page.page_number, page_detections)
+                              for page, page_detections in results])
 
-    for i, box in enumerate(results[0].boxes.xyxy):
-        x1, y1, x2, y2 = map(int, box)
-        cropped_seal = image[y1:y2, x1:x2]
-        seal_path = os.path.join(SEAL_SIGNATURE_FOLDER, invoice_filename)  # Save as original invoice filename
-        cv2.imwrite(seal_path, cropped_seal)
-        print(f"Saved seal/signature as {seal_path}")  # Debugging output
+    metrics.increment("pages_total", len(pages), stage="seals")
+    return pages
 
-def process_images_for_seals():
-    """Scans all original images and applies YOLO seal detection."""
-    ensure_folder_exists(SEAL_SIGNATURE_FOLDER)
+def _set_detections(page, detections):
+    page.seal_detected = len(detections) > 0
+    page.seal_score = max((detection["score"] for detection in detections), default=0.0)
 
-    for filename in os.listdir(ORIGINAL_IMAGE_FOLDER):
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            image_path = os.path.join(ORIGINAL_IMAGE_FOLDER, filename)
-            detect_seal_signature(image_path)
+def process_images_for_seals(batch_size=BATCH_SIZE, imgsz=IMAGE_SIZE, region=DEFAULT_REGION, manifest=None):
+    """Scans all original images and applies YOLO seal detection in batches."""
+    pages = load_pages_from_folder(ORIGINAL_IMAGE_FOLDER, "original")
+    detect_seals_in_pages(pages, batch_size=batch_size, imgsz=imgsz, region=region, manifest=manifest)
 
 if __name__ == "__main__":
-    process_images_for_seals()
\ No newline at end of file
+    from utils.seal_manifest import SealManifest
+    process_images_for_seals(manifest=SealManifest())
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Define queue location
+JOB_QUEUE_FILE = "output/service/jobs.sqlite"
+
+# A job whose worker died this many times is failed instead of being retried again
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """
+    Durable queue of service jobs in SQLite, shared by the HTTP server and its worker processes.
+    A job moves from "queued" to "running" (claimed by one worker) to "done" or "failed", and keeps
+    its parsed invoices and verifiability report. Queued and running jobs survive a restart:
+    running jobs of a worker that died are put back in the queue.
+    """
+
+    def __init__(self, path=JOB_QUEUE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        # Several processes write the queue; wait for each other's transactions instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                pdf_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                submitted_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, submitted_at)")
+        self._conn.commit()
+
+    def submit(self, job_id, filename, pdf_path):
+        """Queues a job for a PDF that is already saved at `pdf_path`."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, pdf_path, status, submitted_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, filename, pdf_path, time.time()),
+            )
+            self._conn.commit()
+
+    def claim(self, worker):
+        """Marks the oldest queued job as running on `worker` and returns it, or None if the queue is empty."""
+        with self._lock:
+            # One UPDATE statement, so two workers can never claim the same job
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY submitted_at LIMIT 1)",
+                (worker, time.time()),
+            ).rowcount
+            self._conn.commit()
+            if not claimed:
+                return None
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND worker = ? ORDER BY started_at DESC LIMIT 1",
+                (worker,),
+            ).fetchone()
+        return self.get(row[0])
+
+    def complete(self, job_id, result):
+        """Stores a finished job's result ({"invoices", "report", ...})."""
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=str(error))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), result, error, job_id),
+            )
+            self._conn.commit()
+
+    def requeue(self, worker=None):
+        """
+        Puts the running jobs of `worker` (or of every worker) back in the queue, e.g. after the
+        worker crashed. Jobs that already failed MAX_ATTEMPTS times are failed instead.
+        Returns the number of jobs requeued.
+        """
+        condition, params = ("status = 'running'", []) if worker is None else \
+            ("status = 'running' AND worker = ?", [worker])
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Worker stopped {MAX_ATTEMPTS} times' "
+                f"WHERE {condition} AND attempts >= ?",
+                [time.time(), *params, MAX_ATTEMPTS],
+            )
+            requeued = self._conn.execute(
+                f"UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL WHERE {condition}", params
+            ).rowcount
+            self._conn.commit()
+        return requeued
+
+    def get(self, job_id, with_result=False):
+        """
+        Returns a job as {"job_id", "filename", "status", "attempts", "submitted_at", "started_at",
+        "finished_at", "error"}, plus its "result" with `with_result`, or None for an unknown id.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, pdf_path, status, attempts, submitted_at, started_at, finished_at, error, "
+                "result FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = dict(zip(["job_id", "filename", "pdf_path", "status", "attempts", "submitted_at", "started_at",
+                        "finished_at", "error"], row[:-1]))
+        if with_result:
+            job["result"] = json.loads(row[-1]) if row[-1] else None
+        return job
+
+    def counts(self):
+        """Number of jobs per status, e.g. {"queued": 3, "running": 2, "done": 40}."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def depth(self):
+        """Jobs waiting for or being processed by a worker."""
+        counts = self.counts()
+        return counts.get("queued", 0) + counts.get("running", 0)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import metrics
+
+# Define cache location and limits
+LLM_CACHE_FILE = "output/llm_cache.sqlite"
+MAX_ENTRIES = 100_000                 # Least recently used responses beyond this are evicted
+EVICT_EVERY = 100                     # Puts between checks of the entry count against MAX_ENTRIES
+TTL_SECONDS = 90 * 24 * 60 * 60       # Responses older than this are asked again
+
+def response_key(model_name, template, cleaned_text):
+    """Hashes everything that determines the LLM's answer."""
+    payload = json.dumps([model_name, template, cleaned_text])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache of LLM answers for the parser chain.
+    Each row keeps the raw response and the JSON extracted from it. Rows are written
+    as soon as a call completes, so a crashed batch resumes without repeating calls.
+    """
+
+    def __init__(self, path=LLM_CACHE_FILE, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS, evict_every=EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                raw_response TEXT NOT NULL,
+                parsed_json TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used_at)")
+        self._evict()
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns the cached parsed JSON for `key`, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT parsed_json, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                metrics.increment("cache_misses_total", cache="llm", stage="parse")
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_used_at = ?, hit_count = hit_count + 1 WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            metrics.increment("cache_hits_total", cache="llm", stage="parse")
+
+        return json.loads(row[0])
+
+    def get_raw(self, key):
+        """Returns the raw LLM response stored for `key`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT raw_response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _evict(self):
+        """Deletes the least recently used rows beyond `max_entries`, if there are any. Call with the lock held."""
+        if not self.max_entries:
+            return
+        excess = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used_at LIMIT ?)",
+                (excess,),
+            )
+
+    def put(self, key, model_name, raw_response, parsed_data):
+        """
+        Stores one answer. Every `evict_every` puts the least recently used rows beyond `max_entries`
+        are evicted, so the cache may briefly hold up to `evict_every` rows more than the limit.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, raw_response, parsed_json, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, raw_response, json.dumps(parsed_data), now, now),
+            )
+            self._puts += 1
+            if self._puts % max(self.evict_every, 1) == 0:
+                self._evict()
+            self._conn.commit()
+
+    def purge_expired(self):
+        """Deletes every entry older than the TTL and returns how many were removed."""
+        if not self.ttl_seconds:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters for this session plus the number of stored responses."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,237 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Define paths
+METRICS_FILE = "output/metrics.json"
+PROFILE_FOLDER = "output/profiles"
+
+METRIC_PREFIX = "invoice_"   # Prefix of every exported Prometheus metric
+MAX_SAMPLES = 1000           # Latest timings kept per series for the p50/p95 quantiles
+QUANTILES = (0.5, 0.95)
+MAX_LABEL_VALUES = 20        # Distinct values kept per bounded label (e.g. vendor); later ones are exported as "other"
+OTHER_LABEL = "other"
+RU_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024  # getrusage reports ru_maxrss in bytes on macOS, KiB elsewhere
+
+# Process-wide registry, shared by every stage and thread: (name, sorted labels) -> value
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+_label_values = {}           # Bounded label name -> values given their own series so far
+_process = None
+
+
+def _series(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def increment(name, value=1, **labels):
+    """Adds `value` to a counter, e.g. increment("pages_total", stage="ocr")."""
+    key = _series(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to its current value, e.g. a queue depth."""
+    with _lock:
+        _gauges[_series(name, labels)] = value
+
+def max_gauge(name, value, **labels):
+    """Raises a gauge to `value` if it is higher (for peaks)."""
+    key = _series(name, labels)
+    with _lock:
+        _gauges[key] = max(_gauges.get(key, value), value)
+
+def observe(name, seconds, **labels):
+    """Records one duration: count, sum and max, plus the latest MAX_SAMPLES values for quantiles."""
+    key = _series(name, labels)
+    with _lock:
+        timing = _timings.get(key)
+        if timing is None:
+            timing = _timings[key] = {"count": 0, "sum": 0.0, "max": 0.0, "samples": deque(maxlen=MAX_SAMPLES)}
+        timing["count"] += 1
+        timing["sum"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["samples"].append(seconds)
+
+def bounded_label(label, value, limit=None):
+    """
+    Caps the distinct values of an open-ended label (vendor, customer) at `limit` series
+    (default MAX_LABEL_VALUES): the first values seen keep their own label, any other becomes "other".
+    """
+    value = str(value)
+    limit = MAX_LABEL_VALUES if limit is None else limit
+    with _lock:
+        seen = _label_values.setdefault(label, set())
+        if value in seen:
+            return value
+        if len(seen) < limit:
+            seen.add(value)
+            return value
+    return OTHER_LABEL
+
+def record_memory():
+    """
+    Updates the peak resident memory gauges from the kernel's high-water marks, so peaks between
+    samples are not missed: `peak_rss_bytes` for this process and `children_peak_rss_bytes` for the
+    largest worker process that has exited (pool workers count once the pool shuts down).
+    Without the `resource` module (Windows) only this process's peak working set is read, via psutil.
+    """
+    global _process
+    if resource is not None:
+        max_gauge("peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RU_MAXRSS_UNIT)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if children:
+            max_gauge("children_peak_rss_bytes", children * RU_MAXRSS_UNIT)
+        return
+    try:
+        if _process is None:
+            import psutil
+            _process = psutil.Process()
+        memory = _process.memory_info()
+        max_gauge("peak_rss_bytes", getattr(memory, "peak_wset", memory.rss))
+    except ImportError:
+        pass
+
+@contextmanager
+def span(name, **labels):
+    """Times the enclosed block as `<name>_seconds` and samples peak memory when it ends."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+        record_memory()
+
+@contextmanager
+def profile(stage, enabled=True, folder=PROFILE_FOLDER):
+    """
+    Runs the enclosed block under cProfile and writes `<folder>/<stage>.prof` (open with pstats or snakeviz).
+    Only one profiler can run at a time; a stage that starts while another is profiled runs unprofiled.
+    """
+    profiler = cProfile.Profile() if enabled else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            print(f"Not profiling stage '{stage}': another profiler is active")
+            profiler = None
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{stage}.prof")
+            profiler.dump_stats(path)
+            print(f"Profile of stage '{stage}' saved: {path}")
+
+def reset():
+    """Clears every metric (for tests and benchmarks)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
+        _label_values.clear()
+
+def _quantile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def snapshot():
+    """Current value of every metric as a JSON-serializable dict."""
+    record_memory()
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        gauges = [{"name": name, "labels": dict(labels), "value": value}
+                  for (name, labels), value in sorted(_gauges.items())]
+        timings = [{"name": name, "labels": dict(labels), "count": timing["count"],
+                    "sum": round(timing["sum"], 6), "max": round(timing["max"], 6),
+                    **{f"p{int(q * 100)}": round(_quantile(timing["samples"], q), 6) for q in QUANTILES}}
+                   for (name, labels), timing in sorted(_timings.items())]
+    return {"generated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "pid": os.getpid(),
+            "counters": counters, "gauges": gauges, "timings": timings}
+
+def write_json(path=METRICS_FILE):
+    """Writes the snapshot to the JSON metrics file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=4)
+    os.replace(tmp_path, path)
+    print(f"Metrics saved: {path}")
+    return path
+
+def _prometheus_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+def prometheus_text(others=None):
+    """
+    The snapshot in the Prometheus text exposition format (counters, gauges and summaries).
+    `others` adds snapshots of other processes as (labels, snapshot) pairs, exported with those
+    labels, e.g. ({"worker": "worker-1"}, snapshot) for a service worker.
+    """
+    families = {}  # Metric name -> (kind, lines); every sample of a metric must be exported together
+
+    def add(name, kind, line):
+        families.setdefault(name, (kind, []))[1].append(line)
+
+    for extra, data in [({}, snapshot()), *(others or [])]:
+        for kind, entries in (("counter", data["counters"]), ("gauge", data["gauges"])):
+            for entry in entries:
+                name = METRIC_PREFIX + entry["name"]
+                add(name, kind, f"{name}{_prometheus_labels(entry['labels'], **extra)} {entry['value']}")
+
+        for entry in data["timings"]:
+            name = METRIC_PREFIX + entry["name"]
+            labels = {**entry["labels"], **extra}
+            for q in QUANTILES:
+                add(name, "summary", f"{name}{_prometheus_labels(labels, quantile=q)} {entry[f'p{int(q * 100)}']}")
+            add(name, "summary", f"{name}_sum{_prometheus_labels(labels)} {entry['sum']}")
+            add(name, "summary", f"{name}_count{_prometheus_labels(labels)} {entry['count']}")
+
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def serve(port, host="0.0.0.0"):
+    """Serves `GET /metrics` in the Prometheus text format from a background thread. Returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would otherwise flood the pipeline output
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Metrics at http://{host}:{port}/metrics (PID {os.getpid()}, e.g. for py-spy)")
+    return server
@@ -1,7 +1,14 @@
 import os
+import re
+import json
+import time
 import pytesseract
 import cv2
-import numpy as np
+
+from utils import metrics
+from utils.cache import make_key, page_cache_key
+from utils.preprocess import apply_filter_chain
+from utils.workers import bounded_map, make_executor
 
 # Path to Tesseract executable (ensure it's installed)
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -10,33 +17,274 @@ pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tessera
 PROCESSED_IMAGE_FOLDER = "output/images/processed"
 TEXT_OUTPUT_FOLDER = "output/extracted_text"
 
+# Filters re-applied to processed JPEGs loaded from disk (see preprocess.FILTERS)
+OCR_FILTER_CHAIN = ["blur", "threshold", "sharpen"]
+
+# Tesseract options, `"--psm 6"` for structured text blocks
+TESSERACT_CONFIG = "--psm 6"
+
+# Worker processes running Tesseract; each Tesseract call is kept single-threaded
+MAX_WORKERS = os.cpu_count() or 1
+
+# Bump when OCR settings change so cached text is not reused
+CACHE_VERSION = 2
+
+# Parsed fields that get a `*_confidence` from the OCR word confidences
+CONFIDENCE_FIELDS = ["invoice_number", "invoice_date", "supplier_gst_number", "bill_to_gst_number", "po_number", "shipping_address"]
+ITEM_CONFIDENCE_FIELDS = ["serial_number", "description", "hsn_sac", "quantity", "unit_price", "total_amount"]
+
+_pool = None
+_pool_workers = None
+
 def ensure_folder_exists(folder_path):
     """Creates a folder if it does not exist."""
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    os.makedirs(folder_path, exist_ok=True)  # No error when another process creates it at the same time
 
-def preprocess_image(image_path):
+def preprocess_image(image):
     """
     Enhances image before OCR using:
     - Grayscale conversion
+    - Gaussian blur for noise reduction
     - Adaptive thresholding
-    - Noise reduction
     - Edge sharpening
+    Accepts either an image path or an already loaded image array.
+    Only needed for processed images read back from disk, where JPEG compression has softened the threshold.
     """
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if isinstance(image, str):
+        image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
 
-    # Apply Gaussian Blur to reduce noise
-    image = cv2.GaussianBlur(image, (5, 5), 0)
+    return apply_filter_chain(image, OCR_FILTER_CHAIN)
 
-    # Adaptive thresholding for better text isolation
-    image = cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                  cv2.THRESH_BINARY, 11, 2)
+def load_ocr_image(image, preprocess=True):
+    """Loads a page image (path or array) and applies the OCR filter chain if requested."""
+    # Preprocess the image for better OCR accuracy
+    if preprocess:
+        return preprocess_image(image)
+    if isinstance(image, str):
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    return image
 
-    # Edge sharpening using kernel filter
-    kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    image = cv2.filter2D(image, -1, kernel)
+def extract_words(image, preprocess=True):
+    """
+    Runs Tesseract once on a page and returns its words with boxes and confidences (0-1).
+    Uses `image_to_data` (TSV output) so confidence data is kept instead of thrown away.
+    """
+    image = load_ocr_image(image, preprocess)
 
-    return image
+    # Extract text using Tesseract with `"--psm 6"` for structured text blocks
+    data = pytesseract.image_to_data(image, config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT)
+
+    words = []
+    for i, text in enumerate(data["text"]):
+        if not text.strip() or float(data["conf"][i]) < 0:
+            continue
+        words.append({
+            "text": text,
+            "conf": round(float(data["conf"][i]) / 100, 4),
+            "left": data["left"][i],
+            "top": data["top"][i],
+            "width": data["width"][i],
+            "height": data["height"][i],
+            "block": data["block_num"][i],
+            "par": data["par_num"][i],
+            "line": data["line_num"][i],
+        })
+
+    return words
+
+def words_to_text(words):
+    """Rebuilds the page text from Tesseract words, one output line per OCR line."""
+    lines = []
+    current_line = None
+
+    for word in words:
+        line_id = (word["block"], word["par"], word["line"])
+        if line_id != current_line:
+            lines.append([])
+            current_line = line_id
+        lines[-1].append(word["text"])
+
+    return "\n".join(" ".join(line) for line in lines).strip()
+
+def extract_text(image, preprocess=True):
+    """
+    Runs Tesseract on a single page image (path or array) and returns the stripped text.
+    Pass `preprocess=False` for pages that already went through the preprocessing filter chain in memory.
+    """
+    return words_to_text(extract_words(image, preprocess))
+
+def save_text(text, filename):
+    """Saves extracted text to a file in the text output folder and returns its path."""
+    text_filename = os.path.join(TEXT_OUTPUT_FOLDER, filename)
+    with open(text_filename, "w", encoding="utf-8") as f:
+        f.write(text)
+    return text_filename
+
+def save_words(words, filename):
+    """Saves OCR words next to the page text, as `<text file>.words.json`."""
+    words_filename = os.path.join(TEXT_OUTPUT_FOLDER, f"{filename}.words.json")
+    with open(words_filename, "w", encoding="utf-8") as f:
+        json.dump(words, f)
+    return words_filename
+
+def load_words(text_filename):
+    """Loads the OCR words saved for a text file, or None if there are none."""
+    words_filename = os.path.join(TEXT_OUTPUT_FOLDER, f"{text_filename}.words.json")
+    if not os.path.exists(words_filename):
+        return None
+    with open(words_filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _ocr_source(page):
+    """
+    Returns (image, preprocess) for a Page. In-memory pages and lossless PNGs (cached pages)
+    go straight to Tesseract; processed JPEGs read back from disk get the OCR filter chain first.
+    """
+    if page.processed is not None:
+        return page.processed, False
+    if page.processed_path is None:
+        raise ValueError(f"{page.name} has no processed image in memory or on disk; run the preprocess stage first")
+    return page.processed_path, not page.processed_path.endswith(".png")
+
+def _ocr_task(source):
+    """Pool task: OCRs one page and returns (text, words, seconds)."""
+    start = time.perf_counter()
+    words = extract_words(*source)
+    return words_to_text(words), words, time.perf_counter() - start
+
+def _init_worker():
+    """Limits Tesseract and OpenCV to one thread per worker; the pool provides the parallelism."""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    cv2.setNumThreads(1)
+
+def get_ocr_pool(workers=None):
+    """Starts the OCR worker pool on first use and keeps it alive for later batches, replacing it if a worker died."""
+    global _pool, _pool_workers
+    workers = workers or MAX_WORKERS
+    if _pool is None or _pool_workers != workers or getattr(_pool, "_broken", False):
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = make_executor(workers, initializer=_init_worker)
+        _pool_workers = workers
+    return _pool
+
+def _ocr_failed(page, error):
+    """Reports a page Tesseract could not read and leaves it without text, so the rest of the batch goes on."""
+    print(f"Error running OCR on {page.name}: {error}")
+    metrics.increment("errors_total", stage="ocr")
+    page.text, page.words = "", []
+
+def extract_text_from_pages(pages, cache=None, workers=None):
+    """
+    Extracts text and word confidences for Page objects across the OCR worker pool,
+    falling back to the processed image on disk for pages not held in memory.
+    In-memory pages go straight to Tesseract without a second filter pass; pages read from
+    the PDF's text layer are not OCR'd at all. A page that fails is reported and left empty
+    instead of aborting the batch.
+    Stores the text and words on each page and also saves them to 'output/extracted_text/'.
+    With a cache, pages whose rendered image is unchanged reuse their previous OCR result.
+    """
+    ensure_folder_exists(TEXT_OUTPUT_FOLDER)
+
+    pending = []  # (page, source, cache key) of pages that still need Tesseract
+
+    for page in pages:
+        if page.text_layer:
+            continue  # Text and words were read from the PDF itself
+
+        try:
+            source = _ocr_source(page)
+        except ValueError as e:
+            _ocr_failed(page, e)
+            continue
+
+        key = None
+        if cache is not None and page_cache_key(page) is not None:
+            _, reads_jpeg = source
+            key = make_key("ocr", CACHE_VERSION, page.cache_key, TESSERACT_CONFIG,
+                           OCR_FILTER_CHAIN if reads_jpeg else None)
+            cached = cache.get_json("ocr", key)
+            if cached is not None:
+                page.text, page.words = cached["text"], cached["words"]
+                continue
+        pending.append((page, source, key))
+
+    workers = workers or MAX_WORKERS
+    pool = get_ocr_pool(workers)
+    sources = (source for _, source, _ in pending)
+
+    for (page, _, key), (_, future) in zip(pending, bounded_map(pool, _ocr_task, sources, max_in_flight=workers * 2)):
+        try:
+            page.text, page.words, page.timings["ocr"] = future.result()
+        except Exception as e:
+            _ocr_failed(page, e)
+            continue
+        metrics.observe("page_seconds", page.timings["ocr"], stage="ocr")
+        if key is not None:
+            cache.put_json("ocr", key, {"text": page.text, "words": page.words})
+
+    for page in pages:
+        metrics.increment("pages_total", stage="ocr")
+        metrics.increment("ocr_characters_total", len(page.text or ""))
+        text_filename = save_text(page.text, page.text_filename)
+        save_words(page.words, page.text_filename)
+        print(f"Extracted text saved: {text_filename}")
+
+    return pages
+
+def _normalize_token(token):
+    """Canonical form for matching parsed values to OCR words (case, punctuation and number formatting)."""
+    number = token.replace(",", "")
+    try:
+        return ("%f" % float(number)).rstrip("0").rstrip(".")
+    except ValueError:
+        return re.sub(r"[^a-z0-9]", "", token.lower())
+
+def word_confidence_index(words):
+    """Maps each normalized OCR token to the best confidence it was read with."""
+    index = {}
+    for word in words or []:
+        token = _normalize_token(word["text"])
+        if token:
+            index[token] = max(word["conf"], index.get(token, 0.0))
+    return index
+
+def value_confidence(value, index):
+    """
+    Confidence of a parsed value from the OCR words it was read from: the mean word confidence,
+    counting tokens missing from the OCR output as 0. Returns None if no token matches.
+    """
+    tokens = [_normalize_token(token) for token in str(value).split()]
+    tokens = [token for token in tokens if token]
+    matched = [index[token] for token in tokens if token in index]
+    if not matched:
+        return None
+    return round(sum(matched) / len(tokens), 2)
+
+def attach_confidences(parsed_data, words):
+    """
+    Adds `<field>_confidence` values backed by OCR word confidences to a parsed invoice.
+    Confidences already set (e.g. by the fast-path extractor) are kept.
+    """
+    if not words or "error" in parsed_data:
+        return parsed_data
+
+    index = word_confidence_index(words)
+
+    def attach(record, fields):
+        for field in fields:
+            value = record.get(field)
+            if value in (None, ""):
+                continue
+            confidence = value_confidence(value, index)
+            if confidence is not None:
+                record.setdefault(f"{field}_confidence", confidence)
+
+    attach(parsed_data, CONFIDENCE_FIELDS)
+    for item in parsed_data.get("items", []):
+        attach(item, ITEM_CONFIDENCE_FIELDS)
+
+    return parsed_data
 
 def extract_text_from_images():
     """
@@ -49,16 +297,12 @@ def extract_text_from_images():
         if filename.endswith(".jpg") or filename.endswith(".png"):
             image_path = os.path.join(PROCESSED_IMAGE_FOLDER, filename)
 
-            # Preprocess the image for better OCR accuracy
-            processed_image = preprocess_image(image_path)
-
-            # Extract text using Tesseract with `"--psm 6"` for structured text blocks
-            extracted_text = pytesseract.image_to_string(processed_image, config="--psm 6")
+            words = extract_words(image_path)
+            extracted_text = words_to_text(words)
 
-            # Save extracted text to a file
-            text_filename = os.path.join(TEXT_OUTPUT_FOLDER, f"{filename}.txt")
-            with open(text_filename, "w", encoding="utf-8") as f:
-                f.write(extracted_text.strip())
+            # Save extracted text and word confidences to files
+            text_filename = save_text(extracted_text, f"{filename}.txt")
+            save_words(words, f"{filename}.txt")
 
             print(f"Extracted text saved: {text_filename}")
 
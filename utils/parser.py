@@ -1,32 +1,50 @@
 import os
 import json
 import re
+import time
+import asyncio
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+from utils import metrics
+from utils.assembler import group_pages
+from utils.document import load_pages_from_text_folder
+from utils.fast_extract import FIELDS, confident_fields, extract_fields, fast_path_result, known_fields, merge_with_llm, missing_fields
+from utils.llm_cache import LLMCache, response_key
+from utils.ocr_utils import attach_confidences, load_words
+from utils.rate_limit import RateLimiter, backoff_delay, is_retryable
+from utils.result_store import ResultStore
+from utils.seal_manifest import SealManifest
+
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+MODEL_NAME = "llama3-70b-8192"
 
 # Initialize Groq LLM
 llm = ChatGroq(
     groq_api_key=GROQ_API_KEY,
-    model_name="llama3-70b-8192",
+    model_name=MODEL_NAME,
     temperature=0
 )
 
+# Batch parsing limits (match these to the API key's quota)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 4))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 30))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 6000))
+LLM_MAX_RETRIES = 5
+EXPECTED_RESPONSE_TOKENS = 800  # Rough size of one JSON answer, reserved against the token budget
+
 # Define directories
 TEXT_INPUT_FOLDER = "output/extracted_text"
 JSON_OUTPUT_FOLDER = "output/parsed_json"
 COMBINED_JSON_FILE = "output/extracted_data.json"
-SEAL_SIGNATURE_FOLDER = "output/seal_signatures"
 
 def ensure_folder_exists(folder_path):
     """Creates a folder if it does not exist."""
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    os.makedirs(folder_path, exist_ok=True)  # No error when another process creates it at the same time
 
 def preprocess_text(text):
     """
@@ -40,22 +58,15 @@ def preprocess_text(text):
     text = re.sub(r"(\d{2})/(\d{2})/(\d{4})", r"\1-\2-\3", text)  # Standardize dates
     return text.strip()
 
-def check_seal_signature(image_filename):
-    """Check if a seal/signature is detected for this specific invoice."""
-    if os.path.exists(SEAL_SIGNATURE_FOLDER):
-        seal_images = os.listdir(SEAL_SIGNATURE_FOLDER)
-        print(f"Debug: Seal Images Found - {seal_images}")  # Show stored seals
-
-        # Remove unwanted suffix from image_filename before checking
-        expected_seal_name = image_filename.replace("_processed.jpg", "_original.jpg")  # Fix processed naming
-        expected_seal_name = expected_seal_name.replace(".pdf_page_1_original.jpg", "") + ".pdf_page_1_original.jpg"  # Ensure correct match
-
-        matching_seals = [f for f in seal_images if f == expected_seal_name]
-        print(f"Checking {expected_seal_name}: Found {len(matching_seals)} matching seals")  # Debugging output
-
-        return len(matching_seals) > 0  # Returns True if exact filename exists
-    print(f"No seal detected for {image_filename}")
-    return False
+def check_seal_signature(page, manifest):
+    """
+    Looks up a page's seal/signature detection in the manifest (utils.seal_manifest) by its name.
+    Sets `seal_detected` and `seal_score` on the page and returns whether a seal was found.
+    """
+    result = manifest.get(page.name)
+    if result is not None:
+        page.seal_detected, page.seal_score = result["seal_detected"], result["score"] or 0.0
+    return page.seal_detected
 
 
 # Improved prompt for extracting structured JSON output
@@ -86,8 +97,38 @@ You are an expert at parsing invoice documents. Extract structured data from the
 """
 )
 
-# Combine prompt → LLM → output parser
-chain = prompt_template | llm | StrOutputParser()
+# Narrower prompt used when the fast path already extracted some fields confidently
+partial_prompt_template = PromptTemplate(
+    input_variables=["ocr_text", "fields", "known_fields"],
+    template="""
+You are an expert at parsing invoice documents. Some fields were already extracted from the OCR results below.
+Extract ONLY the missing fields into **valid JSON format**.
+
+### **Missing Fields**
+{fields}
+
+### **Already Extracted (do not repeat)**
+{known_fields}
+
+### **Field Formats**
+- invoice_date (format: DD-MM-YYYY)
+- items: [{{serial_number, description, hsn_sac, quantity, unit_price, total_amount}}]
+- no_items (number of items)
+
+### **Important Instructions**
+1**If an item row is broken, intelligently infer missing values.**
+2**Respond ONLY with valid JSON—no extra commentary.**
+
+### **OCR Data for Parsing**
+{ocr_text}
+"""
+)
+
+def build_chain(chat_model, template=prompt_template):
+    """Combine prompt → LLM → output parser for any chat model."""
+    return template | chat_model | StrOutputParser()
+
+chain = build_chain(llm)
 
 def extract_json_from_response(response_text):
     """Extracts and verifies JSON structure from AI response."""
@@ -110,49 +151,345 @@ def extract_json_from_response(response_text):
 
     return parsed_json
 
-def parse_invoice_text_files():
-    """Parses text files, saves individual JSON files, and combines all invoices."""
-    ensure_folder_exists(JSON_OUTPUT_FOLDER)
+def chain_chat_model(llm_chain=None):
+    """Returns the chat model inside a chain (the Groq model by default), or None if it has none."""
+    if llm_chain is None:
+        return llm
+    for step in getattr(llm_chain, "steps", []):
+        if hasattr(step, "_llm_type"):
+            return step
+    return None
+
+def chain_model_name(llm_chain=None):
+    """Identifies the chat model behind a chain so cached answers of different models never mix."""
+    if llm_chain is None:
+        return MODEL_NAME
+    chat_model = chain_chat_model(llm_chain)
+    if chat_model is not None:
+        return getattr(chat_model, "model_name", None) or chat_model._llm_type
+    return type(llm_chain).__name__
+
+def estimate_tokens(cleaned_text, template=prompt_template):
+    """Rough token count of one request (prompt + answer), using ~4 characters per token."""
+    return (len(template.template) + len(cleaned_text)) // 4 + EXPECTED_RESPONSE_TOKENS
+
+def _prepare_text(ocr_text, llm_cache, llm_chain=None, words=None, fast_path=True):
+    """
+    Runs the fast-path extractor, cleans OCR text and looks the remaining LLM request up in the cache.
+    Returns a request dict; its "result" is set when no LLM call is needed.
+    """
+    fast = None
+    if fast_path:
+        data, confidences = extract_fields(ocr_text, words)
+        missing = missing_fields(confidences)
+        if not missing:
+            return {"result": fast_path_result(data, confidences)}
+        if known_fields(data, confidences):
+            fast = (data, confidences)
+
+    cleaned_text = preprocess_text(ocr_text)
+
+    if not cleaned_text or len(cleaned_text) < 30:
+        return {"result": {"error": "OCR text is too empty or unclear to parse."}}
+
+    chat_model = chain_chat_model(llm_chain)
+    if fast is not None and chat_model is not None:
+        # Ask only for the fields the fast path could not read confidently
+        data, confidences = fast
+        known = {field: data[field] for field in known_fields(data, confidences) if field != "items"}
+        missing = [field for field in FIELDS if field not in known_fields(data, confidences)]
+        request_fields = missing + (["no_items"] if "items" in missing else [])
+        template = partial_prompt_template
+        request_chain = build_chain(chat_model, template)
+        inputs = {"ocr_text": cleaned_text, "fields": ", ".join(request_fields), "known_fields": json.dumps(known)}
+        key_template = template.template + json.dumps([request_fields, known])
+    else:
+        fast = None
+        template = prompt_template
+        request_chain = llm_chain or chain
+        inputs = {"ocr_text": cleaned_text}
+        key_template = template.template
+
+    request = {"chain": request_chain, "inputs": inputs, "fast": fast, "key": None, "result": None,
+               "tokens": estimate_tokens(cleaned_text, template)}
+
+    if llm_cache is not None:
+        request["key"] = response_key(chain_model_name(llm_chain), key_template, cleaned_text)
+        cached = llm_cache.get(request["key"])
+        if cached is not None:
+            request["result"] = _complete(request, cached)
+
+    return request
+
+def _complete(request, parsed_data):
+    """Merges an LLM answer with the fast-path fields it was not asked for."""
+    if "error" in parsed_data:
+        return parsed_data
+    if request["fast"] is None:
+        parsed_data["extraction_method"] = "llm"
+        return parsed_data
+    data, confidences = request["fast"]
+    return merge_with_llm(data, confidences, parsed_data)
+
+def _finish_response(response_text, llm_cache, request, llm_chain=None):
+    """Extracts JSON from an LLM answer, caches successful parses and merges in the fast-path fields."""
+    parsed_data = extract_json_from_response(response_text)
+
+    # Failed parses are retried on the next run instead of being cached
+    if request["key"] is not None and "error" not in parsed_data:
+        llm_cache.put(request["key"], chain_model_name(llm_chain), response_text, parsed_data)
+    return _complete(request, dict(parsed_data))
+
+def _record_llm_call(request, start, outcome):
+    """Counts one LLM call, its estimated tokens and its latency."""
+    metrics.increment("llm_calls_total", outcome=outcome)
+    metrics.increment("llm_estimated_tokens_total", request["tokens"])
+    metrics.observe("llm_call_seconds", time.perf_counter() - start)
+
+def parse_text(ocr_text, llm_cache=None, llm_chain=None, words=None, fast_path=True):
+    """
+    Extracts structured invoice JSON from OCR text.
+    Fields the rule-based fast path reads confidently skip the LLM; only the rest are asked for.
+    With an LLMCache, text that was already parsed with the same model and prompt is not sent again.
+    """
+    request = _prepare_text(ocr_text, llm_cache, llm_chain, words, fast_path)
+    if request["result"] is not None:
+        return request["result"]
+
+    start = time.perf_counter()
+    try:
+        response_text = request["chain"].invoke(request["inputs"])
+    except Exception as e:
+        _record_llm_call(request, start, "error")
+        return {"error": f"Exception while invoking LLM: {str(e)}"}
+
+    _record_llm_call(request, start, "ok")
+    return _finish_response(response_text, llm_cache, request, llm_chain)
+
+async def aparse_text(ocr_text, llm_cache=None, llm_chain=None, limiter=None, max_retries=LLM_MAX_RETRIES,
+                      words=None, fast_path=True):
+    """
+    Async version of `parse_text` for batch parsing.
+    Waits for the rate limiter before every attempt and retries rate-limit and transient
+    errors with jittered exponential backoff.
+    """
+    request = _prepare_text(ocr_text, llm_cache, llm_chain, words, fast_path)
+    if request["result"] is not None:
+        return request["result"]
+
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire(request["tokens"])
 
-    combined_data = []  # Store all invoices for extracted_data.json
+        start = time.perf_counter()
+        try:
+            response_text = await request["chain"].ainvoke(request["inputs"])
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                _record_llm_call(request, start, "error")
+                return {"error": f"Exception while invoking LLM: {str(e)}"}
+            _record_llm_call(request, start, "retry")
+
+            delay = backoff_delay(attempt, error=e)
+            print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        else:
+            _record_llm_call(request, start, "ok")
+            return _finish_response(response_text, llm_cache, request, llm_chain)
 
-    for filename in os.listdir(TEXT_INPUT_FOLDER):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(TEXT_INPUT_FOLDER, filename)
+def default_rate_limiter():
+    """Rate limiter for the configured requests/tokens per minute."""
+    return RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
 
-            # Convert `.txt` filename to match YOLO's saved seal format
-            image_filename = filename.replace(".txt", ".pdf_page_1_processed.jpg")  # Matches processed invoice naming
-            seal_filename = filename.replace(".txt", ".pdf_page_1_original.jpg")  # Matches YOLO naming
+async def aparse_batch(texts, on_result=None, llm_cache=None, llm_chain=None, concurrency=LLM_CONCURRENCY, limiter=None,
+                       words_list=None, fast_path=True, semaphore=None):
+    """
+    Parses OCR texts concurrently with at most `concurrency` LLM calls in flight.
+    `words_list` optionally holds the OCR words of each text for fast-path confidences.
+    Pass a shared `semaphore` to cap concurrency across several batches running at once.
+    `on_result(index, parsed_data)` is called as soon as each text finishes, in completion order.
+    Returns the parsed results in input order.
+    """
+    limiter = limiter or default_rate_limiter()
+    semaphore = semaphore or asyncio.Semaphore(max(1, concurrency))
+    results = [None] * len(texts)
+    words_list = words_list or [None] * len(texts)
 
-            with open(file_path, "r", encoding="utf-8") as f:
-                ocr_text = f.read().strip()
+    async def parse_one(index, ocr_text):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                parsed_data = await aparse_text(ocr_text, llm_cache=llm_cache, llm_chain=llm_chain, limiter=limiter,
+                                                words=words_list[index], fast_path=fast_path)
+            except Exception as e:
+                # One unexpected failure (e.g. a broken cache entry) must not abort the other invoices
+                parsed_data = {"error": f"Exception while parsing: {str(e)}"}
 
-            cleaned_text = preprocess_text(ocr_text)
+        # Per-vendor latency shows which supplier layouts are slow to parse; the label is bounded
+        # so that a long-running service does not create one series per GSTIN it ever sees
+        method = parsed_data.get("extraction_method", "error")
+        metrics.increment("invoices_total", method=method)
+        vendor = metrics.bounded_label("vendor", parsed_data.get("supplier_gst_number") or "unknown")
+        metrics.observe("invoice_parse_seconds", time.perf_counter() - start, method=method, vendor=vendor)
+        return index, parsed_data
 
-            if not cleaned_text or len(cleaned_text) < 30:
-                parsed_data = {"error": "OCR text is too empty or unclear to parse."}
-            else:
-                try:
-                    response_text = chain.invoke({"ocr_text": cleaned_text})
-                    parsed_data = extract_json_from_response(response_text)
-                except Exception as e:
-                    parsed_data = {"error": f"Exception while invoking LLM: {str(e)}"}
+    for finished in asyncio.as_completed([parse_one(i, text) for i, text in enumerate(texts)]):
+        index, parsed_data = await finished
+        results[index] = parsed_data
+        if on_result is not None:
+            try:
+                on_result(index, parsed_data)
+            except Exception as e:
+                # e.g. a full disk while saving: report this invoice as failed and keep going
+                print(f"Error handling parsed result {index}: {e}")
+                metrics.increment("invoice_save_errors_total")
+                results[index] = {"error": f"Exception while saving the parsed invoice: {str(e)}"}
 
-            # Ensure seal detection uses the correct filename format
-            parsed_data["seal_and_sign_present"] = check_seal_signature(seal_filename)
+    return results
 
-            # Save extracted JSON
-            json_filename = filename.replace(".txt", ".json")
-            json_path = os.path.join(JSON_OUTPUT_FOLDER, json_filename)
+def parse_batch(texts, on_result=None, **kwargs):
+    """Runs `aparse_batch` to completion from synchronous code."""
+    return asyncio.run(aparse_batch(texts, on_result=on_result, **kwargs))
 
-            with open(json_path, "w", encoding="utf-8") as json_file:
-                json.dump(parsed_data, json_file, indent=4)
+def save_parsed_json(parsed_data, json_filename):
+    """Saves a single parsed invoice to the JSON output folder."""
+    json_path = os.path.join(JSON_OUTPUT_FOLDER, json_filename)
 
-            combined_data.append(parsed_data)
+    with open(json_path, "w", encoding="utf-8") as json_file:
+        json.dump(parsed_data, json_file, indent=4)
 
-    # Save combined JSON data
+def save_combined_json(combined_data):
+    """Saves all parsed invoices to extracted_data.json."""
     with open(COMBINED_JSON_FILE, "w", encoding="utf-8") as combined_file:
         json.dump(combined_data, combined_file, indent=4)
 
+def report_extraction_methods(results):
+    """Prints how many invoices were parsed without any LLM call."""
+    methods = [result.get("extraction_method") for result in results]
+    if not methods:
+        return
+    skipped = methods.count("fast_path")
+    print(f"Fast path: {skipped}/{len(methods)} invoices skipped the LLM ({skipped / len(methods):.0%}), "
+          f"{methods.count('fast_path+llm')} needed only missing fields, {methods.count('llm')} used the full prompt")
+
+def find_duplicate(document, dedup):
+    """
+    Checks an assembled invoice against the dedup index (utils.dedup) before it is sent to the LLM,
+    using the supplier GSTIN and invoice number when the fast path reads both confidently.
+    Returns (original invoice_id, layer) for a duplicate, else None.
+    """
+    data, confidences = extract_fields(document.text or "", document.words)
+    confident = confident_fields(confidences)
+    if "supplier_gst_number" not in confident or "invoice_number" not in confident:
+        return None
+    return dedup.find_invoice(data["supplier_gst_number"], data["invoice_number"], document.name,
+                              document.near_duplicates)
+
+def save_document(document, parsed_data, store=None, dedup=None):
+    """
+    Adds page-level results to a parsed invoice, writes its JSON file and appends it to the result store.
+    With a DedupIndex, an invoice that turns out to duplicate an earlier one gets `duplicate_of`
+    in its JSON file and is not stored.
+    """
+    parsed_data["invoice_id"] = document.name
+    # Seal detection results travel with the pages, no filename matching needed
+    parsed_data["seal_and_sign_present"] = document.seal_detected
+    parsed_data["source_file"] = document.source
+    parsed_data["pages"] = document.page_numbers
+    if document.seal_score is not None:
+        parsed_data["seal_and_sign_present_confidence"] = document.seal_score  # Highest detection score
+    profiles = {str(page.page_number): page.preprocess["profile"] for page in document.pages if page.preprocess}
+    if profiles:
+        parsed_data["preprocess_profiles"] = profiles
+    attach_confidences(parsed_data, document.words)
+
+    duplicate = None
+    if dedup is not None and "error" not in parsed_data:
+        duplicate = dedup.claim_invoice(parsed_data, document.near_duplicates)
+    if duplicate is not None:
+        parsed_data["duplicate_of"] = duplicate[0]
+        dedup.record_duplicate(document.name, *duplicate, detail="after parsing")
+
+    save_parsed_json(parsed_data, document.json_filename)
+    if store is not None and duplicate is None:
+        store.append(parsed_data)
+    if duplicate is not None:
+        print(f"Parsed {document.name}: duplicate of {duplicate[0]}, not stored")
+    else:
+        print(f"Parsed {document.name} (pages {', '.join(map(str, document.page_numbers))})")
+
+def skip_duplicates(documents, dedup):
+    """Returns the documents that are not duplicates of earlier invoices, recording the ones that are."""
+    unique = []
+    for document in documents:
+        duplicate = find_duplicate(document, dedup)
+        if duplicate is None:
+            unique.append(document)
+            continue
+        dedup.record_duplicate(document.name, *duplicate, detail="before parsing")
+        print(f"Skipping {document.name}: duplicate of {duplicate[0]}")
+    return unique
+
+async def aparse_documents(documents, store=None, dedup=None, **kwargs):
+    """
+    Parses assembled invoices (see utils.assembler) with one LLM request per invoice,
+    saving each invoice as soon as it is ready. Takes the options of `aparse_batch`.
+    With a DedupIndex, duplicates of earlier invoices are skipped before the LLM call where the
+    fast path can tell, and left out of the results when parsing reveals them. PDFs whose invoices
+    were all handled are then marked complete in the index.
+    """
+    ensure_folder_exists(JSON_OUTPUT_FOLDER)
+    all_documents = documents
+    if dedup is not None:
+        documents = skip_duplicates(documents, dedup)
+
+    results = await aparse_batch([document.text or "" for document in documents],
+                                 on_result=lambda index, parsed_data: save_document(documents[index], parsed_data,
+                                                                                    store, dedup),
+                                 words_list=[document.words for document in documents], **kwargs)
+
+    if dedup is not None:
+        # Only PDFs whose every invoice was stored (or skipped as a duplicate) make later copies exact duplicates
+        failed = {document.pages[0].content_hash for document, parsed_data in zip(documents, results)
+                  if "error" in parsed_data and document.pages}
+        for pdf_hash in {document.pages[0].content_hash for document in all_documents if document.pages} - failed:
+            if pdf_hash is not None:
+                dedup.complete_pdf(pdf_hash)
+    return [parsed_data for parsed_data in results if "duplicate_of" not in parsed_data]
+
+def parse_documents(documents, llm_cache=None, concurrency=LLM_CONCURRENCY, llm_chain=None, limiter=None, fast_path=True,
+                    store=None, dedup=None):
+    """
+    Parses assembled invoices concurrently and returns this run's invoice list.
+    With a ResultStore every invoice is appended to it as soon as it is parsed;
+    without one the list is saved to extracted_data.json instead.
+    """
+    combined_data = asyncio.run(aparse_documents(documents, store=store, dedup=dedup, llm_cache=llm_cache,
+                                                 llm_chain=llm_chain, concurrency=concurrency, limiter=limiter,
+                                                 fast_path=fast_path))
+
+    report_extraction_methods(combined_data)
+    if store is None:
+        save_combined_json(combined_data)
+    return combined_data
+
+def parse_pages(pages, **kwargs):
+    """Groups in-memory Page objects into invoices and parses each invoice once."""
+    return parse_documents(group_pages(pages), **kwargs)
+
+def parse_invoice_text_files(concurrency=LLM_CONCURRENCY, llm_cache=None, fast_path=True, store=None, seal_manifest=None):
+    """
+    Parses the saved OCR text files, one invoice at a time, and combines all invoices.
+    Seal results are read from the seal manifest (default: seal_manifest.SEAL_MANIFEST_FILE).
+    """
+    pages = load_pages_from_text_folder(TEXT_INPUT_FOLDER)
+    seal_manifest = seal_manifest or SealManifest()
+
+    for page in pages:
+        page.words = load_words(page.text_filename)
+        check_seal_signature(page, seal_manifest)
+
+    return parse_pages(pages, concurrency=concurrency, llm_cache=llm_cache, fast_path=fast_path, store=store)
+
 if __name__ == "__main__":
-    parse_invoice_text_files()
\ No newline at end of file
+    parse_invoice_text_files(llm_cache=LLMCache(), store=ResultStore())
\ No newline at end of file
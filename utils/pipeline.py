@@ -0,0 +1,270 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, List
+
+from utils import metrics
+from utils.document import PipelineContext, load_pages_from_folder, load_pages_from_text_folder
+
+# Stage modules are imported inside each stage so that a run only pays for the
+# heavy libraries (YOLO, langchain, pandas) of the stages it actually selects.
+
+
+@dataclass
+class Stage:
+    """A named pipeline step that reads from and writes to the shared PipelineContext."""
+    name: str
+    description: str
+    run: Callable[[PipelineContext], None]
+
+
+def _ensure_processed_pages(context):
+    """Loads processed page images from disk when the preprocess stage did not run."""
+    if not context.pages:
+        from utils.preprocess import PROCESSED_FOLDER
+        context.pages = load_pages_from_folder(PROCESSED_FOLDER, "processed")
+
+def _ensure_original_images(context):
+    """Attaches original image paths to pages that were not rendered in this run."""
+    from utils.preprocess import ORIGINAL_FOLDER
+
+    if not context.pages:
+        context.pages = load_pages_from_folder(ORIGINAL_FOLDER, "original")
+        return
+
+    for page in context.pages:
+        if page.original is None and page.original_path is None and not page.text_layer:
+            page.original_path = os.path.join(ORIGINAL_FOLDER, page.original_filename)
+
+def _ensure_page_text(context):
+    """
+    Loads OCR text and words from disk for pages that were not OCR'd in this run, and their
+    seal/signature results from the seal manifest when the seals stage did not run.
+    """
+    from utils.ocr_utils import TEXT_OUTPUT_FOLDER, load_words
+    from utils.parser import check_seal_signature
+
+    if not context.pages:
+        _ensure_processed_pages(context)
+    if not context.pages:
+        context.pages = load_pages_from_text_folder(TEXT_OUTPUT_FOLDER)
+
+    for page in context.pages:
+        if page.text is None:
+            text_path = os.path.join(TEXT_OUTPUT_FOLDER, page.text_filename)
+            if os.path.exists(text_path):
+                with open(text_path, "r", encoding="utf-8") as f:
+                    page.text = f.read().strip()
+        if page.words is None:
+            page.words = load_words(page.text_filename)
+        if page.seal_score is None and context.seal_manifest is not None:
+            check_seal_signature(page, context.seal_manifest)
+
+def _ensure_invoices(context):
+    """
+    Uses the result store (streamed, latest record per invoice) when the parse stage did not run,
+    falling back to extracted_data.json without one.
+    """
+    if context.invoices is None and context.store is not None:
+        context.invoices = context.store
+    if context.invoices is None:
+        from utils.validator import EXTRACTED_DATA_FILE
+        if os.path.exists(EXTRACTED_DATA_FILE):
+            with open(EXTRACTED_DATA_FILE, "r", encoding="utf-8") as f:
+                context.invoices = json.load(f)
+
+
+def run_preprocess(context):
+    from utils.preprocess import process_pdfs
+    context.pages = process_pdfs(context.input_dir, workers=context.workers, keep_images=context.keep_images,
+                                 max_in_flight_pages=context.max_in_flight_pages,
+                                 save_processed=context.save_debug_images, filter_chain=context.filter_chain,
+                                 cache=context.cache, text_layer=context.text_layer, dedup=context.dedup)
+
+def run_ocr(context):
+    from utils.ocr_utils import extract_text_from_pages
+    _ensure_processed_pages(context)
+    extract_text_from_pages(context.pages, cache=context.cache, workers=context.workers)
+
+def run_seals(context):
+    from utils.image_utils import BATCH_SIZE, DEFAULT_REGION, IMAGE_SIZE, detect_seals_in_pages
+    _ensure_original_images(context)
+    detect_seals_in_pages(context.pages, cache=context.cache, batch_size=context.seal_batch_size or BATCH_SIZE,
+                          imgsz=context.seal_image_size or IMAGE_SIZE, region=context.seal_region or DEFAULT_REGION,
+                          manifest=context.seal_manifest, save_crops=context.save_seal_crops)
+
+def run_parse(context):
+    from utils.assembler import group_pages
+    from utils.parser import LLM_CONCURRENCY, parse_documents
+    _ensure_page_text(context)
+    context.documents = group_pages(context.pages)
+    context.invoices = parse_documents(context.documents, llm_cache=context.llm_cache, llm_chain=context.llm_chain,
+                                       concurrency=context.llm_concurrency or LLM_CONCURRENCY,
+                                       fast_path=context.fast_path, store=context.store, dedup=context.dedup)
+
+def run_validate(context):
+    from utils.validator import generate_verifiability_report
+    _ensure_invoices(context)
+    if context.invoices is None:
+        print("No parsed invoices available, skipping validation.")
+        return
+    context.report = generate_verifiability_report(context.invoices, seal_manifest=context.seal_manifest)
+
+def run_export(context):
+    from utils.convert_to_excel import export_invoices, export_store
+    if context.store is not None:
+        # Only invoices stored since the last export, unless a full export is asked for
+        export_store(context.store, formats=context.export_formats, full=context.full_export)
+        return
+
+    _ensure_invoices(context)
+    if context.invoices is None:
+        print("No parsed invoices available, skipping Excel export.")
+        return
+    export_invoices(context.invoices, formats=context.export_formats)
+
+
+STAGES: List[Stage] = [
+    Stage("preprocess", "Convert PDFs to images and preprocess them", run_preprocess),
+    Stage("ocr", "Extract text from processed pages with Tesseract", run_ocr),
+    Stage("seals", "Detect seals and signatures with YOLO", run_seals),
+    Stage("parse", "Group pages into invoices and parse each into structured JSON", run_parse),
+    Stage("validate", "Generate the verifiability report", run_validate),
+    Stage("export", "Export parsed invoices to Excel, JSON and Parquet", run_export),
+]
+
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+# Stage that reads each in-memory page image; once it has run (or is not selected) the image is dropped
+IMAGE_CONSUMERS = {"processed": "ocr", "original": "seals"}
+
+def _release_images(context, remaining):
+    """Drops the page images no stage in `remaining` reads any more (originals stay on disk)."""
+    for image, consumer in IMAGE_CONSUMERS.items():
+        if consumer not in remaining:
+            for page in context.pages:
+                setattr(page, image, None)
+
+def validate_stage_names(stage_names):
+    """Raises ValueError for names that are not in STAGE_NAMES."""
+    unknown = set(stage_names) - set(STAGE_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+
+
+def run_pipeline(stage_names=None, input_dir="input", workers=None, keep_images=False, max_in_flight_pages=None,
+                 save_debug_images=False, filter_chain=None, cache=None, llm_cache=None,
+                 seal_batch_size=None, seal_image_size=None, seal_region=None, seal_manifest=None, save_seal_crops=True,
+                 dedup=None, llm_concurrency=None, llm_chain=None, fast_path=True, store=None,
+                 export_formats=None, full_export=False, metrics_file=None, profile_stages=None, text_layer=True):
+    """
+    Runs the selected stages in pipeline order inside the current process.
+    Pages and invoices are passed between stages in memory; stages whose
+    inputs were not produced in this run fall back to the files on disk.
+    Each stage finishes every page before the next starts, so page images are
+    written to disk and re-read by ocr and seals: memory stays flat however many
+    pages the run has, with at most `max_in_flight_pages` being rendered at once.
+    `keep_images` holds them in memory instead (faster, but memory grows with the
+    page count) until the stages reading them (ocr, seals) are done; preprocessed
+    pages are then only written to disk with `save_debug_images`.
+    With a ContentCache, unchanged PDFs and pages reuse the results of earlier runs;
+    with an LLMCache, text the LLM has already parsed is not sent again.
+    With `fast_path`, fields the rule-based extractor reads confidently skip the LLM.
+    With a ResultStore, parsed invoices are appended to it and later stages read from it.
+    `export_formats` selects the line-item exports ("xlsx", "csv", "parquet"; default: Excel only).
+    The export stage writes the invoices stored since the previous export to output/updates/;
+    `full_export` regenerates extracted_data.json and every export from the whole store instead.
+    Stage and page timings, counters and peak memory are written to `metrics_file` (see utils.metrics);
+    stages named in `profile_stages` also run under cProfile.
+    With `text_layer`, pages of born-digital PDFs are read from their text layer instead of being OCR'd.
+    With a SealManifest, every page's seal detections (boxes, scores, crop paths) are recorded in it
+    and the validator reads seal scores from it; `save_seal_crops` writes each detection's crop.
+    With a DedupIndex, re-sent PDFs and invoices are skipped as early as they can be recognized.
+    """
+    selected = set(stage_names or STAGE_NAMES)
+    validate_stage_names(selected)
+
+    if filter_chain is not None:
+        from utils.preprocess import validate_filter_chain
+        validate_filter_chain(filter_chain)
+
+    if export_formats is not None:
+        from utils.convert_to_excel import validate_export_formats
+        validate_export_formats(export_formats)
+
+    validate_stage_names(profile_stages or [])
+
+    context = PipelineContext(input_dir=input_dir, workers=workers, keep_images=keep_images,
+                              max_in_flight_pages=max_in_flight_pages,
+                              save_debug_images=save_debug_images, filter_chain=filter_chain, cache=cache,
+                              llm_cache=llm_cache, seal_batch_size=seal_batch_size,
+                              seal_image_size=seal_image_size, seal_region=seal_region,
+                              seal_manifest=seal_manifest, save_seal_crops=save_seal_crops, dedup=dedup,
+                              llm_concurrency=llm_concurrency, llm_chain=llm_chain, fast_path=fast_path,
+                              store=store, export_formats=export_formats, full_export=full_export,
+                              metrics_file=metrics_file,
+                              profile_stages=profile_stages, text_layer=text_layer)
+
+    remaining = [stage.name for stage in STAGES if stage.name in selected]
+    for stage in STAGES:
+        if stage.name not in selected:
+            continue
+
+        print(f"Running stage '{stage.name}': {stage.description}...")
+        start = time.perf_counter()
+        with metrics.profile(stage.name, enabled=stage.name in (profile_stages or ())), \
+                metrics.span("stage", stage=stage.name):
+            stage.run(context)
+        print(f"Stage '{stage.name}' finished in {time.perf_counter() - start:.2f}s")
+
+        remaining.remove(stage.name)
+        _release_images(context, remaining)
+
+    if cache is not None:
+        print(f"Cache hits/misses: {cache.summary()}")
+        cache.evict()
+
+    if llm_cache is not None:
+        print(f"LLM cache: {llm_cache.stats()}")
+
+    metrics.write_json(metrics_file or metrics.METRICS_FILE)
+    return context
+
+def run_streaming(input_dir="input", watch=False, **options):
+    """
+    Streams each PDF through every stage as soon as the previous stage is done with it,
+    instead of running one stage at a time over the whole folder (see utils.streaming).
+    With `watch`, keeps running and processes new PDFs as they land in `input_dir`.
+    Takes the same options as `run_pipeline`, apart from the stage selection.
+    """
+    from utils.streaming import run_stream, watch_folder
+
+    if options.get("filter_chain") is not None:
+        from utils.preprocess import validate_filter_chain
+        validate_filter_chain(options["filter_chain"])
+
+    if options.get("export_formats") is not None:
+        from utils.convert_to_excel import validate_export_formats
+        validate_export_formats(options["export_formats"])
+
+    validate_stage_names(options.get("profile_stages") or [])
+
+    context = PipelineContext(input_dir=input_dir, **options)
+
+    if watch:
+        watch_folder(context)
+    else:
+        from utils.preprocess import list_pdfs
+        start = time.perf_counter()
+        context.invoices = run_stream(list_pdfs(input_dir), context)
+        print(f"Streamed {len(context.invoices)} invoice(s) in {time.perf_counter() - start:.2f}s")
+
+    if context.cache is not None:
+        print(f"Cache hits/misses: {context.cache.summary()}")
+        context.cache.evict()
+
+    if context.llm_cache is not None:
+        print(f"LLM cache: {context.llm_cache.stats()}")
+
+    return context
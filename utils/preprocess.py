@@ -1,9 +1,20 @@
+import json
 import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
+from utils import metrics
+from utils.cache import file_hash, make_key
+from utils.document import Page
+from utils.workers import make_executor
+
 # Manually specify Poppler path if needed
 POPPLER_PATH = r"C:\Program Files\poppler-24.08.0\Library\bin"
 
@@ -12,77 +23,553 @@ OUTPUT_IMAGE_FOLDER = "output/images"
 ORIGINAL_FOLDER = os.path.join(OUTPUT_IMAGE_FOLDER, "original")
 PROCESSED_FOLDER = os.path.join(OUTPUT_IMAGE_FOLDER, "processed")
 
+# Rasterization settings
+RENDER_DPI = 300
+PAGES_PER_TASK = 2                   # Pages rendered by one poppler call / pool task
+MAX_WORKERS = os.cpu_count() or 1    # Processes used for rendering + preprocessing
+
+# Bump when rendering or preprocessing changes so cached pages are not reused
+CACHE_VERSION = 2
+
+# Adaptive preprocessing: a cheap quality estimate picks a profile per page (see choose_profile)
+A4_HEIGHT_INCHES = 11.69     # Long side used to estimate the DPI of pages of unknown resolution
+QUALITY_SAMPLE_SIZE = 1024   # Noise and contrast are estimated on a centered full-resolution crop this big...
+SKEW_SAMPLE_WIDTH = 600      # ...and skew on a copy of the whole page downscaled to this width
+CLEAN_NOISE = 2.0            # Noise sigma (gray levels) below which a page is not denoised at all...
+HEAVY_NOISE = 8.0            # ...and above which it is denoised at full resolution instead of downscaled
+MIN_DOWNSCALE_DPI = 250      # Pages below this resolution lose glyph detail when denoised at half size
+LOW_CONTRAST = 0.35          # Ink-to-paper spread (share of 0-255) below which contrast is stretched first
+INK_PERCENTILE = 0.1         # Gray level percentile taken as the page's darkest ink
+MIN_INK_SPREAD = 16          # Samples with no ink darker than the paper by this much count as blank
+MIN_DESKEW_DEGREES = 0.5     # Smaller skew is left alone...
+MAX_SKEW_DEGREES = 5.0       # ...and larger skew is not searched for
+SKEW_STEP_DEGREES = 0.25
+
+DENOISE_STRENGTH = 40             # `h` of fastNlMeansDenoising at full resolution
+DOWNSCALED_DENOISE_STRENGTH = 20  # Halving the page already averages away about half of the noise
+DENOISE_TILE_SIZE = 1024          # Tiles denoised in parallel by `denoise_tiled`...
+DENOISE_TILE_OVERLAP = 32         # ...with this margin so tile seams match the full-page result
+DENOISE_THREADS = os.cpu_count() or 1
+
+_pool = None
+_pool_workers = None
+
 def ensure_folder_exists(folder_path):
     """Creates a folder if it does not exist."""
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    os.makedirs(folder_path, exist_ok=True)  # No error when another process creates it at the same time
+
+def get_page_count(pdf_path):
+    """Reads the number of pages from the PDF metadata without rendering anything."""
+    return pdfinfo_from_path(pdf_path, poppler_path=POPPLER_PATH)["Pages"]
 
-def convert_pdf_to_images(input_dir):
+def rasterize_config(filter_chain=None):
+    """Settings that change a rendered/preprocessed page; part of its cache key."""
+    if filter_chain is None:
+        return [RENDER_DPI, "adaptive", PREPROCESS_PROFILES, CLEAN_NOISE, HEAVY_NOISE, MIN_DOWNSCALE_DPI,
+                LOW_CONTRAST, MIN_DESKEW_DEGREES, MAX_SKEW_DEGREES]
+    return [RENDER_DPI, filter_chain]
+
+def process_page_range(pdf_path, first_page, last_page, keep_images=True, save_processed=True,
+                       filter_chain=None, pdf_hash=None, cache=None):
     """
-    Converts all PDFs in the input folder to images (one per page).
-    Saves both original and preprocessed images separately.
-    Returns a list of file paths.
+    Renders and preprocesses pages `first_page`..`last_page` (1-based, inclusive) of a PDF.
+    Saves the original image and returns the pages as Page objects.
+    The preprocessed image is only written to disk when `save_processed` is set (or `keep_images` is off).
+    With `keep_images=False` only the file paths are returned, which keeps results cheap to pass between processes.
+    When a cache is given, both images are also stored in it under the page's content key.
+    """
+    save_processed = save_processed or not keep_images
+    filename = os.path.basename(pdf_path)
+    pages = []
+
+    start = time.perf_counter()
+    rendered = convert_from_path(pdf_path, dpi=RENDER_DPI, first_page=first_page,
+                                 last_page=last_page, poppler_path=POPPLER_PATH)
+    render_seconds = (time.perf_counter() - start) / max(1, len(rendered))
+
+    for page_num, page_image in enumerate(rendered, start=first_page):
+        # Convert to OpenCV format
+        image = np.array(page_image)
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+        page = Page(source=filename, page_number=page_num, original=image, content_hash=pdf_hash, pdf_path=pdf_path)
+        page.timings["render"] = render_seconds
+
+        # Apply preprocessing; without a fixed filter chain the profile is chosen from the page's quality
+        start = time.perf_counter()
+        if filter_chain is None:
+            page.processed, page.preprocess = adaptive_preprocess(image, dpi=RENDER_DPI)
+        else:
+            page.processed = preprocess_image(image, filter_chain)
+        page.timings["preprocess"] = time.perf_counter() - start
+
+        # Save original image
+        page.original_path = os.path.join(ORIGINAL_FOLDER, page.original_filename)
+        page_image.save(page.original_path, "JPEG")
+
+        # Preprocessed image is only a debug artifact when OCR reads it from memory
+        if save_processed:
+            page.processed_path = os.path.join(PROCESSED_FOLDER, page.processed_filename)
+            cv2.imwrite(page.processed_path, page.processed)
+
+        if cache is not None and pdf_hash is not None:
+            page.cache_key = make_key("rasterize", CACHE_VERSION, pdf_hash, rasterize_config(filter_chain), page_num)
+            cache.put_file("rasterize", page.cache_key, ".jpg", page.original_path)
+            cache.put_image("rasterize", page.cache_key, ".png", page.processed)  # Lossless, unlike the JPEG
+            if page.preprocess is not None:
+                cache.put_json("rasterize", page.cache_key, page.preprocess)
+
+        if not keep_images:
+            page.original = None
+            page.processed = None
+
+        pages.append(page)
+
+    return pages
+
+def load_cached_pages(cache, pdf_path, pdf_hash, filter_chain=None, skip_pages=()):
+    """
+    Returns the pages of a PDF from the cache, or None unless every page is cached.
+    Pages in `skip_pages` (read from the text layer) are neither needed nor returned.
+    Cached pages only carry file paths; images are read lazily by the stages that still need them.
+    """
+    config = rasterize_config(filter_chain)
+    manifest = cache.get_json("rasterize", make_key("rasterize", CACHE_VERSION, pdf_hash, config))
+    if manifest is None:
+        return None
+
+    filename = os.path.basename(pdf_path)
+    pages = []
+
+    for page_num in range(1, manifest["page_count"] + 1):
+        if page_num in skip_pages:
+            continue
+        key = make_key("rasterize", CACHE_VERSION, pdf_hash, config, page_num)
+        original_path = cache.get_path("rasterize", key, ".jpg", record=False)
+        processed_path = cache.get_path("rasterize", key, ".png", record=False)
+        if original_path is None or processed_path is None:
+            return None  # Partially evicted, render the PDF again
+
+        page = Page(source=filename, page_number=page_num, content_hash=pdf_hash, cache_key=key, pdf_path=pdf_path,
+                    original_path=os.path.join(ORIGINAL_FOLDER, f"{filename}_page_{page_num}_original.jpg"),
+                    processed_path=processed_path)
+
+        # The preprocessing profile chosen when the page was rendered
+        record_path = cache.get_path("rasterize", key, ".json", record=False)
+        if record_path is not None:
+            with open(record_path, "r", encoding="utf-8") as f:
+                page.preprocess = json.load(f)
+
+        # Keep output/images/original complete even when nothing is rendered
+        if not os.path.exists(page.original_path):
+            shutil.copyfile(original_path, page.original_path)
+
+        pages.append(page)
+
+    return pages
+
+def _init_worker():
+    """Keeps OpenCV single-threaded inside pool workers so processes don't oversubscribe the cores."""
+    cv2.setNumThreads(1)
+
+def get_render_pool(workers=None):
+    """
+    Starts a render/preprocess pool on first use and keeps it alive for later calls
+    (see `iter_processed_pages(warm_pool=True)`), replacing it if a worker process died.
+    """
+    global _pool, _pool_workers
+    workers = workers or MAX_WORKERS
+    if _pool is None or _pool_workers != workers or getattr(_pool, "_broken", False):
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = make_executor(workers, initializer=_init_worker)
+        _pool_workers = workers
+    return _pool
+
+def _collect_pages(task, future, near_duplicates=None):
+    """
+    Returns the pages of a finished render task, reporting failures instead of aborting the batch.
+    Pages of PDFs in `near_duplicates` are linked to the earlier PDFs they look like.
+    """
+    pdf_path, first_page, last_page = task
+    try:
+        pages = future.result()
+    except Exception as e:
+        print(f"Error converting {os.path.basename(pdf_path)} pages {first_page}-{last_page}: {e}")
+        metrics.increment("errors_total", stage="rasterize")
+        return []
+
+    # Pages were timed in the worker process; record them in this process's metrics
+    for page in pages:
+        page.near_duplicates = (near_duplicates or {}).get(pdf_path)
+        metrics.increment("pages_total", stage="rasterize")
+        if page.preprocess is not None:
+            metrics.increment("preprocess_profile_total", profile=page.preprocess["profile"])
+        for step, seconds in page.timings.items():
+            metrics.observe("page_seconds", seconds, stage=step)
+    return pages
+
+def read_text_layer(pdf_path, pdf_hash=None):
+    """
+    Returns one entry per page: a Page already holding its text and words when the page
+    has a usable text layer, else None. Returns [] if the PDF cannot be read with PyMuPDF.
+    """
+    from utils.text_layer import extract_text_layer
+
+    try:
+        text_pages = extract_text_layer(pdf_path, pdf_hash)
+    except Exception as e:
+        print(f"Could not read the text layer of {os.path.basename(pdf_path)}, rendering every page: {e}")
+        return []
+
+    found = sum(page is not None for page in text_pages)
+    if found:
+        print(f"{os.path.basename(pdf_path)}: {found}/{len(text_pages)} pages read from the text layer")
+        metrics.increment("text_layer_pages_total", found)
+    return text_pages
+
+def _page_runs(text_pages, page_count, pages_per_task):
+    """
+    Splits pages 1..page_count into runs of consecutive text-layer pages and runs of
+    at most `pages_per_task` pages to render. Returns [is_text, first, last, text pages] lists.
+    """
+    runs = []
+    for page_num in range(1, page_count + 1):
+        text_page = text_pages[page_num - 1] if text_pages else None
+        is_text = text_page is not None
+        if runs and runs[-1][0] == is_text and (is_text or runs[-1][2] - runs[-1][1] + 1 < pages_per_task):
+            runs[-1][2] = page_num
+        else:
+            runs.append([is_text, page_num, page_num, []])
+        if is_text:
+            runs[-1][3].append(text_page)
+    return runs
+
+def iter_processed_pages(pdf_paths, workers=None, pages_per_task=PAGES_PER_TASK,
+                         max_in_flight_pages=None, keep_images=True, save_processed=True,
+                         filter_chain=None, cache=None, text_layer=True, dedup=None, warm_pool=False):
+    """
+    Streams preprocessed pages of the given PDFs, in document and page order.
+    Page ranges are rendered and preprocessed across a process pool of `workers` processes.
+    At most `max_in_flight_pages` pages are being rendered or waiting to be consumed at any time,
+    so memory stays bounded regardless of how many pages a PDF has.
+    With a cache, PDFs whose content and settings are unchanged are not rendered again.
+    With `text_layer`, born-digital pages are returned with the text and words of their text layer
+    and no images: they skip rendering, preprocessing and OCR (seal detection renders them lazily).
+    With a DedupIndex, byte-identical copies of PDFs seen before under another name are skipped, and
+    pages of PDFs that look like earlier ones carry `near_duplicates` for the parser to confirm.
+    With `warm_pool`, the process pool is kept for the next call instead of being started per call.
     """
+    workers = workers or MAX_WORKERS
+    max_in_flight_pages = max_in_flight_pages or workers * pages_per_task * 2
+    max_in_flight_tasks = max(1, max_in_flight_pages // pages_per_task)
+
     ensure_folder_exists(ORIGINAL_FOLDER)
     ensure_folder_exists(PROCESSED_FOLDER)
 
-    image_paths = []
+    executor = get_render_pool(workers) if warm_pool else make_executor(workers, initializer=_init_worker)
+
+    with nullcontext(executor) if warm_pool else executor:
+        in_flight = deque()
+        near_duplicates = {}
 
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(input_dir, filename)
+        for pdf_path in pdf_paths:
+            pdf_hash = None
+            if dedup is not None:
+                try:
+                    pdf_hash = file_hash(pdf_path)
+                    layer, original = dedup.check_pdf(pdf_path, pdf_hash)
+                except Exception as e:
+                    print(f"Could not check {os.path.basename(pdf_path)} for duplicates: {e}")
+                    layer, original = None, None
+                if layer == "exact":
+                    print(f"Skipping {os.path.basename(pdf_path)}: identical to {original}, already processed")
+                    continue
+                if layer == "near":
+                    print(f"{os.path.basename(pdf_path)} looks like {', '.join(original)}, checking its invoice numbers")
+                    near_duplicates[pdf_path] = original
 
             try:
-                pages = convert_from_path(pdf_path, dpi=300, poppler_path=POPPLER_PATH)
+                if pdf_hash is None and cache is not None:
+                    pdf_hash = file_hash(pdf_path)
+                text_pages = read_text_layer(pdf_path, pdf_hash) if text_layer else []
+                skip_pages = {page.page_number for page in text_pages if page is not None}
+                cached_pages = (load_cached_pages(cache, pdf_path, pdf_hash, filter_chain, skip_pages)
+                                if cache is not None else None)
+                if text_pages:
+                    page_count = len(text_pages)
+                elif cached_pages is not None:
+                    page_count = len(cached_pages)
+                else:
+                    page_count = get_page_count(pdf_path)
             except Exception as e:
-                print(f"Error converting {filename}: {e}")
+                print(f"Error converting {os.path.basename(pdf_path)}: {e}")
+                continue
+
+            if cached_pages is not None:
+                if cached_pages:
+                    print(f"Skipping {os.path.basename(pdf_path)}: {len(cached_pages)} rendered pages unchanged since last run")
+                done = Future()
+                done.set_result(sorted(cached_pages + [page for page in text_pages if page is not None],
+                                       key=lambda page: page.page_number))
+                in_flight.append(((pdf_path, 1, page_count), done))
                 continue
 
-            for page_num, page in enumerate(pages):
-                # Save original image
-                original_image_path = os.path.join(ORIGINAL_FOLDER, f"{filename}_page_{page_num+1}_original.jpg")
-                page.save(original_image_path, "JPEG")
+            if cache is not None:
+                manifest_key = make_key("rasterize", CACHE_VERSION, pdf_hash, rasterize_config(filter_chain))
+                cache.put_json("rasterize", manifest_key, {"page_count": page_count})
 
-                # Convert to OpenCV format
-                image = np.array(page)
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            for is_text, first_page, last_page, run_pages in _page_runs(text_pages, page_count, pages_per_task):
+                task = (pdf_path, first_page, last_page)
+                if is_text:
+                    done = Future()
+                    done.set_result(run_pages)
+                    in_flight.append((task, done))
+                    continue
 
-                # Apply preprocessing
-                preprocessed = preprocess_image(image)
+                in_flight.append((task, executor.submit(process_page_range, *task, keep_images, save_processed,
+                                                        filter_chain, pdf_hash, cache)))
+                metrics.set_gauge("in_flight_tasks", len(in_flight), stage="rasterize")
 
-                # Save preprocessed image
-                processed_image_path = os.path.join(PROCESSED_FOLDER, f"{filename}_page_{page_num+1}_processed.jpg")
-                cv2.imwrite(processed_image_path, preprocessed)
+                # Wait for the oldest task before submitting more work (backpressure)
+                while len(in_flight) >= max_in_flight_tasks:
+                    yield from _collect_pages(*in_flight.popleft(), near_duplicates)
 
-                # Store paths
-                image_paths.append((original_image_path, processed_image_path))
+        while in_flight:
+            yield from _collect_pages(*in_flight.popleft(), near_duplicates)
 
-    return image_paths
+def list_pdfs(input_dir):
+    """Returns the paths of all PDFs in the input folder, sorted by name."""
+    return [os.path.join(input_dir, filename) for filename in sorted(os.listdir(input_dir))
+            if filename.endswith(".pdf")]
 
-def preprocess_image(image):
+def process_pdf(pdf_path, **kwargs):
+    """Converts a single PDF to preprocessed Page objects (see `iter_processed_pages` for options)."""
+    return list(iter_processed_pages([pdf_path], **kwargs))
+
+def process_pdfs(input_dir, **kwargs):
+    """Converts every PDF in the input folder to preprocessed Page objects."""
+    return list(iter_processed_pages(list_pdfs(input_dir), **kwargs))
+
+def convert_pdf_to_images(input_dir, workers=None):
     """
-    Apply grayscale, sharpening, denoise, adaptive thresholding, and morphological transformations.
+    Converts all PDFs in the input folder to images (one per page).
+    Saves both original and preprocessed images separately.
+    Returns a list of file paths.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    pages = iter_processed_pages(list_pdfs(input_dir), workers=workers, keep_images=False, text_layer=False)
+    return [(page.original_path, page.processed_path) for page in pages]
 
-    # Apply sharpening to enhance text edges
+def sharpen(image):
+    """Apply sharpening to enhance text edges."""
     kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    sharpened = cv2.filter2D(gray, -1, kernel)
+    return cv2.filter2D(image, -1, kernel)
 
-    # Stronger denoising
-    denoised = cv2.fastNlMeansDenoising(sharpened, h=40)  
+def denoise(image):
+    """Stronger non-local means denoising."""
+    return cv2.fastNlMeansDenoising(image, h=DENOISE_STRENGTH)
 
-    # Adaptive threshold for better text separation
-    thresh = cv2.adaptiveThreshold(
-        denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+def denoise_downscaled(image):
+    """Non-local means denoising at half resolution (about 4x cheaper), scaled back to the page size."""
+    height, width = image.shape[:2]
+    small = cv2.resize(image, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    small = cv2.fastNlMeansDenoising(small, h=DOWNSCALED_DENOISE_STRENGTH)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+def _denoise_tile(image, output, top, left):
+    """Denoises one tile (plus its overlap margin) and writes its inner part into `output`."""
+    height, width = image.shape[:2]
+    bottom, right = min(top + DENOISE_TILE_SIZE, height), min(left + DENOISE_TILE_SIZE, width)
+    y0, x0 = max(0, top - DENOISE_TILE_OVERLAP), max(0, left - DENOISE_TILE_OVERLAP)
+    y1, x1 = min(height, bottom + DENOISE_TILE_OVERLAP), min(width, right + DENOISE_TILE_OVERLAP)
+    tile = cv2.fastNlMeansDenoising(np.ascontiguousarray(image[y0:y1, x0:x1]), h=DENOISE_STRENGTH)
+    output[top:bottom, left:right] = tile[top - y0:bottom - y0, left - x0:right - x0]
+
+def denoise_tiled(image):
+    """
+    Full-resolution denoising split into overlapping tiles run on DENOISE_THREADS threads
+    (OpenCV releases the GIL), so one heavy page uses every core even in a single-threaded worker.
+    """
+    height, width = image.shape[:2]
+    output = np.empty_like(image)
+    tiles = [(top, left) for top in range(0, height, DENOISE_TILE_SIZE) for left in range(0, width, DENOISE_TILE_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(DENOISE_THREADS, len(tiles))) as executor:
+        list(executor.map(lambda tile: _denoise_tile(image, output, *tile), tiles))
+    return output
+
+def normalize_contrast(image):
+    """Stretches the gray levels so the darkest ink is black and the paper is white (for faded scans)."""
+    sample = image[::4, ::4]
+    ink, paper = float(np.percentile(sample, INK_PERCENTILE)), float(np.median(sample))
+    if paper - ink < MIN_INK_SPREAD:
+        return image  # Blank page, stretching would only amplify paper noise
+    stretched = (image.astype(np.float32) - ink) * (255.0 / (paper - ink))
+    return np.clip(stretched, 0, 255).astype(np.uint8)
+
+def gaussian_blur(image):
+    """Apply Gaussian Blur to reduce noise."""
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+def adaptive_threshold(image):
+    """Adaptive threshold for better text separation."""
+    return cv2.adaptiveThreshold(
+        image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY, 11, 2
     )
 
-    # Morphological opening to remove small artifacts
+def morph_open(image):
+    """Morphological opening to remove small artifacts."""
     kernel = np.ones((2,2), np.uint8)
-    morph = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
+
+def rotate_image(image, degrees):
+    """Rotates a grayscale page counter-clockwise around its center, filling the corners with white."""
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), degrees, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+# Filters available to a preprocessing chain, by name
+FILTERS = {
+    "sharpen": sharpen,
+    "denoise": denoise,
+    "denoise_downscaled": denoise_downscaled,
+    "denoise_tiled": denoise_tiled,
+    "normalize": normalize_contrast,
+    "blur": gaussian_blur,
+    "threshold": adaptive_threshold,
+    "morph_open": morph_open,
+}
+
+# The fixed filter chain (denoising every page at full resolution); default of `apply_filter_chain`
+FILTER_CHAIN = ["sharpen", "denoise", "threshold", "morph_open"]
+
+# Filter chains the adaptive mode chooses from (see choose_profile); "full" is the fixed chain above
+PREPROCESS_PROFILES = {
+    "clean": ["sharpen", "threshold", "morph_open"],
+    "downscaled": ["sharpen", "denoise_downscaled", "threshold", "morph_open"],
+    "tiled": ["sharpen", "denoise_tiled", "threshold", "morph_open"],
+    "full": FILTER_CHAIN,
+}
+
+def validate_filter_chain(filter_chain):
+    """Raises ValueError for filter names that are not in FILTERS."""
+    unknown = [name for name in filter_chain if name not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(unknown)}. Available: {', '.join(FILTERS)}")
+
+def apply_filter_chain(image, filter_chain=None):
+    """Converts the image to grayscale and applies each named filter in order."""
+    filter_chain = FILTER_CHAIN if filter_chain is None else filter_chain
+    validate_filter_chain(filter_chain)
+
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    for name in filter_chain:
+        image = FILTERS[name](image)
 
-    return morph
+    return image
+
+def estimate_noise(sample):
+    """
+    Noise sigma in gray levels (Immerkaer's fast estimate) over the flat areas of a page sample;
+    text edges are masked out so dense pages are not mistaken for noisy ones.
+    """
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+    response = np.abs(cv2.filter2D(sample.astype(np.float32), -1, kernel))
+    edges = cv2.dilate(cv2.Canny(sample, 50, 150), np.ones((5, 5), np.uint8))
+    flat = response[edges == 0]
+    if not flat.size:
+        return 0.0
+    return float(np.sqrt(np.pi / 2) * flat.mean() / 6)
+
+def estimate_contrast(sample):
+    """
+    Spread between the paper (median) and the darkest ink gray level, 0-1.
+    Samples without visible ink count as full contrast, so blank pages are not stretched.
+    """
+    ink, paper = float(np.percentile(sample, INK_PERCENTILE)), float(np.median(sample))
+    if paper - ink < MIN_INK_SPREAD:
+        return 1.0
+    return (paper - ink) / 255
+
+def estimate_skew(small):
+    """
+    Skew of the text lines in degrees (positive = rotated counter-clockwise): the rotation within
+    +-MAX_SKEW_DEGREES whose row profile of ink pixels is sharpest.
+    """
+    threshold, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if np.median(small) - threshold < MIN_INK_SPREAD:
+        return 0.0  # Blank page: the "ink" is paper noise
+    height, width = ink.shape
+    best_angle, best_score = 0.0, -1.0
+    angles = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES / 2, SKEW_STEP_DEGREES)
+    for angle in sorted(angles, key=abs):  # Ties (e.g. nearly empty pages) keep the smallest rotation
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        rotated = cv2.warpAffine(ink, matrix, (width, height), flags=cv2.INTER_NEAREST)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return 0.0 - best_angle  # Never -0.0
+
+def estimate_quality(gray, dpi=None):
+    """
+    Cheap per-page quality estimate (tens of milliseconds on a 300 DPI page): noise sigma,
+    contrast (0-1), skew in degrees and resolution (estimated from an A4 page when not given).
+    """
+    height, width = gray.shape
+    top, left = max(0, (height - QUALITY_SAMPLE_SIZE) // 2), max(0, (width - QUALITY_SAMPLE_SIZE) // 2)
+    sample = gray[top:top + QUALITY_SAMPLE_SIZE, left:left + QUALITY_SAMPLE_SIZE]
+    small = cv2.resize(gray, (SKEW_SAMPLE_WIDTH, max(1, round(height * SKEW_SAMPLE_WIDTH / width))),
+                       interpolation=cv2.INTER_AREA)
+    return {
+        "noise": round(estimate_noise(sample), 2),
+        "contrast": round(estimate_contrast(sample), 3),
+        "skew": round(estimate_skew(small), 2),
+        "dpi": dpi or round(max(height, width) / A4_HEIGHT_INCHES),
+    }
+
+def choose_profile(quality):
+    """
+    Picks the cheapest PREPROCESS_PROFILES entry that suits a page: clean pages skip denoising,
+    moderately noisy ones are denoised at half resolution and heavily noisy (or low-resolution) ones
+    at full resolution in parallel tiles.
+    """
+    if quality["noise"] < CLEAN_NOISE:
+        return "clean"
+    if quality["noise"] < HEAVY_NOISE and quality["dpi"] >= MIN_DOWNSCALE_DPI:
+        return "downscaled"
+    return "tiled"
+
+def adaptive_preprocess(image, dpi=None, profile=None):
+    """
+    Preprocesses a page with the profile its quality estimate calls for (or the given `profile`),
+    stretching low-contrast pages and straightening skewed ones first.
+    Returns (processed image, record) where the record holds the profile, its filters and the estimate.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    quality = estimate_quality(gray, dpi)
+    profile = profile or choose_profile(quality)
+
+    filter_chain = list(PREPROCESS_PROFILES[profile])
+    if quality["contrast"] < LOW_CONTRAST:
+        filter_chain.insert(0, "normalize")
+    if abs(quality["skew"]) >= MIN_DESKEW_DEGREES:
+        gray = rotate_image(gray, -quality["skew"])
+
+    record = {"profile": profile, "filters": filter_chain, **quality,
+              "deskewed": abs(quality["skew"]) >= MIN_DESKEW_DEGREES}
+    return apply_filter_chain(gray, filter_chain), record
+
+def preprocess_image(image, filter_chain=None):
+    """
+    Apply grayscale, sharpening, denoise, adaptive thresholding, and morphological transformations.
+    Without a `filter_chain` the denoising profile is chosen per page (see `adaptive_preprocess`);
+    a fixed sequence of FILTERS can be passed as `filter_chain` instead.
+    """
+    if filter_chain is None:
+        return adaptive_preprocess(image)[0]
+    return apply_filter_chain(image, filter_chain)
 
 # Example execution (if needed)
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute up to `capacity`; callers wait until enough units are available."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # A request larger than the bucket waits for a full bucket
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Async limiter for requests per minute and tokens per minute.
+    Either limit can be None to disable it.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=0):
+        """Waits until one request of roughly `tokens` tokens fits in both budgets, then reserves it."""
+        # Requests are admitted one at a time so a large request is not starved by smaller ones
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.requests:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests:
+                self.requests.consume(1)
+            if self.tokens and tokens:
+                self.tokens.consume(tokens)
+
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+def is_retryable(error):
+    """Returns True for rate-limit, timeout and transient server errors."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    name = type(error).__name__
+    return any(marker in name for marker in ("RateLimit", "Timeout", "Connection"))
+
+def retry_after(error):
+    """Returns the server's Retry-After hint in seconds, if the error carries one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=1.0, maximum=30.0, error=None):
+    """Full-jitter exponential backoff, never shorter than a Retry-After hint."""
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    hint = retry_after(error) if error is not None else None
+    return max(delay, hint) if hint else delay
@@ -0,0 +1,275 @@
+import json
+import os
+import time
+
+from filelock import FileLock
+
+# Define store location and limits
+STORE_FOLDER = "output/results"
+SEGMENT_MAX_BYTES = 64 * 1024 ** 2   # A new JSONL segment is started beyond this size
+SEGMENT_PATTERN = "invoices-{:06d}.jsonl"
+INVOICES_PARQUET_FILE = "output/invoices.parquet"
+LINE_ITEMS_PARQUET_FILE = "output/line_items.parquet"
+PARQUET_BATCH_SIZE = 5000            # Rows held in memory per Parquet row group
+EXPORT_MARK_FILE = "last_export"     # Store position of the last export, kept in the store folder
+
+def record_key(invoice):
+    """Identifies an invoice across runs, so a re-parsed invoice replaces its earlier record."""
+    return invoice.get("invoice_id") or invoice.get("invoice_number") or json.dumps(invoice, sort_keys=True)
+
+
+class ResultStore:
+    """
+    Append-only store of parsed invoices in JSONL segment files.
+    Every record is written as one line and fsynced, so a crash loses at most the line being
+    written; a torn last line is cut off before the next append and skipped by readers.
+    Readers stream the segments instead of loading the whole history. When an invoice is
+    stored again (same `record_key`), iterating the store yields only its latest record.
+    A position in the store is a (segment filename, byte offset) pair (see `checkpoint`), so
+    reading what was stored since a position costs as much as the new records, not the history.
+    """
+
+    def __init__(self, folder=STORE_FOLDER, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.folder = folder
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self._lock = FileLock(os.path.join(folder, ".lock"))  # Shared with other processes writing the store
+        self._keys = set()           # Record keys counted by `__len__` so far...
+        self._counted = None         # ...up to this position
+
+    def segments(self):
+        """Paths of all segment files, oldest first."""
+        return [os.path.join(self.folder, filename) for filename in sorted(os.listdir(self.folder))
+                if filename.startswith("invoices-") and filename.endswith(".jsonl")]
+
+    def _writable_segment(self):
+        """Returns the segment to append to, starting a new one when the last is full."""
+        segments = self.segments()
+        if segments and os.path.getsize(segments[-1]) < self.segment_max_bytes:
+            return segments[-1]
+        return os.path.join(self.folder, SEGMENT_PATTERN.format(len(segments) + 1))
+
+    @staticmethod
+    def _repair_tail(path):
+        """Truncates a partially written last line left behind by a crash."""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            content = f.read()
+            f.truncate(content.rfind(b"\n") + 1)
+
+    def append(self, invoices):
+        """Appends invoices as one JSON line each and flushes them to disk."""
+        if isinstance(invoices, dict):
+            invoices = [invoices]
+
+        if not invoices:
+            return
+
+        with self._lock:
+            stored_at = time.time()
+            lines = [json.dumps({"key": record_key(invoice), "stored_at": stored_at, "invoice": invoice})
+                     for invoice in invoices]
+            path = self._writable_segment()
+            self._repair_tail(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _iter_from(self, position=None, until=None):
+        """
+        Streams (record, position after it) in write order, starting at `position` and stopping
+        at `until` (positions from `checkpoint`; None for the start and the end of the store).
+        """
+        first, offset = position or (None, 0)
+        for path in self.segments():
+            name = os.path.basename(path)
+            if first is not None and name < first:
+                continue
+            if until is not None and name > until[0]:
+                return
+            end = until[1] if until is not None and name == until[0] else None
+
+            current = offset if name == first else 0
+            with open(path, "rb") as f:
+                f.seek(current)
+                for line in f:
+                    if (end is not None and current >= end) or not line.endswith(b"\n"):
+                        break  # Past `until`, or a line still being written
+                    current += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn line from an interrupted write
+                    yield record, (name, current)
+
+    def iter_records(self):
+        """Streams every stored record ({"key", "stored_at", "invoice"}) in write order."""
+        for record, _ in self._iter_from():
+            yield record
+
+    def iter_invoices(self, since=None, until=None):
+        """
+        Streams the latest record of every invoice, in the order they were last stored.
+        Over the whole store only the record keys are held in memory. With `since` and `until`
+        (positions from `checkpoint`), only the records stored between them are read: each invoice
+        stored in that window is returned once, as its latest record in the window.
+        """
+        if since is not None:
+            latest = {}
+            for record, _ in self._iter_from(since, until):
+                latest.pop(record["key"], None)  # Re-insert, so invoices come in the order they were last stored
+                latest[record["key"]] = record["invoice"]
+            yield from latest.values()
+            return
+
+        latest = {}
+        for index, (record, _) in enumerate(self._iter_from(until=until)):
+            latest[record["key"]] = index
+
+        wanted = set(latest.values())
+        for index, (record, _) in enumerate(self._iter_from(until=until)):
+            if index in wanted:
+                yield record["invoice"]
+
+    def checkpoint(self):
+        """
+        The current end of the store, as a (segment filename, byte offset) position: records
+        appended afterwards come after it, so `iter_invoices(since=checkpoint)` reads only them.
+        """
+        with self._lock:
+            segments = self.segments()
+            if not segments:
+                return SEGMENT_PATTERN.format(1), 0
+            self._repair_tail(segments[-1])
+            return os.path.basename(segments[-1]), os.path.getsize(segments[-1])
+
+    def last_export(self):
+        """
+        The checkpoint of the store's last export (see convert_to_excel.export_store), or None
+        (also for marks written as timestamps by earlier versions, so the next export is a full one).
+        """
+        try:
+            with open(os.path.join(self.folder, EXPORT_MARK_FILE), "r", encoding="utf-8") as f:
+                segment, offset = json.load(f)
+            return segment, int(offset)
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def set_last_export(self, checkpoint):
+        path = os.path.join(self.folder, EXPORT_MARK_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(list(checkpoint), f)
+        os.replace(f"{path}.tmp", path)
+
+    def __iter__(self):
+        return self.iter_invoices()
+
+    def __len__(self):
+        """Number of distinct invoices stored; each call only reads the records appended since the previous one."""
+        position = self._counted
+        for record, position in self._iter_from(self._counted):
+            self._keys.add(record["key"])
+        self._counted = position
+        return len(self._keys)
+
+    def export_json(self, path):
+        """Writes the latest invoices as one JSON array (extracted_data.json format) without loading them all."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for index, invoice in enumerate(self.iter_invoices()):
+                f.write(",\n" if index else "\n")
+                f.write(json.dumps(invoice, indent=4))
+            f.write("\n]\n")
+        os.replace(tmp_path, path)
+        return path
+
+    def export_parquet(self, invoices_path=INVOICES_PARQUET_FILE, line_items_path=LINE_ITEMS_PARQUET_FILE,
+                       batch_size=PARQUET_BATCH_SIZE):
+        """
+        Writes the latest invoices to two columnar files: one row per invoice (items excluded)
+        and one row per line item keyed by `invoice_id`. Rows are written in batches of `batch_size`.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Column types must be fixed before the first batch is written, so collect them in a first pass
+        invoice_kinds, item_kinds = {"invoice_id": {"str"}}, {"invoice_id": {"str"}}
+        for invoice in self.iter_invoices():
+            _collect_kinds(invoice_kinds, invoice, skip="items")
+            for item in invoice.get("items", []):
+                _collect_kinds(item_kinds, item)
+
+        invoice_schema = pa.schema([(column, _arrow_type(pa, kinds)) for column, kinds in invoice_kinds.items()])
+        item_schema = pa.schema([(column, _arrow_type(pa, kinds)) for column, kinds in item_kinds.items()])
+
+        def write(writer, rows, schema):
+            columns = {f.name: [_convert(row.get(f.name), f.type, pa) for row in rows] for f in schema}
+            writer.write_table(pa.table(columns, schema=schema))
+
+        invoice_rows, item_rows = [], []
+        with pq.ParquetWriter(invoices_path, invoice_schema) as invoice_writer, \
+                pq.ParquetWriter(line_items_path, item_schema) as item_writer:
+            for invoice in self.iter_invoices():
+                invoice_id = record_key(invoice)
+                invoice_rows.append({**invoice, "invoice_id": invoice_id})
+                item_rows.extend({**item, "invoice_id": invoice_id} for item in invoice.get("items", []))
+
+                if len(invoice_rows) >= batch_size:
+                    write(invoice_writer, invoice_rows, invoice_schema)
+                    invoice_rows = []
+                if len(item_rows) >= batch_size:
+                    write(item_writer, item_rows, item_schema)
+                    item_rows = []
+
+            write(invoice_writer, invoice_rows, invoice_schema)
+            write(item_writer, item_rows, item_schema)
+
+        print(f"Parquet exports saved: {invoices_path}, {line_items_path}")
+        return invoices_path, line_items_path
+
+
+def _value_kind(value):
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    return "json"
+
+def _collect_kinds(kinds, record, skip=None):
+    """Records the Python value kinds seen in each column."""
+    for column, value in record.items():
+        if column == skip:
+            continue
+        column_kinds = kinds.setdefault(column, set())
+        if value is not None:
+            column_kinds.add(_value_kind(value))
+
+def _arrow_type(pa, kinds):
+    """Narrowest Arrow type holding every kind seen in a column; mixed or nested columns become JSON text."""
+    if kinds == {"bool"}:
+        return pa.bool_()
+    if kinds and kinds <= {"int"}:
+        return pa.int64()
+    if kinds and kinds <= {"int", "float"}:
+        return pa.float64()
+    return pa.string()
+
+def _convert(value, arrow_type, pa):
+    if value is None:
+        return None
+    if arrow_type == pa.string():
+        return value if isinstance(value, str) else json.dumps(value)
+    if arrow_type == pa.float64():
+        return float(value)
+    return value
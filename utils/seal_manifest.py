@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Define manifest location
+SEAL_MANIFEST_FILE = "output/seal_manifest.sqlite"
+
+
+def scaled_bbox(detection, dpi):
+    """A detection's box in pixels of a page rendered at `dpi` (unchanged if its own DPI is unknown)."""
+    if not detection.get("dpi"):
+        return list(detection["bbox"])
+    scale = dpi / detection["dpi"]
+    return [round(value * scale) for value in detection["bbox"]]
+
+
+class SealManifest:
+    """
+    Indexed SQLite record of seal/signature detection: one row per checked page (so "no seal"
+    is distinguishable from "not checked") and one row per detection with its box, class,
+    score, crop path and the DPI of the image the box is in (text-layer pages are rendered at
+    a lower resolution than scanned ones, see `scaled_bbox`). Lookups by page name are primary-key reads instead of folder scans.
+    """
+
+    def __init__(self, path=SEAL_MANIFEST_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                page TEXT PRIMARY KEY,
+                source TEXT,
+                page_number INTEGER,
+                seal_detected INTEGER NOT NULL,
+                score REAL,
+                detected_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                page TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                class INTEGER NOT NULL,
+                label TEXT,
+                score REAL NOT NULL,
+                x1 INTEGER NOT NULL,
+                y1 INTEGER NOT NULL,
+                x2 INTEGER NOT NULL,
+                y2 INTEGER NOT NULL,
+                crop_path TEXT,
+                dpi INTEGER,
+                PRIMARY KEY (page, idx)
+            )
+        """)
+        if "dpi" not in [row[1] for row in self._conn.execute("PRAGMA table_info(detections)")]:
+            # Manifests written before boxes carried their scale: their DPI is unknown (NULL)
+            self._conn.execute("ALTER TABLE detections ADD COLUMN dpi INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_source ON pages(source)")
+        self._conn.commit()
+
+    def record_many(self, results):
+        """
+        Stores the detections of several pages in one transaction, replacing earlier results for them.
+        `results` holds (page name, source, page number, detections) tuples, with detections as
+        returned by `image_utils.detect_seals_batch`.
+        """
+        now = time.time()
+        with self._lock:
+            for page, source, page_number, detections in results:
+                score = max((detection["score"] for detection in detections), default=None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pages (page, source, page_number, seal_detected, score, detected_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (page, source, page_number, int(bool(detections)), score, now),
+                )
+                self._conn.execute("DELETE FROM detections WHERE page = ?", (page,))
+                self._conn.executemany(
+                    "INSERT INTO detections (page, idx, class, label, score, x1, y1, x2, y2, crop_path, dpi) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(page, idx, detection["class"], detection.get("label"), detection["score"], *detection["bbox"],
+                      detection.get("crop_path"), detection.get("dpi")) for idx, detection in enumerate(detections)],
+                )
+            self._conn.commit()
+
+    def record(self, page, detections, source=None, page_number=None):
+        """Stores the detections of one page (see `record_many`)."""
+        self.record_many([(page, source, page_number, detections)])
+
+    def get(self, page):
+        """
+        Returns {"seal_detected", "score", "detections"} for a page name
+        (e.g. sample_invoice.pdf_page_1), or None if the page was never checked.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT seal_detected, score FROM pages WHERE page = ?", (page,)).fetchone()
+            if row is None:
+                return None
+            detections = self._conn.execute(
+                "SELECT class, label, score, x1, y1, x2, y2, crop_path, dpi FROM detections WHERE page = ? ORDER BY idx",
+                (page,),
+            ).fetchall()
+
+        return {
+            "seal_detected": bool(row[0]),
+            "score": row[1],
+            "detections": [{"bbox": [x1, y1, x2, y2], "score": score, "class": cls, "label": label, "crop_path": crop_path,
+                            "dpi": dpi} for cls, label, score, x1, y1, x2, y2, crop_path, dpi in detections],
+        }
+
+    def seal_score(self, pages):
+        """
+        Highest detection score over the given page names: None if none of them was checked,
+        0.0 if they were checked and nothing was found.
+        """
+        if not pages:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT score FROM pages WHERE page IN ({','.join('?' * len(pages))})", list(pages)
+            ).fetchall()
+        if not rows:
+            return None
+        return max((score or 0.0) for score, in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
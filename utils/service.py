@@ -0,0 +1,347 @@
+import json
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+from utils import metrics
+from utils.document import PipelineContext
+from utils.job_queue import JOB_QUEUE_FILE, JobQueue
+
+# Define service locations
+UPLOAD_FOLDER = "output/service/uploads"
+WORKER_METRICS_FOLDER = "output/service/metrics"   # Each worker's metrics snapshot, served by /metrics
+
+# Service limits
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", 2))       # Warm worker processes
+MAX_QUEUE_DEPTH = int(os.getenv("SERVICE_MAX_QUEUE", 100))   # Queued + running jobs before submissions get 429
+MAX_UPLOAD_BYTES = 50 * 1024 ** 2
+RETRY_AFTER_SECONDS = 5      # Suggested wait for clients turned away by a full queue
+POLL_SECONDS = 0.5           # Idle workers look for new jobs this often
+SUPERVISE_SECONDS = 1.0      # Dead workers are noticed and restarted within this time
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while MAX_QUEUE_DEPTH jobs are already waiting or running."""
+
+
+def safe_filename(name):
+    """Base name of an uploaded file with unsafe characters replaced, e.g. "../a b.pdf" -> "a_b.pdf"."""
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(name or "")).lstrip(".")
+    if not name.lower().endswith(".pdf"):
+        name += ".pdf"
+    return name
+
+def save_upload(job_id, filename, data, folder=UPLOAD_FOLDER):
+    """Writes an uploaded PDF to disk (fsynced, so a queued job never loses its file) and returns its path."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{job_id}_{filename}")
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+def warm_up(context):
+    """Loads the LLM client, YOLO model, render and OCR pools once, before the worker takes its first job."""
+    import utils.parser  # noqa: F401  (creates the Groq client)
+    from utils.image_utils import get_model
+    from utils.ocr_utils import get_ocr_pool
+    from utils.preprocess import get_render_pool
+
+    try:
+        get_model()
+    except Exception as e:
+        print(f"Could not load the YOLO model, seal detection will fail: {e}")
+    get_render_pool(context.workers)
+    get_ocr_pool(context.workers)
+
+def pool_size(service_workers):
+    """Render and OCR processes per service worker, so that together the workers use each core once."""
+    return max(1, (os.cpu_count() or 1) // max(1, service_workers))
+
+def write_worker_metrics(worker, folder=WORKER_METRICS_FOLDER):
+    """Saves a worker's metrics for the HTTP process to serve (see `JobService.worker_metrics`)."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{worker}.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(metrics.snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+def run_job(job, context, jobs):
+    """Streams one job's PDF through every stage and stores its invoices and verifiability report."""
+    from utils.streaming import stream_pdfs
+
+    start = time.perf_counter()
+    try:
+        items = list(stream_pdfs([job["pdf_path"]], context))
+        result = {"invoices": [invoice for item in items for invoice in item.invoices],
+                  "report": items[0].report if items else None}
+
+        if not items:
+            # Skipped PDFs are duplicates of an earlier upload; anything else failed in a stage
+            duplicates = context.dedup.duplicates_of(os.path.basename(job["pdf_path"])) if context.dedup else []
+            if not duplicates:
+                raise RuntimeError("The PDF could not be processed, see the service log")
+            result["duplicate_of"] = duplicates[-1]["duplicate_of"]
+
+        jobs.complete(job["job_id"], result)
+        metrics.increment("service_jobs_total", status="done")
+        print(f"Job {job['job_id']} ({job['filename']}) done in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        jobs.fail(job["job_id"], e)
+        metrics.increment("service_jobs_total", status="failed")
+        print(f"Job {job['job_id']} ({job['filename']}) failed: {e}")
+    metrics.observe("service_job_seconds", time.perf_counter() - start)
+
+def worker_main(worker, queue_path, options_factory, stop, pool_workers=None):
+    """
+    Worker process: builds its own pipeline options (caches, stores, LLM chain) with `options_factory`,
+    warms up the models and processes queued jobs one at a time until `stop` is set.
+    Its render and OCR pools have `pool_workers` processes unless the options set `workers`.
+    """
+    # Ctrl+C reaches the whole process group; workers are stopped by the service through `stop` instead.
+    # A job cut short by a forced stop stays "running" and is requeued when the service restarts.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    context = PipelineContext(input_dir=UPLOAD_FOLDER, **options_factory())
+    context.workers = context.workers or pool_workers
+    context.warm_pools = True
+    jobs = JobQueue(queue_path)
+    warm_up(context)
+    write_worker_metrics(worker)
+    print(f"🧑‍🏭 {worker} ready (PID {os.getpid()}, {context.workers or 'all'} render/OCR processes)")
+
+    try:
+        while not stop.is_set():
+            job = jobs.claim(worker)
+            if job is None:
+                stop.wait(POLL_SECONDS)
+                continue
+            run_job(job, context, jobs)
+            write_worker_metrics(worker)
+    finally:
+        jobs.close()
+
+
+class JobService:
+    """Accepts jobs into the JobQueue and keeps `workers` warm worker processes running them."""
+
+    def __init__(self, options_factory, workers=SERVICE_WORKERS, max_queue=MAX_QUEUE_DEPTH, queue_path=JOB_QUEUE_FILE):
+        self.options_factory = options_factory
+        self.max_queue = max_queue
+        self.queue_path = queue_path
+        self.jobs = JobQueue(queue_path)
+        self.workers = {f"worker-{index + 1}": None for index in range(max(1, workers))}
+        self.pool_workers = pool_size(len(self.workers))
+        self._stop = multiprocessing.Event()
+        self._submit_lock = threading.Lock()
+
+    def _start_worker(self, name):
+        # Not a daemon: workers start their own render/OCR process pools
+        process = multiprocessing.Process(target=worker_main, name=name,
+                                          args=(name, self.queue_path, self.options_factory, self._stop,
+                                                self.pool_workers))
+        process.start()
+        self.workers[name] = process
+
+    def start(self):
+        """Requeues jobs left running by an earlier service process, then starts the workers."""
+        requeued = self.jobs.requeue()
+        if requeued:
+            print(f"Requeued {requeued} job(s) interrupted by the last shutdown")
+        for name in self.workers:
+            self._start_worker(name)
+        threading.Thread(target=self._supervise, name="service-supervisor", daemon=True).start()
+
+    def _supervise(self):
+        """Restarts workers that died, putting the job they were running back in the queue."""
+        while not self._stop.wait(SUPERVISE_SECONDS):
+            for name, process in self.workers.items():
+                if process.is_alive() or self._stop.is_set():
+                    continue
+                requeued = self.jobs.requeue(name)
+                print(f"{name} exited with code {process.exitcode}; restarting it ({requeued} job(s) requeued)")
+                metrics.increment("service_worker_restarts_total")
+                self._start_worker(name)
+
+    def full(self):
+        return self.jobs.depth() >= self.max_queue
+
+    def submit(self, filename, data):
+        """Saves an uploaded PDF and queues it. Returns the job; raises QueueFull when the queue is at its limit."""
+        with self._submit_lock:
+            if self.full():
+                raise QueueFull(f"{self.max_queue} jobs are already queued or running")
+            job_id = uuid.uuid4().hex[:16]
+            filename = safe_filename(filename)
+            self.jobs.submit(job_id, filename, save_upload(job_id, filename, data))
+        metrics.increment("service_jobs_submitted_total")
+        return self.jobs.get(job_id)
+
+    def health(self):
+        counts = self.jobs.counts()
+        metrics.set_gauge("service_queue_depth", counts.get("queued", 0) + counts.get("running", 0))
+        return {"workers": {name: process is not None and process.is_alive() for name, process in self.workers.items()},
+                "jobs": counts, "max_queue": self.max_queue}
+
+    def worker_metrics(self, folder=WORKER_METRICS_FOLDER):
+        """Latest metrics snapshot of each worker, as (labels, snapshot) pairs for metrics.prometheus_text."""
+        snapshots = []
+        for name in self.workers:
+            try:
+                with open(os.path.join(folder, f"{name}.json"), "r", encoding="utf-8") as f:
+                    snapshots.append(({"worker": name}, json.load(f)))
+            except (OSError, ValueError):
+                continue  # Not written yet
+        return snapshots
+
+    def stop(self, timeout=10):
+        """Stops the workers after their current job (or terminates them after `timeout` seconds)."""
+        self._stop.set()
+        for process in self.workers.values():
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.jobs.close()
+
+
+def _public(job):
+    """A job as returned by the API, without server-side paths."""
+    return {key: value for key, value in job.items() if key not in ("pdf_path", "result")}
+
+def make_handler(service):
+    """HTTP handler class serving the job API of a JobService."""
+    from http.server import BaseHTTPRequestHandler
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _reject(self, status, error, headers=None):
+            metrics.increment("service_jobs_rejected_total", status=status)
+            self.close_connection = True  # An unread request body must not be parsed as the next request
+            self._send_json(status, {"error": error}, headers)
+
+        def _discard_body(self, length):
+            """Reads and drops a request body, so the client can finish sending before it gets the answer."""
+            while length > 0:
+                chunk = self.rfile.read(min(length, 1024 ** 2))
+                if not chunk:
+                    break
+                length -= len(chunk)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") != "/jobs":
+                self._send_json(404, {"error": "Not found"})
+                return
+
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0:
+                self._reject(411, "Send the PDF as the request body, with a Content-Length")
+                return
+            if length > MAX_UPLOAD_BYTES:
+                self._reject(413, f"PDFs are limited to {MAX_UPLOAD_BYTES // 1024 ** 2} MB")
+                return
+            # Checked before the upload is stored, so a full queue costs no disk space
+            if service.full():
+                self._discard_body(length)
+                self._reject(429, "Queue is full, retry later", {"Retry-After": RETRY_AFTER_SECONDS})
+                return
+
+            data = self.rfile.read(length)
+            if not data.startswith(b"%PDF"):
+                self._send_json(415, {"error": "The request body is not a PDF"})
+                return
+
+            filename = parse_qs(url.query).get("filename", [None])[0] or self.headers.get("X-Filename")
+            try:
+                job = service.submit(filename or "invoice.pdf", data)
+            except QueueFull as e:
+                self._send_json(429, {"error": str(e)}, {"Retry-After": RETRY_AFTER_SECONDS})
+                return
+            self._send_json(202, _public(job), {"Location": f"/jobs/{job['job_id']}"})
+
+        def do_GET(self):
+            parts = [part for part in urlparse(self.path).path.split("/") if part]
+
+            if parts == ["health"]:
+                self._send_json(200, service.health())
+            elif parts == ["metrics"]:
+                service.health()  # Refreshes the queue depth gauge
+                # Jobs run in the worker processes; their metrics are labelled with the worker name
+                body = metrics.prometheus_text(service.worker_metrics()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = service.jobs.get(parts[1])
+                if job is None:
+                    self._send_json(404, {"error": "Unknown job"})
+                else:
+                    self._send_json(200, _public(job))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+                self._send_result(parts[1])
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def _send_result(self, job_id):
+            """200 with the invoices and report, 202 while the job is pending, 422 if it failed."""
+            job = service.jobs.get(job_id, with_result=True)
+            if job is None:
+                self._send_json(404, {"error": "Unknown job"})
+            elif job["status"] == "done":
+                self._send_json(200, {"job_id": job_id, "status": "done", **job["result"]})
+            elif job["status"] == "failed":
+                self._send_json(422, {"job_id": job_id, "status": "failed", "error": job["error"]})
+            else:
+                self._send_json(202, {"job_id": job_id, "status": job["status"]}, {"Retry-After": 1})
+
+        def log_message(self, format, *args):
+            pass  # Status polling would otherwise flood the worker output
+
+    return ServiceHandler
+
+def serve(port, options_factory, workers=SERVICE_WORKERS, max_queue=MAX_QUEUE_DEPTH, host="0.0.0.0",
+          queue_path=JOB_QUEUE_FILE):
+    """
+    Runs the invoice service until interrupted:
+      POST /jobs?filename=x.pdf    queue a PDF (request body) → 202 {"job_id", "status", ...}
+      GET  /jobs/<id>              job status
+      GET  /jobs/<id>/result       parsed invoices and verifiability report once done
+      GET  /health, GET /metrics   worker and queue state (/metrics includes each worker's metrics
+                                   as of its last finished job)
+    `options_factory` returns the pipeline options (as taken by run_pipeline) and is called in
+    each worker process, so every worker opens its own caches, stores and LLM client.
+    """
+    from http.server import ThreadingHTTPServer
+
+    service = JobService(options_factory, workers=workers, max_queue=max_queue, queue_path=queue_path)
+    server = ThreadingHTTPServer((host, port), make_handler(service))  # Bound first: a busy port starts no workers
+    service.start()
+    print(f"🌐 Invoice service at http://{host}:{port} with {len(service.workers)} worker(s) (Ctrl+C to stop)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping service.")
+    finally:
+        server.server_close()
+        service.stop()
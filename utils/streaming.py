@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from utils import metrics
+from utils.document import InvoiceDocument, Page
+
+# PDFs waiting between two stages; a full queue blocks the stage before it (backpressure)
+QUEUE_SIZE = 2
+# PDFs whose invoices are being parsed at the same time
+PARSE_IN_FLIGHT = 4
+# Watch mode: a new PDF is processed once its size has not changed for this long
+SETTLE_SECONDS = 2.0
+POLL_SECONDS = 1.0
+
+_DONE = object()  # End-of-stream marker passed down the queues
+
+
+@dataclass
+class StreamItem:
+    """One PDF flowing through the streaming pipeline."""
+    source: str
+    pages: List[Page] = field(default_factory=list)
+    documents: List[InvoiceDocument] = field(default_factory=list)
+    invoices: Optional[List[dict]] = None
+    report: Optional[dict] = None
+
+
+def _rasterize(pdf_paths, context, outbox):
+    """Renders and preprocesses PDFs and hands them on one complete PDF at a time."""
+    from utils.preprocess import iter_processed_pages
+
+    item = None
+    for page in iter_processed_pages(pdf_paths, workers=context.workers, keep_images=context.keep_images,
+                                     max_in_flight_pages=context.max_in_flight_pages,
+                                     save_processed=context.save_debug_images,
+                                     filter_chain=context.filter_chain, cache=context.cache,
+                                     text_layer=context.text_layer, dedup=context.dedup,
+                                     warm_pool=context.warm_pools):
+        if item is not None and item.source != page.source:
+            outbox.put(item)
+            item = None
+        if item is None:
+            item = StreamItem(source=page.source)
+        item.pages.append(page)
+
+    if item is not None:
+        outbox.put(item)
+
+def _ocr(item, context):
+    from utils.ocr_utils import extract_text_from_pages
+    extract_text_from_pages(item.pages, cache=context.cache, workers=context.workers)
+    return item
+
+def _seals(item, context):
+    from utils.image_utils import BATCH_SIZE, DEFAULT_REGION, IMAGE_SIZE, detect_seals_in_pages
+    detect_seals_in_pages(item.pages, cache=context.cache, batch_size=context.seal_batch_size or BATCH_SIZE,
+                          imgsz=context.seal_image_size or IMAGE_SIZE, region=context.seal_region or DEFAULT_REGION,
+                          manifest=context.seal_manifest, save_crops=context.save_seal_crops)
+
+    # Images are not needed past this point, release them before the PDF waits for the LLM
+    for page in item.pages:
+        page.original = page.processed = None
+    return item
+
+def _validate(item, context):
+    from utils.validator import build_verifiability_report
+    item.report = build_verifiability_report(item.invoices, seal_manifest=context.seal_manifest)
+    return item
+
+def _record_queue(name, inbox):
+    """Records how many PDFs are still waiting for stage `name`."""
+    depth = inbox.qsize()
+    metrics.set_gauge("queue_depth", depth, stage=name)
+    metrics.max_gauge("queue_depth_max", depth, stage=name)
+
+def _profiled(name, context, target, *args):
+    """Thread body: runs `target` under cProfile when stage `name` is selected for profiling."""
+    with metrics.profile(name, enabled=name in (context.profile_stages or ())):
+        target(*args)
+
+def _run_stage(fn, name, context, inbox, outbox):
+    """Applies `fn` to every PDF from `inbox`; a failing PDF is reported and dropped, not fatal."""
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            outbox.put(_DONE)
+            return
+        _record_queue(name, inbox)
+        try:
+            with metrics.span("stage", stage=name):
+                result = fn(item, context)
+            outbox.put(result)
+        except Exception as e:
+            print(f"Error processing {item.source}: {e}")
+            metrics.increment("errors_total", stage=name)
+
+async def _parse_stage(context, inbox, outbox):
+    """
+    Groups each PDF's pages into invoices and parses them on one event loop, so the LLM
+    concurrency and rate limits are shared by every PDF in the stream.
+    """
+    from utils.assembler import group_pages
+    from utils.parser import LLM_CONCURRENCY, aparse_documents, default_rate_limiter
+
+    loop = asyncio.get_running_loop()
+    concurrency = context.llm_concurrency or LLM_CONCURRENCY
+    limiter = default_rate_limiter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    in_flight = asyncio.Semaphore(PARSE_IN_FLIGHT)
+    tasks = set()
+
+    async def parse(item):
+        start = time.perf_counter()
+        try:
+            item.documents = group_pages(item.pages)
+            item.invoices = await aparse_documents(item.documents, llm_cache=context.llm_cache,
+                                                   llm_chain=context.llm_chain, concurrency=concurrency,
+                                                   limiter=limiter, fast_path=context.fast_path,
+                                                   semaphore=semaphore, store=context.store, dedup=context.dedup)
+            metrics.observe("stage_seconds", time.perf_counter() - start, stage="parse")
+            await loop.run_in_executor(None, outbox.put, item)
+        except Exception as e:
+            print(f"Error parsing {item.source}: {e}")
+            metrics.increment("errors_total", stage="parse")
+        finally:
+            in_flight.release()
+
+    while True:
+        await in_flight.acquire()
+        item = await loop.run_in_executor(None, inbox.get)
+        if item is _DONE:
+            break
+        _record_queue("parse", inbox)
+        task = asyncio.create_task(parse(item))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    outbox.put(_DONE)
+
+def stream_pdfs(pdf_paths, context):
+    """
+    Runs rasterize → OCR → seals → parse → validate as concurrent stages connected by bounded
+    queues, and yields each PDF (a StreamItem with its invoices and report) as soon as it is done.
+    `context` is a PipelineContext holding the run options.
+    """
+    queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(5)]
+
+    def rasterize():
+        try:
+            _rasterize(pdf_paths, context, queues[0])
+        except Exception as e:
+            print(f"Error rendering PDFs: {e}")
+        finally:
+            queues[0].put(_DONE)
+
+    # Threads are named after the pipeline stages, so profilers such as py-spy show which stage is busy
+    stages = [
+        ("preprocess", rasterize),
+        ("ocr", _run_stage, _ocr, "ocr", context, queues[0], queues[1]),
+        ("seals", _run_stage, _seals, "seals", context, queues[1], queues[2]),
+        ("parse", lambda: asyncio.run(_parse_stage(context, queues[2], queues[3]))),
+        ("validate", _run_stage, _validate, "validate", context, queues[3], queues[4]),
+    ]
+    threads = [threading.Thread(target=_profiled, args=(name, context, *target), name=name)
+               for name, *target in stages]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    while True:
+        item = queues[4].get()
+        if item is _DONE:
+            break
+        yield item
+
+    for thread in threads:
+        thread.join()
+
+def publish_invoices(context, invoices):
+    """
+    Refreshes the outputs after a batch: the new invoices' checks merged into the verifiability report, and
+    JSON and line-item (Excel by default) exports of the invoices stored since the previous batch
+    (see convert_to_excel.export_store; the whole store with `context.full_export`). Without a
+    result store, the new invoices are merged into extracted_data.json per source PDF instead.
+    """
+    from utils.convert_to_excel import export_invoices, export_store
+    from utils.parser import save_combined_json
+    from utils.validator import EXTRACTED_DATA_FILE, generate_verifiability_report
+
+    generate_verifiability_report(invoices, seal_manifest=context.seal_manifest, merge=True)
+
+    if context.store is not None:
+        export_store(context.store, formats=context.export_formats, full=context.full_export)
+        return
+
+    combined = []
+    if os.path.exists(EXTRACTED_DATA_FILE):
+        with open(EXTRACTED_DATA_FILE, "r", encoding="utf-8") as f:
+            combined = json.load(f)
+
+    sources = {invoice.get("source_file") for invoice in invoices}
+    combined = [invoice for invoice in combined if invoice.get("source_file") not in sources] + invoices
+
+    save_combined_json(combined)
+    export_invoices(combined, formats=context.export_formats)
+
+def run_stream(pdf_paths, context):
+    """Streams the given PDFs through every stage, printing each PDF's result as it finishes."""
+    invoices = []
+    start = time.perf_counter()
+
+    for item in stream_pdfs(pdf_paths, context):
+        issues = len(item.report["summary"]["issues"])
+        print(f"✅ {item.source}: {len(item.invoices)} invoice(s), {issues} issue(s), "
+              f"ready after {time.perf_counter() - start:.2f}s")
+        invoices.extend(item.invoices)
+
+    if invoices:
+        with metrics.span("stage", stage="export"):
+            publish_invoices(context, invoices)
+    metrics.write_json(context.metrics_file or metrics.METRICS_FILE)
+    return invoices
+
+def _snapshot(path):
+    """(size, mtime) of a file, or None if it disappeared."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+def watch_folder(context, poll_seconds=POLL_SECONDS, settle_seconds=SETTLE_SECONDS):
+    """
+    Daemon mode: processes the PDFs already in `context.input_dir`, then every PDF that lands there,
+    until interrupted. A file is picked up once its size has stayed the same for `settle_seconds`.
+    """
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    events = queue.Queue()
+
+    class PdfHandler(FileSystemEventHandler):
+        def on_created(self, event):
+            events.put(event.src_path)
+
+        def on_modified(self, event):
+            events.put(event.src_path)
+
+        def on_moved(self, event):
+            events.put(event.src_path)
+            events.put(event.dest_path)
+
+        def on_deleted(self, event):
+            events.put(event.src_path)
+
+    os.makedirs(context.input_dir, exist_ok=True)
+    observer = Observer()
+    observer.schedule(PdfHandler(), context.input_dir, recursive=False)
+    observer.start()
+    print(f"👀 Watching {context.input_dir} for new PDFs (Ctrl+C to stop)...")
+
+    pending = {}     # path -> (snapshot, time it was last seen changing)
+    processed = {}   # path -> snapshot it was processed at, for files still in the folder
+
+    for filename in os.listdir(context.input_dir):
+        events.put(os.path.join(context.input_dir, filename))
+
+    try:
+        while True:
+            try:
+                while True:
+                    path = events.get(timeout=poll_seconds)
+                    if path.lower().endswith(".pdf"):
+                        pending[path] = (_snapshot(path), time.monotonic())
+            except queue.Empty:
+                pass
+
+            ready = []
+            now = time.monotonic()
+            for path, (snapshot, since) in list(pending.items()):
+                current = _snapshot(path)
+                if current is None:
+                    # Deleted or moved away: forget it, a file later copied to the same path is new
+                    del pending[path]
+                    processed.pop(path, None)
+                elif current != snapshot:
+                    pending[path] = (current, now)
+                elif now - since >= settle_seconds:
+                    del pending[path]
+                    if processed.get(path) != current:
+                        processed[path] = current
+                        ready.append(path)
+
+            if ready:
+                run_stream(sorted(ready), context)
+                if context.cache is not None:
+                    context.cache.evict()
+    except KeyboardInterrupt:
+        print("Stopping watcher.")
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,239 @@
+import json
+import os
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.fast_extract import GSTIN_CHARS
+
+# Define paths
+CORPUS_FOLDER = "output/benchmark/corpus"
+
+# Page layout, in pixels at RENDER_DPI (A4, like the 300 DPI pages the pipeline renders)
+RENDER_DPI = 300
+PAGE_SIZE = (2480, 3508)
+MARGIN = 150
+FONT_SIZE = 36
+TITLE_SIZE = 64
+LINE_HEIGHT = 52
+LINES_PER_PAGE = 60
+CONTINUATION_LINES = 3   # Header lines repeated at the top of every further page
+TABLE_COLUMNS = [0, 120, 1150, 1450, 1650, 1950]  # x offsets: Sl, Description, HSN/SAC, Qty, Rate, Amount
+
+# Corpus defaults
+CORPUS_SIZE = 10
+MIN_PAGES, MAX_PAGES = 1, 4
+MAX_NOISE = 0.08         # Standard deviation of the Gaussian noise, as a fraction of the 0-255 range
+MAX_SKEW_DEGREES = 2.0
+SEAL_RATE = 0.7          # Share of invoices that carry a seal and signature
+
+SUPPLIERS = ["SRI GANESH AUTOMOBILES", "KAVERI MOTORS PVT LTD", "DECCAN SPARES & CO", "LAKSHMI TRADERS",
+             "SAHYADRI ENGINEERING WORKS", "NILGIRI CYCLE MART"]
+CUSTOMERS = ["ACME LOGISTICS PVT LTD", "BHARAT FLEET SERVICES", "COASTAL TRANSPORT CO", "METRO BIKES LLP"]
+STREETS = ["1450/1, INFANTRY ROAD", "22, MG ROAD", "7/3, RESIDENCY ROAD", "114, 2ND MAIN, PEENYA",
+           "56, OLD AIRPORT ROAD", "9, NEHRU NAGAR"]
+CITIES = [("BENGALURU", "560001"), ("MYSURU", "570001"), ("CHENNAI", "600002"), ("PUNE", "411001"),
+          ("HYDERABAD", "500003"), ("MUMBAI", "400001")]
+DESCRIPTIONS = ["FRONT WHEEL", "REAR WHEEL", "ANO ADJUST", "BRAKE SHOE", "CHAIN SPROCKET KIT", "CLUTCH PLATE",
+                "HEAD LAMP ASSY", "SPARK PLUG", "AIR FILTER", "ENGINE OIL 1L", "DISC PAD SET", "TUBE 2.75-18"]
+HSN_CODES = ["8714", "8708", "4011", "8511", "8421", "2710"]
+GST_RATE = 0.18
+
+
+def gstin_check_digit(gstin14):
+    """Check character for the first 14 GSTIN characters (see fast_extract.gstin_checksum_valid)."""
+    total = 0
+    for i, c in enumerate(gstin14):
+        value = GSTIN_CHARS.index(c) * (2 if i % 2 else 1)
+        total += value // 36 + value % 36
+    return GSTIN_CHARS[(36 - total % 36) % 36]
+
+def random_gstin(rng):
+    """A well-formed GSTIN: state code, PAN, entity number, "Z" and a valid check digit."""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    pan = "".join(rng.choice(letters) for _ in range(5)) + f"{rng.randint(0, 9999):04d}" + rng.choice(letters)
+    gstin14 = f"{rng.randint(1, 37):02d}{pan}{rng.randint(1, 9)}Z"
+    return gstin14 + gstin_check_digit(gstin14)
+
+def _item_capacity(pages):
+    """Most line items that fit on `pages` pages next to the header and totals."""
+    if pages <= 0:
+        return 0
+    return pages * LINES_PER_PAGE - len(_header_lines({})) - len(_total_lines({})) - (pages - 1) * CONTINUATION_LINES
+
+def random_invoice(rng, index, pages=1, seal=True):
+    """Ground-truth invoice data (parser output shape) whose line items fill exactly `pages` pages."""
+    items = []
+    for serial in range(1, rng.randint(_item_capacity(pages - 1) + 1, _item_capacity(pages)) + 1):
+        quantity = rng.randint(1, 20)
+        unit_price = rng.randint(50, 50000)
+        items.append({"serial_number": serial, "description": rng.choice(DESCRIPTIONS),
+                      "hsn_sac": rng.choice(HSN_CODES), "quantity": quantity, "unit_price": unit_price,
+                      "total_amount": quantity * unit_price})
+
+    city, pin = rng.choice(CITIES)
+    return {
+        "invoice_number": f"INV-{rng.randint(2019, 2025)}-{index:05d}",
+        "invoice_date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2019, 2025)}",
+        "supplier": rng.choice(SUPPLIERS),
+        "supplier_gst_number": random_gstin(rng),
+        "customer": rng.choice(CUSTOMERS),
+        "bill_to_gst_number": random_gstin(rng),
+        "po_number": f"PO-{rng.randint(1000, 99999)}",
+        "shipping_address": f"{rng.choice(STREETS)}, {city}, {pin}",
+        "seal_and_sign_present": seal,
+        "no_items": len(items),
+        "items": items,
+    }
+
+def _money(value):
+    return f"{value:,.2f}"
+
+def _header_lines(invoice):
+    """Lines (lists of (x, text) cells) above the item table."""
+    return [
+        [(0, "TAX INVOICE")],
+        [(0, invoice.get("supplier", ""))],
+        [(0, f"GSTIN: {invoice.get('supplier_gst_number', '')}")],
+        [(0, f"Invoice No: {invoice.get('invoice_number', '')}"), (1250, f"Invoice Date: {invoice.get('invoice_date', '')}")],
+        [(0, f"PO No: {invoice.get('po_number', '')}")],
+        [],
+        [(0, f"Bill To: {invoice.get('customer', '')}")],
+        [(0, f"GSTIN: {invoice.get('bill_to_gst_number', '')}")],
+        [(0, f"Ship To: {invoice.get('shipping_address', '')}")],
+        [],
+        list(zip(TABLE_COLUMNS, ["Sl", "Description", "HSN/SAC", "Qty", "Rate", "Amount"])),
+    ]
+
+def _total_lines(invoice):
+    subtotal = sum(item["total_amount"] for item in invoice.get("items", []))
+    tax = round(subtotal * GST_RATE, 2)
+    return [
+        [],
+        [(TABLE_COLUMNS[4], "Sub Total"), (TABLE_COLUMNS[5], _money(subtotal))],
+        [(TABLE_COLUMNS[4], f"IGST {GST_RATE:.0%}"), (TABLE_COLUMNS[5], _money(tax))],
+        [(TABLE_COLUMNS[4], "Grand Total"), (TABLE_COLUMNS[5], _money(subtotal + tax))],
+        [],
+        [(1650, "Authorised Signatory")],
+    ]
+
+def layout_pages(invoice):
+    """Splits the invoice into pages of text lines, each ending with a "Page x of y" line."""
+    rows = [list(zip(TABLE_COLUMNS, [str(item["serial_number"]), item["description"], item["hsn_sac"],
+                                     str(item["quantity"]), _money(item["unit_price"]), _money(item["total_amount"])]))
+            for item in invoice["items"]]
+    lines = _header_lines(invoice) + rows + _total_lines(invoice)
+    continuation = [[(0, invoice["supplier"])], [(0, f"Invoice No: {invoice['invoice_number']} (continued)")], []]
+
+    pages = [lines[:LINES_PER_PAGE]]
+    rest = lines[LINES_PER_PAGE:]
+    while rest:
+        body = LINES_PER_PAGE - CONTINUATION_LINES
+        pages.append(continuation + rest[:body])
+        rest = rest[body:]
+
+    return [page + [[], [(900, f"Page {number} of {len(pages)}")]] for number, page in enumerate(pages, start=1)]
+
+def page_text(lines):
+    """The text a perfect OCR pass would read from a page."""
+    return "\n".join(" ".join(text for _, text in line) for line in lines)
+
+def _draw_seal(draw, rng, font):
+    """Round company stamp with a scribbled signature over the signatory line."""
+    cx, cy = PAGE_SIZE[0] - MARGIN - 380, PAGE_SIZE[1] - MARGIN - 420
+    color = rng.choice([(30, 60, 170), (170, 30, 40), (90, 40, 140)])
+    for radius in (170, 150):
+        draw.ellipse([cx - radius, cy - radius, cx + radius, cy + radius], outline=color, width=6)
+    draw.text((cx, cy - 25), "SEAL", fill=color, font=font, anchor="mm")
+    draw.text((cx, cy + 25), "AUTHORISED", fill=color, font=font, anchor="mm")
+
+    x, y = cx + 150, cy + 80
+    points = [(x + step * 22, y + rng.randint(-35, 35)) for step in range(14)]
+    draw.line(points, fill=(20, 20, 90), width=5, joint="curve")
+
+def render_page(lines, rng, noise=0.0, skew=0.0, seal=False):
+    """Draws one page of text lines and applies the seal, skew and noise. Returns an RGB PIL image."""
+    image = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=FONT_SIZE)
+    title_font = ImageFont.load_default(size=TITLE_SIZE)
+
+    y = MARGIN
+    for line in lines:
+        is_title = line == [(0, "TAX INVOICE")]
+        for x, text in line:
+            draw.text((MARGIN + x, y), text, fill="black", font=title_font if is_title else font)
+        y += LINE_HEIGHT * (2 if is_title else 1)
+
+    if seal:
+        _draw_seal(draw, rng, font)
+
+    if skew:
+        image = image.rotate(skew, resample=Image.BICUBIC, fillcolor="white")
+
+    if noise:
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels += np.random.default_rng(rng.randint(0, 2 ** 32 - 1)).normal(0, noise * 255, pixels.shape[:2])[..., None]
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    return image
+
+def render_document(spec):
+    """Renders the pages described by a corpus entry (see generate_invoice_pdf) as PIL images."""
+    rng = random.Random(spec["seed"])
+    pages = layout_pages(spec["invoice"])
+    return [render_page(lines, rng, noise=spec["noise"], skew=spec["skew"],
+                        seal=spec["invoice"]["seal_and_sign_present"] and number == len(pages))
+            for number, lines in enumerate(pages, start=1)]
+
+def generate_invoice_pdf(path, seed, index=1, pages=1, noise=0.0, skew=0.0, seal=True):
+    """
+    Renders a synthetic GST invoice to `path` and writes its ground truth next to it (`<path>.json`):
+    the invoice data, per-page text and render settings. Returns the ground truth.
+    """
+    rng = random.Random(seed)
+    invoice = random_invoice(rng, index, pages, seal)
+    spec = {"seed": seed, "pages": pages, "noise": noise, "skew": skew, "invoice": invoice,
+            "page_texts": [page_text(lines) for lines in layout_pages(invoice)]}
+
+    images = render_document(spec)
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=RENDER_DPI)
+
+    spec["path"] = path
+    with open(f"{path}.json", "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=4)
+    return spec
+
+def generate_corpus(folder=CORPUS_FOLDER, count=CORPUS_SIZE, seed=0, min_pages=MIN_PAGES, max_pages=MAX_PAGES,
+                    max_noise=MAX_NOISE, max_skew=MAX_SKEW_DEGREES, seal_rate=SEAL_RATE):
+    """
+    Writes `count` synthetic invoice PDFs with random page counts, noise, skew and seals.
+    The same seed always produces the same corpus. Returns the ground truth of every PDF.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    corpus = []
+
+    for index in range(1, count + 1):
+        path = os.path.join(folder, f"synthetic_{index:04d}.pdf")
+        corpus.append(generate_invoice_pdf(path, seed=rng.randint(0, 2 ** 32 - 1), index=index,
+                                           pages=rng.randint(min_pages, max_pages),
+                                           noise=round(rng.uniform(0, max_noise), 4),
+                                           skew=round(rng.uniform(-max_skew, max_skew), 2),
+                                           seal=rng.random() < seal_rate))
+
+    print(f"Generated {count} synthetic invoices ({sum(spec['pages'] for spec in corpus)} pages) in {folder}")
+    return corpus
+
+def load_corpus(folder=CORPUS_FOLDER):
+    """Reads the ground truth of every PDF in a generated corpus."""
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".pdf.json"):
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                corpus.append(json.load(f))
+    return corpus
+
+if __name__ == "__main__":
+    generate_corpus()
@@ -0,0 +1,111 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.cache import make_key
+from utils.document import Page
+
+# A page's embedded text is used instead of OCR when it has at least this many characters...
+MIN_TEXT_CHARS = 40
+# ...and at least this share of them are letters, digits, spaces or common punctuation
+# (broken font encodings extract as symbols or U+FFFD instead)
+MIN_READABLE_RATIO = 0.9
+READABLE_PUNCTUATION = set(" .,:;-/()&#%@'\"+*=_")
+
+RENDER_DPI = 300        # Word boxes are scaled to the pixel grid of pages rendered at this DPI
+SEAL_RENDER_DPI = 150   # Resolution of the lazy render used only for seal detection
+LINE_OVERLAP = 0.5      # Words whose vertical centers are within this share of the word height share a line
+
+# Bump when text extraction changes so cached seal results of text-layer pages are not reused
+CACHE_VERSION = 1
+
+def is_readable(text):
+    """True if the extracted text is long enough and not mostly garbage glyphs."""
+    stripped = "".join(text.split())
+    if len(stripped) < MIN_TEXT_CHARS:
+        return False
+    readable = sum(1 for c in stripped if c.isalnum() or c in READABLE_PUNCTUATION)
+    return readable / len(stripped) >= MIN_READABLE_RATIO
+
+def _group_lines(boxes):
+    """
+    Assigns words to visual lines by their vertical position, so table cells that the PDF
+    stores as separate blocks still end up on one line. Returns lines of boxes sorted left to right.
+    """
+    lines = []
+    for box in sorted(boxes, key=lambda b: (b[1] + b[3]) / 2):
+        center, height = (box[1] + box[3]) / 2, box[3] - box[1]
+        if lines:
+            last = lines[-1]
+            last_center = sum((b[1] + b[3]) / 2 for b in last) / len(last)
+            if abs(center - last_center) <= max(height, 1) * LINE_OVERLAP:
+                last.append(box)
+                continue
+        lines.append([box])
+    return [sorted(line, key=lambda b: b[0]) for line in lines]
+
+def page_words(pdf_page, dpi=RENDER_DPI):
+    """
+    Returns (text, words) from a PyMuPDF page's text layer, in the shape `ocr_utils.extract_words`
+    produces: boxes in pixels at `dpi` and a confidence of 1.0 for every word.
+    """
+    scale = dpi / 72
+    words = []
+    lines = _group_lines(pdf_page.get_text("words"))
+
+    for line_number, line in enumerate(lines, start=1):
+        for x0, y0, x1, y1, text, *_ in line:
+            words.append({
+                "text": text,
+                "conf": 1.0,
+                "left": round(x0 * scale),
+                "top": round(y0 * scale),
+                "width": round((x1 - x0) * scale),
+                "height": round((y1 - y0) * scale),
+                "block": 1,
+                "par": 1,
+                "line": line_number,
+            })
+
+    text = "\n".join(" ".join(box[4] for box in line) for line in lines)
+    return text, words
+
+def extract_text_layer(pdf_path, content_hash=None):
+    """
+    Checks every page of a PDF for a usable text layer.
+    Returns one entry per page: a Page with its text and words for born-digital pages,
+    or None for pages that have to be rendered and OCR'd.
+    """
+    import pymupdf
+
+    filename = os.path.basename(pdf_path)
+    pages = []
+
+    with pymupdf.open(pdf_path) as document:
+        for page_number, pdf_page in enumerate(document, start=1):
+            start = time.perf_counter()
+            text, words = page_words(pdf_page)
+            if not is_readable(text):
+                pages.append(None)
+                continue
+
+            page = Page(source=filename, page_number=page_number, text=text, words=words,
+                        content_hash=content_hash, pdf_path=pdf_path, text_layer=True)
+            if content_hash is not None:
+                page.cache_key = make_key("text_layer", CACHE_VERSION, content_hash, page_number)
+            page.timings["text_layer"] = time.perf_counter() - start
+            pages.append(page)
+
+    return pages
+
+def render_page(pdf_path, page_number, dpi=SEAL_RENDER_DPI):
+    """Renders one PDF page with PyMuPDF and returns it as a BGR image."""
+    import pymupdf
+
+    with pymupdf.open(pdf_path) as document:
+        pixmap = document[page_number - 1].get_pixmap(dpi=dpi)
+
+    image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+    return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR if pixmap.n == 4 else cv2.COLOR_RGB2BGR)
@@ -1,19 +1,63 @@
+import gc
 import os
 import json
+from contextlib import contextmanager
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from utils.result_store import STORE_FOLDER, ResultStore
 
 # Define file paths
 EXTRACTED_DATA_FILE = "output/extracted_data.json"
 VERIFIABILITY_REPORT_FILE = "output/verifiability_report.json"
 
+# GST rate applied to line items, overridable per HSN/SAC prefix, e.g. GST_RATES_BY_HSN="8714=0.28,8708=0.28".
+# An invoice's own "gst_rate" field takes precedence over both.
+GST_RATE = float(os.getenv("GST_RATE", 0.18))
+GST_RATES_BY_HSN = os.getenv("GST_RATES_BY_HSN", "")
+
+CONFIDENCE_THRESHOLD = 0.85  # Fields below this are reported as low confidence
+TOLERANCE = 0.05             # Allowed rounding difference between calculated and extracted amounts
+
+REQUIRED_FIELDS = ["invoice_number", "invoice_date", "supplier_gst_number", "bill_to_gst_number", "po_number", "shipping_address", "seal_and_sign_present"]
+ITEM_CONFIDENCE_FIELDS = ["description", "hsn_sac", "quantity", "unit_price", "total_amount", "serial_number"]
+TOTAL_FIELDS = ["subtotal", "discount", "gst", "final_total"]
+ITEM_ROW_KEYS = ["row"] + [f"{field}_confidence" for field in ITEM_CONFIDENCE_FIELDS] + ["line_total_check"]
+CHECK_KEYS = ["calculated_value", "extracted_value", "check_passed"]
+TOTAL_CHECK_KEYS = [f"{field}_check" for field in TOTAL_FIELDS]
+
 def ensure_folder_exists(folder_path):
     """Creates a folder if it does not exist."""
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    os.makedirs(folder_path, exist_ok=True)  # No error when another process creates it at the same time
+
+def parse_gst_rates(spec=GST_RATES_BY_HSN):
+    """Parses "prefix=rate,prefix=rate" into a {HSN/SAC prefix: rate} dict."""
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, rate = entry.split("=")
+        rates[prefix.strip()] = float(rate)
+    return rates
+
+def gst_rate_for(hsn_sac, rates_by_hsn, default_rate=GST_RATE):
+    """GST rate of the longest matching HSN/SAC prefix, or the default rate."""
+    code = str(hsn_sac or "").replace(" ", "")
+    for length in range(len(code), 0, -1):
+        if code[:length] in rates_by_hsn:
+            return rates_by_hsn[code[:length]]
+    return default_rate
 
 def calculate_confidence(value, ocr_confidence=0.0, seal_present=False):
-    """Uses OCR confidence scores if available, otherwise estimates based on presence."""
+    """
+    Uses OCR confidence scores if available, otherwise estimates based on presence.
+    For the seal field `ocr_confidence` is the highest detection score (None if the pages were never
+    checked): a detected seal is as confident as its score, a missing one as unlikely as the best score.
+    """
     if seal_present:
-        return 0.8 if value else 0.5  # Boost confidence when seal is detected
+        if value:
+            return round(ocr_confidence, 2) if ocr_confidence else 0.8  # Boost confidence when seal is detected
+        return round(1.0 - ocr_confidence, 2) if ocr_confidence is not None else 0.5
     if ocr_confidence:
         return round(ocr_confidence, 2)  # Use OCR confidence directly
     return round(min(0.5 + (len(str(value)) * 0.05), 0.99), 2) if value else 0.5  # Fallback estimation
@@ -23,105 +67,282 @@ def validate_line_total(item):
     calculated_value = round(item["quantity"] * item["unit_price"], 2)  # Ensure rounding
     extracted_value = round(item["total_amount"], 2)  # Ensure rounding
 
-    check_passed = abs(calculated_value - extracted_value) < 0.05  # Allow minor rounding differences
+    check_passed = abs(calculated_value - extracted_value) < TOLERANCE  # Allow minor rounding differences
 
     return {"calculated_value": calculated_value, "extracted_value": extracted_value, "check_passed": check_passed}
 
-def validate_totals(invoice_data):
-    """Verifies subtotal, discount, GST, and final total calculations."""
+def validate_totals(invoice_data, gst_rate=GST_RATE):
+    """Verifies subtotal, discount, GST, and final total calculations for a single invoice."""
     subtotal = sum(item["total_amount"] for item in invoice_data.get("items", []))  # Ensure "items" exists
     discount = invoice_data.get("discount", 0)
-    gst = round(subtotal * 0.18, 2)  # Assuming 18% GST
+    gst = round(subtotal * invoice_data.get("gst_rate", gst_rate), 2)
     final_total = subtotal + gst - discount
 
-    return {
-        "subtotal_check": {"calculated_value": subtotal, "extracted_value": invoice_data.get("subtotal", subtotal), "check_passed": subtotal == invoice_data.get("subtotal", subtotal)},
-        "discount_check": {"calculated_value": discount, "extracted_value": invoice_data.get("discount", discount), "check_passed": discount == invoice_data.get("discount", discount)},
-        "gst_check": {"calculated_value": gst, "extracted_value": invoice_data.get("gst", gst), "check_passed": gst == invoice_data.get("gst", gst)},
-        "final_total_check": {"calculated_value": final_total, "extracted_value": invoice_data.get("final_total", final_total), "check_passed": final_total == invoice_data.get("final_total", final_total)}
-    }
+    calculated = {"subtotal": subtotal, "discount": discount, "gst": gst, "final_total": final_total}
+    return {f"{field}_check": _check(value, invoice_data.get(field, value)) for field, value in calculated.items()}
 
-def generate_verifiability_report():
-    """Generates a JSON report verifying extracted invoice data from `extracted_data.json`."""
-    ensure_folder_exists("output")
+def _numbers(values):
+    """Converts parsed values (numbers, "1,234.50" strings, None) to a float array; unreadable values become NaN."""
+    try:
+        return np.array(values, dtype=float)  # Fast path: plain numbers and None
+    except (TypeError, ValueError):
+        pass
+    series = pd.Series(values, dtype=object)
+    strings = series.map(lambda v: v.replace(",", "") if isinstance(v, str) else v)
+    return pd.to_numeric(strings, errors="coerce").to_numpy(dtype=float)
+
+def _confidences(values, ocr_confidences, seal_present=False):
+    """
+    Vectorized `calculate_confidence` over one column of values and their OCR confidences
+    (detection scores for the seal field, NaN where never checked). Returns (confidences, present) arrays.
+    """
+    values = np.fromiter(values, dtype=object, count=len(values))
+    present = values.astype(bool)
+    scores = _numbers(ocr_confidences)
+    ocr = np.nan_to_num(scores)
+    if seal_present:
+        absent = np.where(np.isnan(scores), 0.5, np.round(1.0 - ocr, 2))
+        return np.where(present, np.where(ocr != 0, np.round(ocr, 2), 0.8), absent), present
+
+    confidences = np.where(ocr != 0, np.round(ocr, 2), 0.5)
+
+    # Values without an OCR confidence are estimated from their length
+    estimate = np.flatnonzero(present & (ocr == 0))
+    lengths = pd.Series(values[estimate], dtype=object).astype(str).str.len().to_numpy(dtype=float)
+    confidences[estimate] = np.round(np.minimum(0.5 + lengths * 0.05, 0.99), 2)
+    return confidences, present
+
+def _json_values(array):
+    """Array → list for the JSON report, with NaN (unreadable numbers) as null."""
+    return [None if value != value else value for value in array.tolist()]
+
+def _check(calculated, extracted):
+    return {"calculated_value": calculated, "extracted_value": extracted,
+            "check_passed": calculated is not None and extracted is not None and abs(calculated - extracted) < TOLERANCE}
+
+@contextmanager
+def _gc_paused():
+    """
+    Pauses the cyclic garbage collector while the report's millions of row dicts are built; they all
+    stay alive, so every collection it would trigger meanwhile rescans them for nothing.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _page_names(invoice_data):
+    """Seal manifest keys of an invoice's pages, e.g. sample_invoice.pdf_page_1."""
+    return [f"{invoice_data.get('source_file')}_page_{page}" for page in invoice_data.get("pages") or []]
+
+def build_verifiability_report(invoices, gst_rate=GST_RATE, gst_rates_by_hsn=None, seal_manifest=None):
+    """
+    Builds the verifiability report for parsed invoices (a list, or any iterable such as a ResultStore).
+    Invoices are read once into columns; confidences and line-total, subtotal, GST and final-total
+    checks are then computed for all invoices and line items at once with NumPy.
+    Invoices parsed without a seal score look it up in `seal_manifest` (utils.seal_manifest), if given.
+    """
+    gst_rates_by_hsn = parse_gst_rates() if gst_rates_by_hsn is None else gst_rates_by_hsn
+
+    # One pass over the invoices, collecting invoice and line-item columns
+    entries = []                                        # ("error", message) or ("invoice", invoice row) in input order
+    invoice_numbers = []
+    fields = {field: [] for field in REQUIRED_FIELDS}
+    field_ocr = {field: [] for field in REQUIRED_FIELDS}
+    totals = {field: [] for field in TOTAL_FIELDS}
+    invoice_rates, item_counts, all_items = [], [], []
+
+    for invoice_data in invoices:
+        if "error" in invoice_data:
+            entries.append(("error", invoice_data["error"]))
+            continue
+
+        entries.append(("invoice", len(item_counts)))
+        invoice_numbers.append(invoice_data.get("invoice_number", "Unknown"))
+        for field in REQUIRED_FIELDS:
+            fields[field].append(invoice_data.get(field, ""))
+            field_ocr[field].append(invoice_data.get(f"{field}_confidence", 0.0))
+        # Seal scores stay None (NaN) when never checked: 0.0 means checked and nothing found
+        field_ocr["seal_and_sign_present"][-1] = invoice_data.get("seal_and_sign_present_confidence")
+        if seal_manifest is not None and field_ocr["seal_and_sign_present"][-1] is None:
+            field_ocr["seal_and_sign_present"][-1] = seal_manifest.seal_score(_page_names(invoice_data))
+        for field in TOTAL_FIELDS:
+            totals[field].append(invoice_data.get(field))
+        invoice_rates.append(invoice_data.get("gst_rate"))
 
-    if not os.path.exists(EXTRACTED_DATA_FILE):
-        print(f"Error: `{EXTRACTED_DATA_FILE}` not found!")
-        return
-    
-    with open(EXTRACTED_DATA_FILE, "r", encoding="utf-8") as f:
-        invoices = json.load(f)
+        invoice_items = invoice_data.get("items") or []
+        item_counts.append(len(invoice_items))
+        all_items.extend(invoice_items)
 
+    # Item columns are read with C-level maps instead of a Python comprehension per element
+    items = {field: list(map(dict.get, all_items, repeat(field))) for field in ITEM_CONFIDENCE_FIELDS}
+    item_ocr = {field: list(map(dict.get, all_items, repeat(f"{field}_confidence"), repeat(0.0)))
+                for field in ITEM_CONFIDENCE_FIELDS}
+    del all_items
+
+    # Field confidences for every invoice at once
+    field_confidence, field_present = {}, {}
+    for field in REQUIRED_FIELDS:
+        field_confidence[field], field_present[field] = _confidences(
+            fields[field], field_ocr[field], seal_present=field == "seal_and_sign_present")
+
+    # Line items: confidences and quantity × unit price checks
+    item_confidence = {field: _confidences(items[field], item_ocr[field])[0] for field in ITEM_CONFIDENCE_FIELDS}
+    quantity, unit_price, total_amount = (_numbers(items[field]) for field in ("quantity", "unit_price", "total_amount"))
+    line_calculated = np.round(quantity * unit_price, 2)
+    line_extracted = np.round(total_amount, 2)
+    line_passed = np.abs(line_calculated - line_extracted) < TOLERANCE
+
+    # Invoice totals, summing line items per invoice with their GST rate
+    item_counts = np.array(item_counts, dtype=int)
+    invoice_index = np.repeat(np.arange(len(item_counts)), item_counts)
+    hsn_codes = pd.Series(items["hsn_sac"], dtype=object).astype(str)
+    item_rates = hsn_codes.map({code: gst_rate_for(code, gst_rates_by_hsn, gst_rate) for code in hsn_codes.unique()})
+    invoice_rate = _numbers(invoice_rates)
+    item_rates = np.where(np.isnan(invoice_rate[invoice_index]), item_rates.to_numpy(dtype=float), invoice_rate[invoice_index])
+
+    subtotal = np.bincount(invoice_index, weights=total_amount, minlength=len(item_counts))
+    gst = np.round(np.bincount(invoice_index, weights=total_amount * item_rates, minlength=len(item_counts)), 2)
+    extracted_totals = {field: _numbers(values) for field, values in totals.items()}
+    discount = np.nan_to_num(extracted_totals["discount"])
+    final_total = np.round(subtotal + gst - discount, 2)
+    calculated_totals = {"subtotal": subtotal, "discount": discount, "gst": gst, "final_total": final_total}
+    for field in TOTAL_FIELDS:
+        # Totals the invoice does not state are taken as calculated
+        missing = np.array([value is None for value in totals[field]], dtype=bool)
+        extracted_totals[field] = np.where(missing, calculated_totals[field], extracted_totals[field])
+
+    # Assemble the report in input order
     report_data = {
         "field_verification": {},
         "line_items_verification": {},
         "total_calculations_verification": {},
         "summary": {"all_fields_confident": True, "all_line_items_verified": True, "totals_verified": True, "issues": []}
     }
+    summary, issues = report_data["summary"], report_data["summary"]["issues"]
 
-    for invoice_data in invoices:
-        # Check for errors in the invoice data
-        if "error" in invoice_data:
-            report_data["summary"]["issues"].append(f"Skipping invoice due to error: {invoice_data['error']}")
-            continue  # Skip this invoice
-
-        # Field verification stored separately for each invoice
-        invoice_number = invoice_data.get("invoice_number", "Unknown")
-        report_data["field_verification"][invoice_number] = {}
-
-        required_fields = ["invoice_number", "invoice_date", "supplier_gst_number", "bill_to_gst_number", "po_number", "shipping_address", "seal_and_sign_present"]
-        for field in required_fields:
-            value = invoice_data.get(field, "")
-            ocr_confidence = invoice_data.get(f"{field}_confidence", 0.0)
-            seal_present = invoice_data.get("seal_and_sign_present", False) if field == "seal_and_sign_present" else False
-            confidence = calculate_confidence(value, ocr_confidence, seal_present)
-
-            report_data["field_verification"][invoice_number][field] = {
-                "confidence": confidence,
-                "present": bool(value)
-            }
+    with _gc_paused():
+        field_columns = {field: (field_confidence[field].tolist(), field_present[field].tolist(),
+                                 (field_confidence[field] < CONFIDENCE_THRESHOLD).tolist()) for field in REQUIRED_FIELDS}
+        item_starts = np.concatenate(([0], np.cumsum(item_counts)))
+        row_numbers = np.arange(len(invoice_index)) - item_starts[invoice_index] + 1
+        line_failures = np.flatnonzero(~line_passed)
+        failed_invoices = np.bincount(invoice_index[line_failures], minlength=len(item_counts)).astype(bool).tolist()
+        item_starts, item_counts = item_starts.tolist(), item_counts.tolist()
+
+        # Report rows are zipped from the NumPy columns by C-level maps, without Python code per row
+        line_checks = map(dict, map(zip, repeat(CHECK_KEYS), zip(_json_values(line_calculated),
+                                                                 _json_values(line_extracted), line_passed.tolist())))
+        item_rows = list(map(dict, map(zip, repeat(ITEM_ROW_KEYS),
+                                       zip(row_numbers.tolist(),
+                                           *(item_confidence[field].tolist() for field in ITEM_CONFIDENCE_FIELDS),
+                                           line_checks))))
+        total_checks, totals_passed = [], np.ones(len(item_counts), dtype=bool)
+        for field in TOTAL_FIELDS:
+            calculated, extracted = calculated_totals[field], extracted_totals[field]
+            passed = np.abs(calculated - extracted) < TOLERANCE  # False when either is NaN (unreadable)
+            totals_passed &= passed
+            total_checks.append(list(map(dict, map(zip, repeat(CHECK_KEYS), zip(_json_values(calculated),
+                                                                                _json_values(extracted),
+                                                                                passed.tolist())))))
+        total_checks = list(map(dict, map(zip, repeat(TOTAL_CHECK_KEYS), zip(*total_checks))))
+        totals_passed = totals_passed.tolist()
 
-            if confidence < 0.85 and f"Low confidence in {field}" not in report_data["summary"]["issues"]:
-                report_data["summary"]["issues"].append(f"Low confidence in {field}: {confidence}")
-                report_data["summary"]["all_fields_confident"] = False
-
-        # Handle invoices that may not have "items"
-        if "items" not in invoice_data or not invoice_data["items"]:
-            report_data["summary"]["issues"].append(f"Invoice {invoice_number} has no line items!")
-            report_data["summary"]["all_line_items_verified"] = False
-            continue  # Skip processing for invoices missing "items"
-
-        # Line items verification stored separately per invoice
-        report_data["line_items_verification"][invoice_number] = []
-
-        for index, item in enumerate(invoice_data["items"], start=1):
-            line_item_verification = {
-                "row": index,
-                "description_confidence": calculate_confidence(item.get("description"), item.get("description_confidence", 0.0)),
-                "hsn_sac_confidence": calculate_confidence(item.get("hsn_sac"), item.get("hsn_sac_confidence", 0.0)),
-                "quantity_confidence": calculate_confidence(item.get("quantity"), item.get("quantity_confidence", 0.0)),
-                "unit_price_confidence": calculate_confidence(item.get("unit_price"), item.get("unit_price_confidence", 0.0)),
-                "total_amount_confidence": calculate_confidence(item.get("total_amount"), item.get("total_amount_confidence", 0.0)),
-                "serial_number_confidence": calculate_confidence(item.get("serial_number"), item.get("serial_number_confidence", 0.0)),
-                "line_total_check": validate_line_total(item)
+        for kind, value in entries:
+            if kind == "error":
+                issues.append(f"Skipping invoice due to error: {value}")
+                continue
+
+            i = value
+            invoice_number = invoice_numbers[i]
+
+            report_data["field_verification"][invoice_number] = {
+                field: {"confidence": field_columns[field][0][i], "present": field_columns[field][1][i]}
+                for field in REQUIRED_FIELDS
             }
-            report_data["line_items_verification"][invoice_number].append(line_item_verification)
+            for field in REQUIRED_FIELDS:
+                if field_columns[field][2][i]:
+                    issues.append(f"Low confidence in {field}: {field_columns[field][0][i]}")
+                    summary["all_fields_confident"] = False
+
+            if not item_counts[i]:
+                issues.append(f"Invoice {invoice_number} has no line items!")
+                summary["all_line_items_verified"] = False
+                continue
+
+            start, end = item_starts[i], item_starts[i + 1]
+            report_data["line_items_verification"][invoice_number] = item_rows[start:end]
+
+            # Failed rows of this invoice, found by binary search in the sorted failure positions
+            if failed_invoices[i]:
+                for j in line_failures[np.searchsorted(line_failures, start):np.searchsorted(line_failures, end)].tolist():
+                    issues.append(f"Line total mismatch in row {j - start + 1}")
+                summary["all_line_items_verified"] = False
+
+            report_data["total_calculations_verification"][invoice_number] = total_checks[i]
+            if not totals_passed[i]:
+                issues.append(f"Total calculations mismatch in invoice {invoice_number}")
+                summary["totals_verified"] = False
+
+    return report_data
+
+def merge_verifiability_reports(report, update):
+    """
+    Merges the report of a later batch into an earlier one: invoices in `update` replace those with
+    the same number, its issues are appended, and the summary flags are recomputed over every invoice.
+    """
+    merged = {section: {**report.get(section, {}), **update[section]}
+              for section in ("field_verification", "line_items_verification", "total_calculations_verification")}
+    fields = merged["field_verification"]
+    line_items = merged["line_items_verification"]
+    merged["summary"] = {
+        "all_fields_confident": all(not entry["confidence"] < CONFIDENCE_THRESHOLD
+                                    for invoice in fields.values() for entry in invoice.values()),
+        "all_line_items_verified": all(number in line_items for number in fields) and
+                                   all(row["line_total_check"]["check_passed"]
+                                       for rows in line_items.values() for row in rows),
+        "totals_verified": all(check["check_passed"] for checks in merged["total_calculations_verification"].values()
+                               for check in checks.values()),
+        "issues": report.get("summary", {}).get("issues", []) + update["summary"]["issues"],
+    }
+    return merged
+
+def generate_verifiability_report(invoices=None, seal_manifest=None, merge=False):
+    """
+    Generates a JSON report verifying extracted invoice data.
+    Uses the given invoices (a list or a ResultStore) when called in-process; otherwise streams
+    the result store, or reads `extracted_data.json` when there is no store yet.
+    With `merge`, the report is merged into the existing report file instead of replacing it
+    (see `merge_verifiability_reports`), so batches of a watched folder add up.
+    """
+    ensure_folder_exists("output")
+
+    if invoices is None and os.path.exists(STORE_FOLDER):
+        invoices = ResultStore()
+
+    if invoices is None:
+        if not os.path.exists(EXTRACTED_DATA_FILE):
+            print(f"Error: `{EXTRACTED_DATA_FILE}` not found!")
+            return
+
+        with open(EXTRACTED_DATA_FILE, "r", encoding="utf-8") as f:
+            invoices = json.load(f)
 
-            if not line_item_verification["line_total_check"]["check_passed"]:
-                report_data["summary"]["issues"].append(f"Line total mismatch in row {index}")
-                report_data["summary"]["all_line_items_verified"] = False
+    report_data = build_verifiability_report(invoices, seal_manifest=seal_manifest)
 
-        # Total calculations verification stored per invoice
-        report_data["total_calculations_verification"][invoice_number] = validate_totals(invoice_data)
-        if not all(v["check_passed"] for v in report_data["total_calculations_verification"][invoice_number].values()):
-            report_data["summary"]["issues"].append(f"Total calculations mismatch in invoice {invoice_number}")
-            report_data["summary"]["totals_verified"] = False
+    if merge and os.path.exists(VERIFIABILITY_REPORT_FILE):
+        with open(VERIFIABILITY_REPORT_FILE, "r", encoding="utf-8") as f:
+            report_data = merge_verifiability_reports(json.load(f), report_data)
 
     # Save verification report
     with open(VERIFIABILITY_REPORT_FILE, "w", encoding="utf-8") as f:
         json.dump(report_data, f, indent=4)
 
     print(f"Verifiability Report saved: {VERIFIABILITY_REPORT_FILE}")
+    return report_data
 
 # Execute validator
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+class InlineExecutor:
+    """Runs tasks in the calling process; used instead of a pool when workers=1."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def make_executor(workers, initializer=None):
+    """Returns a process pool for `workers` > 1, otherwise an InlineExecutor."""
+    if workers <= 1:
+        return InlineExecutor()
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """
+    Like executor.map, but submits at most `max_in_flight` tasks ahead of the consumer
+    so arguments and results never pile up in memory. Yields (item, future) in input order.
+    """
+    in_flight = deque()
+
+    for item in items:
+        in_flight.append((item, executor.submit(fn, item)))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft()
+
+    while in_flight:
+        yield in_flight.popleft()